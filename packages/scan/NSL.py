@@ -10,6 +10,12 @@ http://docs.astropy.org/en/stable/coordinates/index.html#module-astropy.coordina
 
 import frame_transformations as ft
 from quaternion import Quaternion
+from attitude_table import AttitudeTable
+from attitude_store import MultiResolutionStore
+from attitude_cache import AttitudeCache
+from observation_table import ObservationTable
+from scan_frames import FrameCache
+import propagator
 
 import numpy as np
 import time
@@ -88,9 +94,27 @@ class Satellite:
         self.wz = wz * (60 * 60 * 24. / 206264.8062470946)  # to [rad/day]
 
 class Attitude(Satellite):
+    """
+    Attitude of the satellite sampled between ti and tf.
+    Args:
+        ti (float): initial time [days].
+        tf (float): final time [days].
+        dt (float): step of the samples [days].
+        integrator (str): 'euler' (first order, as .update()), 'rk4' or 'dopri'.
+        cache (AttitudeCache): if given, the attitude is loaded from this cache when it
+            was computed before with the same parameters, and stored in it otherwise.
+    Attributes:
+        storage (AttitudeTable): samples (t, w, z, x, q) of the attitude.
+        store (MultiResolutionStore): coarse storage and its refined windows.
+        solution (DenseSolution): continuous attitude of the last 'rk4'/'dopri' integration.
+    """
 
-    def __init__(self, ti, tf, dt):
+    def __init__(self, ti, tf, dt, integrator='euler', cache=None):
         Satellite.__init__(self)
+        if integrator not in propagator.INTEGRATORS:
+            raise ValueError("unknown integrator %r, expected one of %r" % (integrator, propagator.INTEGRATORS))
+        self.integrator = integrator
+        self.solution = None
         self.empty()
         self.t = 0
         self.lambda_ = 0
@@ -112,11 +136,29 @@ class Attitude(Satellite):
 
         q_total = q1 * q2 * q3 * q4 * q5
         self.attitude = q_total * Quaternion(0, 0, 0, 1) * q_total.conjugate()
-
+        if integrator != 'euler':
+            # Higher order integrators carry the attitude through the scanning law angles,
+            # so they start from the attitude q_total and the z-axis it defines.
+            self.z_ = self.attitude.to_vector()
+            self.attitude = q_total
+            self.x_ = (q_total * Quaternion(0, 1, 0, 0) * q_total.conjugate()).to_vector()
+
+        if cache is not None and cache.restore(self, ti, tf, dt):
+            return
         self.create_storage(ti, tf, dt)
+        if cache is not None:
+            cache.save(self, ti, tf, dt)
+
+    @property
+    def storage(self):
+        return self.store.table
+
+    @storage.setter
+    def storage(self, table):
+        self.store = MultiResolutionStore(table)
 
     def empty(self):
-        self.storage = []
+        self.storage = AttitudeTable.empty()
 
     def update(self, dt):
         """
@@ -164,7 +206,7 @@ class Attitude(Satellite):
         z_dot_ = np.cross(self.k_, self.z_) * self.lambda_dot + np.cross(self.s_, self.z_) * nu_dot
         dz_ = z_dot_ * dt
         self.z_ = self.z_ + dz_
-        self.z_ = self.z_ / np.linalg.linalg.norm(self.z_)
+        self.z_ = self.z_ / np.linalg.norm(self.z_)
 
         # Updates inertial rotation vector
         self.w_ = self.k_ * self.lambda_dot + self.s_ * nu_dot + self.z_ * omega_dot
@@ -187,35 +229,78 @@ class Attitude(Satellite):
             tf (float): integrating time upper limit [days]
             dt (float): step discretness of integration.
         Notes:
-            The data is stored in satellite.storing_list
+            The data is stored in satellite.storage, an AttitudeTable with columns
+            (t, w, z, x, q). The steps are integrated by the compiled kernels in
+            propagator; with the 'euler' integrator this is equivalent to calling
+            .update(dt) in a loop.
         '''
+        self.storage = self.storage.merge(propagator.propagate(self, ti, tf, dt))
 
-        self.t = ti
-        n_steps = (tf - ti) / dt
-        for i in np.arange(n_steps):
-            self.update(dt)
-            self.storage.append([self.t, self.w_, self.z_, self.x_, self.attitude])
+    def refine(self, ti, tf, dt):
+        '''
+        Adds samples every dt between ti and tf to the storage, without changing the
+        current state of the attitude. Each refined window starts from the state
+        interpolated from the storage, replaces the coarser samples it covers, and
+        parts of [ti, tf] refined before are not integrated again.
+        Args:
+            ti (float): start of the refined window [days]
+            tf (float): end of the refined window [days]
+            dt (float): step of the refined samples [days]
+        '''
+        self.store.refine(self, ti, tf, dt)
 
-        self.storage.sort(key=lambda x: x[0])
+    def iter_storage(self, ti, tf, dt, chunk_size=100000):
+        '''
+        Integrates the attitude like create_storage, but yields the samples in chunks
+        instead of keeping them in the storage, so that a whole mission can be consumed
+        with constant memory.
+        Args:
+            ti (float): integrating time lower limit [days]
+            tf (float): integrating time upper limit [days]
+            dt (float): step discretness of integration.
+            chunk_size (int): number of samples per chunk.
+        Yields:
+            AttitudeTable: the next (at most) chunk_size samples, with columns (t, q, z, x, w).
+        Notes:
+            The integration state is carried across chunks, so the concatenated chunks
+            are the samples create_storage(ti, tf, dt) would store.
+        '''
+        remaining = propagator.n_steps(ti, tf, dt)
+        t = ti
+        while remaining > 0:
+            n = min(chunk_size, remaining)
+            chunk = propagator.propagate(self, t, tf, dt, n)
+            t = self.t
+            remaining -= n
+            yield chunk
 
     def reset_to_time(self, t):
         '''
         Resets satellite to time t, along with all the parameters corresponding to that time.
+        The samples around t are found by binary search in the storage and interpolated
+        (SLERP for the attitude quaternion).
         Args:
             t (float): time from J2000 [days]
         '''
+        row = self.storage.interpolate(t)
+        self.t = t
+        self.w_ = row.w[0]
+        self.z_ = row.z[0]
+        self.x_ = row.x[0]
+        self.lambda_, self.nu, self.omega = row.angles[0]
+        self.s_ = self.l_ * np.cos(self.lambda_) + self.j_ * np.sin(self.lambda_)
+        self.attitude = row[0][4]
 
-        temp_list = [obj for obj in self.storage if obj[0] <= t]
-        list_element = temp_list[-1]
-        self.t = list_element[0]
-        self.w_ = list_element[1]
-        self.z_ = list_element[2]
-        self.x_ = list_element[3]
-        self.attitude = list_element[4]
-
-        # Account for decimal loss difference from discreteness from NM.
-        delta_t = t % self.t
-        self.update(delta_t)
+    def attitude_at(self, times, method='slerp'):
+        '''
+        Attitude interpolated from the storage at many times at once.
+        Args:
+            times (np.ndarray): times from J2000 [days]
+            method (str): 'slerp' or 'hermite', see AttitudeTable.attitude_at.
+        Returns:
+            np.ndarray: (N, 4) quaternions (w, x, y, z).
+        '''
+        return self.storage.attitude_at(times, method)
 
 class Scanner:
     """
@@ -228,6 +313,9 @@ class Scanner:
         times_to_scan_star (list of floats): times where star within CCD field of view.
         obs_times (list of floats): times from J2000 at which the star is inside of the line of intercept.
         stars_positions (list of arrays): positions calculated from obs_times of transits using satellite's attitude.
+        observations (ObservationTable): the transits of all the stars scanned since the last empty().
+        frame_cache (FrameCache): rotation matrices and field of view at the samples of the
+            attitude last scanned.
     """
 
     def __init__(self, ccd=0.2, delta_z=0.15, delta_y=0.01):
@@ -239,6 +327,8 @@ class Scanner:
 
         self.obs_times = []
         self.stars_positions = []
+        self.observations = ObservationTable.empty()
+        self.frame_cache = FrameCache()
 
     def empty(self):
         """
@@ -247,6 +337,14 @@ class Scanner:
         self.obs_times = []
         self.stars_positions = []
         self.times_deep_scan = []
+        self.observations = ObservationTable.empty()
+
+    def frames(self, att):
+        """
+        :param att: attitude object.
+        :return: ScanFrames of att.storage for this field of view, computed once per attitude table.
+        """
+        return self.frame_cache.frames(att, self.ccd, self.delta_z)
 
     def intercept(self, att, star):
         """
@@ -254,25 +352,17 @@ class Scanner:
         :param attitude: contains storage list.
         :return: populates scanner.times_to_scan list, before deep_scan is executed.
         """
-        self.empty()         # careful for when there are more than one star.
-        for obj in att.storage:
-            t = obj[0]
-            attitude = obj[4]
-            x_telescope1 = obj[3]
-
-            x_srs_telescope1 = ft.srs(attitude, x_telescope1)
-
-            star_coor_srs = ft.srs(attitude, star.coor)
-            xy_proy_star_srs = np.array([star_coor_srs[0], star_coor_srs[1], 0])
-            xz_proy_star_srs = np.array([star_coor_srs[0], 0, star_coor_srs[2]])
-
-            width_angle = 2 * np.arctan2(self.ccd / 2, x_srs_telescope1[0])
-            aperture_angle = 2 * np.arctan2(self.delta_z / 2, x_srs_telescope1[0])
-
-            if np.arccos(np.dot(xy_proy_star_srs, x_srs_telescope1)) < width_angle:
-                if np.arccos(np.dot(xz_proy_star_srs, x_srs_telescope1)) < aperture_angle:
-                    self.times_deep_scan.append(t)
-                    self.times_deep_scan.sort()
+        self.times_deep_scan = []   # the transits of the previous stars are kept.
+        frames = self.frames(att)
+        x_srs_telescope1 = frames.x_srs
+        star_coor_srs = frames.srs(star.coor)
+
+        # projections of the star on the xy and xz planes of the SRS.
+        xy_dot = star_coor_srs[:, 0] * x_srs_telescope1[:, 0] + star_coor_srs[:, 1] * x_srs_telescope1[:, 1]
+        xz_dot = star_coor_srs[:, 0] * x_srs_telescope1[:, 0] + star_coor_srs[:, 2] * x_srs_telescope1[:, 2]
+        with np.errstate(invalid='ignore'):
+            mask = (np.arccos(xy_dot) < frames.width_angle) & (np.arccos(xz_dot) < frames.aperture_angle)
+        self.times_deep_scan = list(frames.t[mask])
 
     def deep_scan(self, att, deep_dt=0.001):
         """
@@ -282,7 +372,7 @@ class Scanner:
         :param deep_dt: new step dt fur higher numerical method precision.
         """
         for t in self.times_deep_scan:
-            att.create_storage(t - 0.5, t + 0.5, deep_dt)
+            att.refine(t - 0.5, t + 0.5, deep_dt)
 
 
 def star_finder(scanner, att, sky):
@@ -294,38 +384,50 @@ def star_finder(scanner, att, sky):
     :param sky: sky to be scanned.
     :return:
     """
-    for star in sky.elements:
+    transits = []
+    for source_id, star in enumerate(sky.elements):
         scanner.intercept(att, star)
         scanner.deep_scan(att)
 
-        for obj in att.storage:
-            t = obj[0]
-            attitude = obj[4]
-            x_telescope1 = obj[3]
-
-            # change frame to SRS for scanning.
-            x_srs_telescope1 = ft.srs(attitude, x_telescope1)
-            star_srs_coor = ft.srs(attitude, star.coor)
-
-            # scanner parameters
-            aperture_angle = np.arctan2(scanner.delta_z / 2, x_srs_telescope1[0])
-
-            # condition for x axis:
-            if np.arccos(np.dot(star_srs_coor, x_srs_telescope1)) < aperture_angle:
-                # condition for z axis
-                if np.abs(star_srs_coor[2] - x_srs_telescope1[2]) < scanner.delta_z:
-                    # condition for y axis:
-                    if np.abs(star_srs_coor[1] - x_srs_telescope1[1]) < scanner.delta_y:
-                        scanner.obs_times.append(t)
-                        scanner.stars_positions.append(ft.bcrs(attitude, x_srs_telescope1))
-
-
-def run():
+        # change frame to SRS for scanning.
+        frames = scanner.frames(att)
+        x_srs_telescope1 = frames.x_srs
+        star_srs_coor = frames.srs(star.coor)
+        aperture_angle = frames.half_aperture
+
+        # conditions for the x, z and y axis:
+        with np.errstate(invalid='ignore'):
+            mask = np.arccos(np.einsum('ij,ij->i', star_srs_coor, x_srs_telescope1)) < aperture_angle
+        mask &= np.abs(star_srs_coor[:, 2] - x_srs_telescope1[:, 2]) < scanner.delta_z
+        mask &= np.abs(star_srs_coor[:, 1] - x_srs_telescope1[:, 1]) < scanner.delta_y
+        rows = np.flatnonzero(mask)
+
+        if len(rows):
+            star_srs = star_srs_coor[rows]
+            positions = ft.bcrs_batch(frames.q[rows], x_srs_telescope1[rows])
+            scanner.obs_times.extend(frames.t[rows])
+            scanner.stars_positions.extend(positions)
+            transits.append((source_id, frames.t[rows],
+                             np.arctan2(star_srs[:, 1], star_srs[:, 0]),
+                             np.arctan2(star_srs[:, 2], np.hypot(star_srs[:, 0], star_srs[:, 1])),
+                             positions))
+
+    # the deep scans of the next stars insert samples in the attitude table, so the rows
+    # of the transits are only known once all the stars are scanned.
+    for source_id, times, along_scan, across_scan, positions in transits:
+        scanner.observations.append(source_id, times, along_scan, across_scan, positions,
+                                    att.storage.index_of(times))
+
+
+def run(cache=None):
+    """
+    :param cache: AttitudeCache to load the attitude from, the default cache if None.
+    """
     start_time = time.time()
 
     sky = Sky(1)
     scan = Scanner()
-    att = Attitude(0, 365, 0.01)
+    att = Attitude(0, 365, 0.01, cache=AttitudeCache() if cache is None else cache)
     star_finder(scan, att, sky)
 
     seconds = time.time() - start_time
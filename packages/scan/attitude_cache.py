@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of propagated attitudes.
+
+An entry is a directory named after a hash of the scanning law parameters
+(S, epsilon, xi, wz, ti, tf, dt, integrator). It holds one .npy file per column
+of the AttitudeTable, the final integration state and, for 'rk4' and 'dopri',
+the dense output. Columns are loaded memory-mapped, so a cached multi-year
+attitude opens in milliseconds and processes reading the same entry share
+one copy of it in the page cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from attitude_table import AttitudeTable
+from quaternion import Quaternion
+import propagator
+
+# Bump when the layout of an entry or the propagation changes.
+FORMAT_VERSION = 1
+
+DEFAULT_DIRECTORY = os.environ.get('GAIALAB_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.gaialab', 'attitude_cache'))
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+
+PARAMETERS = ('S', 'epsilon', 'xi', 'wz', 'ti', 'tf', 'dt', 'integrator')
+
+
+class AttitudeCache:
+    """
+    Content addressed store of attitude tables.
+
+    Args:
+        directory (str): where the entries are kept, created if needed.
+        max_bytes (int): total size of the entries above which the least recently
+            used ones are evicted.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def parameters(att, ti, tf, dt):
+        """
+        Scanning law parameters identifying the attitude of att between ti and tf.
+        """
+        return {'S': float(att.S), 'epsilon': float(att.epsilon), 'xi': float(att.xi),
+                'wz': float(att.wz), 'ti': float(ti), 'tf': float(tf), 'dt': float(dt),
+                'integrator': getattr(att, 'integrator', 'euler')}
+
+    @staticmethod
+    def key(parameters):
+        """
+        Hash of the parameters, the name of their entry.
+        """
+        canonical = [FORMAT_VERSION] + [repr(parameters[name]) for name in PARAMETERS]
+        return hashlib.sha1(json.dumps(canonical).encode()).hexdigest()
+
+    def path(self, parameters):
+        return os.path.join(self.directory, self.key(parameters))
+
+    def restore(self, att, ti, tf, dt):
+        """
+        Loads the cached attitude of att between ti and tf, if there is one.
+        Returns:
+            bool: True if att.storage and the state of att were set from the cache.
+        """
+        path = self.path(self.parameters(att, ti, tf, dt))
+        if not os.path.isdir(path):
+            return False
+        columns = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in AttitudeTable.columns]
+        att.storage = AttitudeTable(*columns)
+
+        state = np.load(os.path.join(path, 'state.npy'))
+        att.t, att.lambda_, att.nu, att.omega = state[0:4]
+        att.z_, att.x_, att.w_ = state[4:7], state[7:10], state[10:13]
+        att.attitude = Quaternion(*state[13:17])
+        att.s_ = att.l_ * np.cos(att.lambda_) + att.j_ * np.sin(att.lambda_)
+
+        if os.path.exists(os.path.join(path, 'rcont.npy')):
+            att.solution = propagator.DenseSolution(
+                np.load(os.path.join(path, 'solution_t.npy'), mmap_mode='r'),
+                np.load(os.path.join(path, 'rcont.npy'), mmap_mode='r'),
+                np.array([att.lambda_dot, att.S, att.xi, att.wz]), att.epsilon, att.l_, att.j_, att.k_)
+
+        # Mark the entry as recently used for the eviction.
+        os.utime(path)
+        return True
+
+    def save(self, att, ti, tf, dt):
+        """
+        Stores att.storage and the state of att as the attitude between ti and tf,
+        then evicts old entries if the cache is too large.
+        """
+        parameters = self.parameters(att, ti, tf, dt)
+        path = self.path(parameters)
+        if os.path.isdir(path):
+            return
+
+        # Written aside and renamed, so that readers never see a partial entry.
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            for name in AttitudeTable.columns:
+                np.save(os.path.join(tmp, name + '.npy'), getattr(att.storage, name))
+            q = att.attitude
+            state = np.concatenate(([att.t, att.lambda_, att.nu, att.omega],
+                                    att.z_, att.x_, att.w_, [q.w, q.x, q.y, q.z]))
+            np.save(os.path.join(tmp, 'state.npy'), state)
+            if att.solution is not None:
+                np.save(os.path.join(tmp, 'solution_t.npy'), att.solution.t)
+                np.save(os.path.join(tmp, 'rcont.npy'), att.solution.rcont)
+            with open(os.path.join(tmp, 'parameters.json'), 'w') as f:
+                json.dump(parameters, f)
+            os.rename(tmp, path)
+        except OSError:
+            # Another process stored the same entry first.
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        self.evict()
+
+    def entries(self):
+        """
+        Cached entries as a list of (path, bytes, last use), least recently used first.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((path, size, os.path.getmtime(path)))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """
+        Total size of the cached entries [bytes].
+        """
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used entries until the cache holds at most max_bytes.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for path, size, last_use in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def invalidate(self, att=None, ti=None, tf=None, dt=None):
+        """
+        Removes the entry of the attitude of att between ti and tf, or every entry
+        when called without arguments.
+        """
+        if att is None:
+            for path, size, last_use in self.entries():
+                shutil.rmtree(path, ignore_errors=True)
+            return
+        shutil.rmtree(self.path(self.parameters(att, ti, tf, dt)), ignore_errors=True)
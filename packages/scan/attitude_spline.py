@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+B-spline representation of the attitude, as in AGIS.
+
+The four components of the attitude quaternion are fitted with B-splines on
+equidistant knots. Only the (M, 4) spline coefficients are kept, and the
+quaternion, its rate and the spin vector can then be evaluated at any time.
+"""
+
+import numpy as np
+from scipy.interpolate import BSpline
+from scipy.linalg import solveh_banded
+
+from attitude_table import AttitudeTable
+from quaternion import multiply_arrays
+
+SECONDS_PER_DAY = 86400.
+
+
+def align_signs(q):
+    """
+    Flips the sign of quaternions so that consecutive rows of q are on the same
+    hemisphere (q and -q are the same attitude, but not for a spline fit).
+    """
+    dot = np.sum(q[1:] * q[:-1], axis=1)
+    signs = np.cumprod(np.concatenate(([1.], np.where(dot < 0, -1., 1.))))
+    return q * signs[:, None]
+
+
+def equidistant_knots(ti, tf, interval, k=3):
+    """
+    Knot vector on [ti, tf] with one knot every interval, with k+1 repeated end knots.
+    """
+    n = max(int(np.ceil((tf - ti) / interval)), 1)
+    inner = np.linspace(ti, tf, n + 1)
+    return np.concatenate((np.full(k, ti), inner, np.full(k, tf)))
+
+
+class AttitudeSpline:
+    """
+    Attitude quaternion as a B-spline of time.
+
+    Args:
+        t (np.ndarray): (N,) times of the attitude samples [days].
+        q (np.ndarray): (N, 4) attitude quaternions (w, x, y, z).
+        knot_interval (float): distance between the knots [s].
+        k (int): degree of the spline, 3 for cubic.
+    Attributes:
+        knots (np.ndarray): knot vector [days].
+        coefficients (np.ndarray): (M, 4) B-spline coefficients.
+
+    Notes:
+        The coefficients are the least squares solution of B c = q, B being the
+        B-spline design matrix, from the normal equations (B^T B) c = B^T q. B^T B
+        has k diagonals above the main one, so it is solved in banded form in
+        O(M k^2). There must be samples in every knot interval.
+    """
+
+    def __init__(self, t, q, knot_interval, k=3):
+        t = np.asarray(t, dtype=np.float64)
+        q = align_signs(np.asarray(q, dtype=np.float64))
+        self.k = k
+        self.knots = equidistant_knots(t[0], t[-1], knot_interval / SECONDS_PER_DAY, k)
+        n_coefficients = len(self.knots) - k - 1
+
+        B = BSpline.design_matrix(t, self.knots, k).tocsc()
+        normal = (B.T @ B).todia()
+        banded = np.zeros((k + 1, n_coefficients))
+        for offset, diagonal in zip(normal.offsets, normal.data):
+            if 0 <= offset <= k:
+                # upper form of solveh_banded: ab[k - d, j] = N[j - d, j]
+                banded[k - offset, offset:] = diagonal[offset:]
+        self.coefficients = solveh_banded(banded, B.T @ q)
+        self._spline = BSpline(self.knots, self.coefficients, k, extrapolate=False)
+        self._rate = self._spline.derivative()
+
+    @classmethod
+    def from_table(cls, table, knot_interval, k=3):
+        """
+        Fits the samples of an AttitudeTable, e.g. Attitude.storage.
+        """
+        return cls(table.t, table.q, knot_interval, k)
+
+    @classmethod
+    def from_attitude(cls, att, knot_interval, samples_per_knot=4, k=3):
+        """
+        Fits the attitude of att, sampled samples_per_knot times per knot interval
+        from att.solution ('rk4' and 'dopri') or else interpolated from att.storage.
+        """
+        if att.solution is not None:
+            ti, tf = att.solution.t[0], att.solution.t[-1]
+        else:
+            ti, tf = att.storage.t[0], att.storage.t[-1]
+        n = int(np.ceil((tf - ti) * SECONDS_PER_DAY / knot_interval * samples_per_knot)) + 1
+        t = np.linspace(ti, tf, n)
+        q = att.solution(t).q if att.solution is not None else att.storage.attitude_at(t)
+        return cls(t, q, knot_interval, k)
+
+    @property
+    def span(self):
+        return self.knots[0], self.knots[-1]
+
+    def _evaluate(self, spline, times):
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        if np.any(times < self.knots[0]) or np.any(times > self.knots[-1]):
+            raise ValueError("times outside of the spline span [%r, %r]" % self.span)
+        return spline(times)
+
+    def quaternion(self, times):
+        """
+        Unit attitude quaternions at the given times, shape (N, 4).
+        """
+        q = self._evaluate(self._spline, times)
+        return q / np.linalg.norm(q, axis=1)[:, None]
+
+    def rate(self, times):
+        """
+        Time derivative [1/day] of the unit attitude quaternions, shape (N, 4).
+        """
+        q = self._evaluate(self._spline, times)
+        dq = self._evaluate(self._rate, times)
+        norm = np.linalg.norm(q, axis=1)[:, None]
+        u = q / norm
+        return (dq - u * np.sum(u * dq, axis=1)[:, None]) / norm
+
+    def spin(self, times):
+        """
+        Inertial spin vector w [rad/day], from dq/dt = (0, w)*q / 2, shape (N, 3).
+        """
+        q = self.quaternion(times)
+        q_conj = q * np.array([1., -1., -1., -1.])
+        return 2 * multiply_arrays(self.rate(times), q_conj)[:, 1:]
+
+    def table(self, times):
+        """
+        AttitudeTable of the spline at the given times. The scanning law angles
+        are not part of the spline and are set to nan.
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        q = self.quaternion(times)
+        w = self.spin(times)
+        # x and z axes: first and last columns of the rotation matrix of q.
+        x = np.stack((1 - 2 * (q[:, 2] ** 2 + q[:, 3] ** 2),
+                      2 * (q[:, 1] * q[:, 2] + q[:, 0] * q[:, 3]),
+                      2 * (q[:, 1] * q[:, 3] - q[:, 0] * q[:, 2])), axis=1)
+        z = np.stack((2 * (q[:, 1] * q[:, 3] + q[:, 0] * q[:, 2]),
+                      2 * (q[:, 2] * q[:, 3] - q[:, 0] * q[:, 1]),
+                      1 - 2 * (q[:, 1] ** 2 + q[:, 2] ** 2)), axis=1)
+        return AttitudeTable(times, w, z, x, q, np.full((len(times), 3), np.nan))
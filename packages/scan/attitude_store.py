@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution storage of the attitude.
+
+Scanner.deep_scan needs the attitude at a fine step around every transit. A
+MultiResolutionStore keeps the coarse table of the whole mission and the fine
+windows apart, and only merges them, once, when the full table is needed.
+"""
+
+import bisect
+
+import numpy as np
+
+from attitude_table import AttitudeTable
+import propagator
+
+
+class MultiResolutionStore:
+    """
+    Coarse attitude table with refined, non-overlapping windows.
+
+    Args:
+        base (AttitudeTable): coarse samples of the attitude.
+    Attributes:
+        base (AttitudeTable): coarse samples.
+        windows (list of AttitudeTable): refined samples, sorted by time.
+        starts, ends (list of float): span (start, end] covered by every window.
+        version (int): incremented on every change, to invalidate derived data.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.windows = []
+        self.starts = []
+        self.ends = []
+        self.version = 0
+        self._table = base
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def table(self):
+        """
+        AttitudeTable of the base samples with the refined windows in place of the
+        base samples they cover. Merged lazily, once per change.
+        """
+        if self._table is None:
+            pieces = []
+            position = 0
+            for start, end, window in zip(self.starts, self.ends, self.windows):
+                i = np.searchsorted(self.base.t, start, side='right')
+                pieces.append(self.base[position:i])
+                pieces.append(window)
+                position = max(i, np.searchsorted(self.base.t, end, side='right'))
+            pieces.append(self.base[position:])
+            self._table = AttitudeTable.concatenate(pieces)
+        return self._table
+
+    def uncovered(self, t0, t1):
+        """
+        Parts of [t0, t1] not covered by a refined window, as a list of (start, end).
+        """
+        gaps = []
+        i = bisect.bisect_right(self.ends, t0)
+        while i < len(self.starts) and self.starts[i] < t1:
+            if self.starts[i] > t0:
+                gaps.append((t0, self.starts[i]))
+            t0 = max(t0, self.ends[i])
+            i += 1
+        if t0 < t1:
+            gaps.append((t0, t1))
+        return gaps
+
+    def seed(self, t):
+        """
+        State at time t as a one row table: the last sample of the window ending at t
+        if there is one, otherwise interpolated from the base samples.
+        """
+        i = bisect.bisect_left(self.ends, t)
+        if i < len(self.ends) and self.ends[i] == t:
+            window = self.windows[i]
+            return window[len(window) - 1:]
+        return self.base.interpolate(t)
+
+    def refine(self, att, t0, t1, dt):
+        """
+        Adds samples every dt between t0 and t1, integrated from the interpolated
+        state at the start of every part of [t0, t1] that is not refined yet. Parts
+        already refined are kept, so the cost is that of the new samples only.
+
+        Args:
+            att (Attitude): attitude providing the scanning law and the integrator,
+                its state is not changed.
+            t0, t1 (float): span to refine, clipped to the base samples [days].
+            dt (float): step of the refined samples [days].
+        """
+        if len(self.base) == 0:
+            raise ValueError("cannot refine an empty attitude table")
+        t0 = max(t0, self.base.t[0])
+        t1 = min(t1, self.base.t[-1])
+        for start, end in self.uncovered(t0, t1):
+            n = int(np.floor((end - start) / dt + 1e-9))
+            if n < 1:
+                continue
+            window = propagator.propagate(att, start, end, dt, n, seed=self.seed(start))
+            i = bisect.bisect_left(self.starts, start)
+            self.starts.insert(i, start)
+            self.ends.insert(i, window.t[-1])
+            self.windows.insert(i, window)
+            self._table = None
+            self.version += 1
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar storage for the attitude of the satellite.
+
+An AttitudeTable keeps every sample of the attitude in contiguous arrays
+instead of a list of [t, w_, z_, x_, Quaternion] rows, while still behaving
+like that list for the code that iterates over Attitude.storage.
+"""
+
+import numpy as np
+from quaternion import Quaternion, multiply_arrays, slerp
+
+
+class AttitudeTable:
+    """
+    Time ordered table of attitude samples stored column by column.
+
+    Args:
+        t (np.ndarray): (N,) times [days].
+        w (np.ndarray): (N, 3) inertial spin vectors wrt BCRS.
+        z (np.ndarray): (N, 3) z-axis of SRS wrt BCRS.
+        x (np.ndarray): (N, 3) x-axis of SRS wrt BCRS.
+        q (np.ndarray): (N, 4) attitude quaternions as (w, x, y, z).
+        angles (np.ndarray): (N, 3) scanning law angles (lambda, nu, omega) [rad].
+
+    Notes:
+        Indexing with an integer returns the legacy row [t, w_, z_, x_, Quaternion],
+        so ``for obj in att.storage`` keeps working. Indexing with a slice or an
+        index array returns a new AttitudeTable.
+
+        Lookups by time use a binary search on the t column, and values between
+        two samples are interpolated (SLERP for the quaternions).
+    """
+
+    columns = ('t', 'w', 'z', 'x', 'q', 'angles')
+
+    def __init__(self, t, w, z, x, q, angles):
+        self.t = np.ascontiguousarray(t, dtype=np.float64)
+        self.w = np.ascontiguousarray(w, dtype=np.float64).reshape(-1, 3)
+        self.z = np.ascontiguousarray(z, dtype=np.float64).reshape(-1, 3)
+        self.x = np.ascontiguousarray(x, dtype=np.float64).reshape(-1, 3)
+        self.q = np.ascontiguousarray(q, dtype=np.float64).reshape(-1, 4)
+        self.angles = np.ascontiguousarray(angles, dtype=np.float64).reshape(-1, 3)
+
+    @classmethod
+    def allocate(cls, n):
+        """
+        Creates a table of n uninitialised rows, to be filled in place.
+        """
+        return cls(np.empty(n), np.empty((n, 3)), np.empty((n, 3)),
+                   np.empty((n, 3)), np.empty((n, 4)), np.empty((n, 3)))
+
+    @classmethod
+    def empty(cls):
+        return cls.allocate(0)
+
+    def __len__(self):
+        return self.t.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            q = self.q[index]
+            return [self.t[index], self.w[index], self.z[index], self.x[index],
+                    Quaternion(q[0], q[1], q[2], q[3])]
+        return AttitudeTable(*(getattr(self, name)[index] for name in self.columns))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        if len(self) == 0:
+            return "AttitudeTable(empty)"
+        return "AttitudeTable(%d rows, t=[%r, %r])" % (len(self), self.t[0], self.t[-1])
+
+    def index_of(self, times):
+        """
+        Index of the last sample at or before each time, by binary search.
+        Args:
+            times (float or np.ndarray): times [days].
+        Returns:
+            np.ndarray: indexes into the table.
+        Raises:
+            ValueError: if a time is outside of the table.
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        if len(self) == 0 or np.any(times < self.t[0]) or np.any(times > self.t[-1]):
+            raise ValueError("times outside of the attitude table")
+        return np.searchsorted(self.t, times, side='right') - 1
+
+    def _bracket(self, times):
+        """
+        Indexes (i, i+1) of the samples around each time and the fraction of the
+        interval elapsed at that time.
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        i0 = self.index_of(times)
+        i1 = np.minimum(i0 + 1, len(self) - 1)
+        h = self.t[i1] - self.t[i0]
+        theta = np.zeros_like(times)
+        np.divide(times - self.t[i0], h, out=theta, where=h > 0)
+        return i0, i1, theta
+
+    def attitude_at(self, times, method='slerp'):
+        """
+        Attitude quaternions interpolated at the given times.
+        Args:
+            times (float or np.ndarray): times [days].
+            method (str): 'slerp', or 'hermite' for a cubic through the samples with
+                the rates dq/dt = (0, w)*q / 2. 'hermite' is much more accurate but
+                needs w to be the spin vector of q, as in 'rk4' and 'dopri' tables.
+        Returns:
+            np.ndarray: (N, 4) quaternions (w, x, y, z).
+        """
+        i0, i1, theta = self._bracket(times)
+        if method == 'slerp':
+            return slerp(self.q[i0], self.q[i1], theta)
+        if method == 'hermite':
+            return self._hermite(i0, i1, theta)
+        raise ValueError("unknown interpolation method %r" % method)
+
+    def _hermite(self, i0, i1, theta):
+        q0 = self.q[i0]
+        sign = np.where(np.sum(q0 * self.q[i1], axis=1) < 0, -1., 1.)[:, None]
+        q1 = self.q[i1] * sign
+        zero = np.zeros((len(i0), 1))
+        m0 = 0.5 * multiply_arrays(np.hstack((zero, self.w[i0])), q0)
+        m1 = 0.5 * multiply_arrays(np.hstack((zero, self.w[i1])), q1)
+        h = (self.t[i1] - self.t[i0])[:, None]
+        c = theta[:, None]
+        q = ((2 * c ** 3 - 3 * c ** 2 + 1) * q0 + (c ** 3 - 2 * c ** 2 + c) * h * m0
+             + (3 * c ** 2 - 2 * c ** 3) * q1 + (c ** 3 - c ** 2) * h * m1)
+        return q / np.linalg.norm(q, axis=1)[:, None]
+
+    def interpolate(self, times):
+        """
+        Table of the attitude interpolated at the given times: SLERP for the
+        quaternions, linear for the other columns, with z and x normalised.
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        i0, i1, theta = self._bracket(times)
+        c = theta[:, None]
+        w, z, x, angles = ((1 - c) * column[i0] + c * column[i1]
+                           for column in (self.w, self.z, self.x, self.angles))
+        z /= np.linalg.norm(z, axis=1)[:, None]
+        x /= np.linalg.norm(x, axis=1)[:, None]
+        return AttitudeTable(times, w, z, x, slerp(self.q[i0], self.q[i1], theta), angles)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        Table with the rows of all the given tables, in the given order.
+        """
+        tables = [table for table in tables if len(table) > 0]
+        if not tables:
+            return cls.empty()
+        if len(tables) == 1:
+            return tables[0]
+        return cls(*(np.concatenate([getattr(table, name) for table in tables]) for name in cls.columns))
+
+    def merge(self, other):
+        """
+        Returns a new table with the rows of both tables sorted by time.
+        The sort is stable, so rows of self come first for equal times.
+        """
+        if len(other) == 0:
+            return self
+        if len(self) == 0:
+            return other
+        merged = AttitudeTable.concatenate((self, other))
+        if self.t[-1] <= other.t[0]:
+            return merged
+        return merged[np.argsort(merged.t, kind='stable')]
+
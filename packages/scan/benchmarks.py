@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and cost benchmarks for the scan package.
+
+Run as a script to print the tables:
+
+    python benchmarks.py
+"""
+
+import time
+
+import numpy as np
+
+from NSL import Attitude
+import frame_transformations as ft
+import propagator
+from quaternion import QuaternionArray
+
+MAS = np.degrees(1) * 3600e3  # [mas/rad]
+
+
+def angle_between(u, v):
+    """
+    Angles [rad] between the rows of two (N, 3) arrays of vectors.
+    """
+    return np.arctan2(np.linalg.norm(np.cross(u, v), axis=1), np.sum(u * v, axis=1))
+
+
+def integrator_accuracy(integrator='rk4', dts=(0.5, 0.2, 0.1, 0.05, 0.02, 0.01), span=10.,
+                        reference_dt=1e-3, tolerances=None):
+    """
+    Compares an integrator of the scanning law with a fine step RK4 reference.
+
+    Every run samples the attitude every dt over [0, span] and is compared with the
+    reference solution at the same times, for the direction of the x and z axes of SRS.
+
+    Args:
+        integrator (str): 'rk4' or 'dopri'.
+        dts (tuple of float): steps to test [days]; sampling steps for 'dopri'.
+        span (float): integrated time [days].
+        reference_dt (float): step of the reference RK4 integration [days].
+        tolerances (tuple of float): absolute tolerances [rad] to test with 'dopri',
+            with the sampling step dts[0]. Defaults to 1e-8 ... 1e-13.
+    Returns:
+        list of dict: one entry per run with keys dt, atol, steps, seconds and error [mas].
+    """
+    reference = Attitude(0, 0, reference_dt, integrator='rk4')
+    reference_solution = propagator.integrate(reference, 0, span, 'rk4', reference_dt)
+
+    if integrator == 'dopri':
+        if tolerances is None:
+            tolerances = (1e-8, 1e-9, 1e-10, 1e-11, 1e-12, 1e-13)
+        runs = [(dts[0], atol) for atol in tolerances]
+    else:
+        runs = [(dt, None) for dt in dts]
+
+    results = []
+    for dt, atol in runs:
+        att = Attitude(0, 0, dt, integrator=integrator)
+        kwargs = {} if atol is None else {'atol': atol}
+        start = time.time()
+        solution = propagator.integrate(att, 0, span, integrator, dt, **kwargs)
+        table = solution.table(dt * np.arange(1, propagator.n_steps(0, span, dt) + 1))
+        seconds = time.time() - start
+
+        expected = reference_solution.table(table.t)
+        error = max(angle_between(table.x, expected.x).max(), angle_between(table.z, expected.z).max())
+        results.append({'dt': dt, 'atol': atol, 'steps': solution.n_steps,
+                        'seconds': seconds, 'error': error * MAS})
+    return results
+
+
+def largest_dt(tolerance=1., integrator='rk4', dts=(1., 0.5, 0.2, 0.1, 0.05, 0.02, 0.01), **kwargs):
+    """
+    Largest step of dts meeting the given accuracy.
+    Args:
+        tolerance (float): maximum error of the axes [mas].
+    Returns:
+        float: the step [days], None if no step is accurate enough.
+    """
+    results = integrator_accuracy(integrator, dts=dts, **kwargs)
+    accurate = [result['dt'] for result in results if result['error'] <= tolerance]
+    return max(accurate) if accurate else None
+
+
+def quaternion_speed(n=10 ** 6):
+    """
+    Times QuaternionArray against loops over Quaternion for n random elements.
+    Returns:
+        list of dict: one entry per operation with keys operation, scalar and array [s] and speedup.
+    """
+    a = QuaternionArray(np.random.normal(size=(n, 4))).normalize()
+    b = QuaternionArray(np.random.normal(size=(n, 4))).normalize()
+    v = np.random.normal(size=(n, 3))
+    quats_a, quats_b = list(a), list(b)
+
+    operations = [
+        ('multiply', lambda: [p * q for p, q in zip(quats_a, quats_b)], lambda: a * b),
+        ('conjugate', lambda: [p.conjugate() for p in quats_a], a.conjugate),
+        ('normalize', lambda: [p.unit() for p in quats_a], a.normalize),
+        ('srs', lambda: [ft.srs(p, u) for p, u in zip(quats_a, v)], lambda: a.rotate(v, inverse=True)),
+        ('basis', lambda: [p.basis() for p in quats_a], a.basis),
+    ]
+    results = []
+    for name, scalar, array in operations:
+        start = time.time()
+        scalar()
+        scalar_seconds = time.time() - start
+        start = time.time()
+        array()
+        array_seconds = time.time() - start
+        results.append({'operation': name, 'scalar': scalar_seconds, 'array': array_seconds,
+                        'speedup': scalar_seconds / array_seconds})
+    return results
+
+
+def print_results(title, results):
+    print(title)
+    print('%10s %10s %10s %12s %14s' % ('dt', 'atol', 'steps', 'seconds', 'error [mas]'))
+    for result in results:
+        atol = '-' if result['atol'] is None else '%.0e' % result['atol']
+        print('%10g %10s %10d %12.4f %14.6g' % (result['dt'], atol, result['steps'],
+                                                result['seconds'], result['error']))
+
+
+if __name__ == '__main__':
+    # compile the kernels before timing
+    integrator_accuracy('rk4', dts=(0.1,), span=1., reference_dt=0.01)
+    integrator_accuracy('dopri', dts=(0.1,), span=1., reference_dt=0.01, tolerances=(1e-8,))
+
+    print_results('RK4 vs reference', integrator_accuracy('rk4'))
+    print_results('Dormand-Prince vs reference', integrator_accuracy('dopri'))
+    print('largest RK4 step within 1 mas:', largest_dt(1.))
+
+    print('Quaternion vs QuaternionArray, 10^6 elements')
+    print('%10s %12s %12s %10s' % ('operation', 'scalar [s]', 'array [s]', 'speedup'))
+    for result in quaternion_speed():
+        print('%10s %12.4f %12.4f %10.0f' % (result['operation'], result['scalar'], result['array'],
+                                             result['speedup']))
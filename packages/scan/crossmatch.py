@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-match of two catalogues for the frame rotation comparisons.
+
+A SourceIdIndex keeps the sourceId of a catalogue sorted, with the rows they
+come from, so that it is built once and saved with the catalogue. Matching two
+indexes is then a merge of two sorted arrays, linear in the size of the
+catalogues, and the resulting CrossMatch gives aligned columns of the matched
+sources for as many solves as needed, without realigning data frames.
+
+Catalogues without common identifiers are matched by position with
+match_positions: the nearest neighbour on the unit sphere, within a radius,
+found in a KD-tree of the reference catalogue.
+"""
+
+import numpy as np
+from numba import jit
+from scipy.spatial import cKDTree
+
+import frame_transformations as ft
+from sky_index import chord
+
+
+@jit(nopython=True)
+def _merge_join(a, b, rows_a, rows_b):
+    i = j = k = 0
+    while i < a.shape[0] and j < b.shape[0]:
+        if a[i] < b[j]:
+            i += 1
+        elif a[i] > b[j]:
+            j += 1
+        else:
+            rows_a[k] = i
+            rows_b[k] = j
+            k += 1
+            i += 1
+            j += 1
+    return k
+
+
+class SourceIdIndex:
+    """
+    Sorted sourceId of a catalogue.
+
+    Args:
+        source_id (np.ndarray): (N,) sourceId of the rows of the catalogue, unique.
+    Attributes:
+        source_id (np.ndarray): (N,) sorted int64 identifiers.
+        rows (np.ndarray): (N,) row of the catalogue of every sorted identifier.
+    """
+
+    def __init__(self, source_id):
+        source_id = np.asarray(source_id, dtype=np.int64)
+        self.rows = np.argsort(source_id, kind='stable')
+        self.source_id = source_id[self.rows]
+        if len(self.source_id) > 1 and np.any(self.source_id[1:] == self.source_id[:-1]):
+            raise ValueError("the sourceId of a catalogue must be unique")
+
+    @classmethod
+    def from_catalogue(cls, catalogue, column='sourceId'):
+        """
+        Index of a data frame, or of any mapping of column names to arrays.
+        """
+        return cls(np.asarray(catalogue[column]))
+
+    def __len__(self):
+        return self.source_id.shape[0]
+
+    def save(self, path):
+        """
+        Writes the index to an .npz file.
+        """
+        np.savez(path, source_id=self.source_id, rows=self.rows)
+
+    @classmethod
+    def load(cls, path):
+        index = cls.__new__(cls)
+        with np.load(path) as data:
+            index.source_id = data['source_id']
+            index.rows = data['rows']
+        return index
+
+    def match(self, other):
+        """
+        Sources of self also in other, by a merge of the two sorted indexes.
+        Args:
+            other (SourceIdIndex): index of the other catalogue.
+        Returns:
+            CrossMatch: rows of the matched sources in both catalogues, by increasing sourceId.
+        """
+        size = min(len(self), len(other))
+        rows, other_rows = np.empty(size, dtype=np.intp), np.empty(size, dtype=np.intp)
+        n = _merge_join(self.source_id, other.source_id, rows, other_rows)
+        return CrossMatch(self.source_id[rows[:n]], self.rows[rows[:n]], other.rows[other_rows[:n]])
+
+
+class CrossMatch:
+    """
+    Matched sources of two catalogues.
+
+    Args:
+        source_id (np.ndarray): (M,) identifiers of the matched sources, their rows in the
+            catalogue for a positional match of catalogues without sourceId.
+        rows, rows0 (np.ndarray): (M,) rows of the matched sources in the catalogue and
+            in the reference catalogue.
+    Attributes:
+        separation (np.ndarray): (M,) distance between the matched positions [rad], for a
+            positional match, None otherwise.
+    """
+
+    def __init__(self, source_id, rows, rows0, separation=None):
+        self.source_id = np.asarray(source_id)
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.rows0 = np.asarray(rows0, dtype=np.intp)
+        self.separation = separation
+
+    def __len__(self):
+        return self.rows.shape[0]
+
+    def save(self, path):
+        """
+        Writes the match to an .npz file.
+        """
+        arrays = dict(source_id=self.source_id, rows=self.rows, rows0=self.rows0)
+        if self.separation is not None:
+            arrays['separation'] = self.separation
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['source_id'], data['rows'], data['rows0'],
+                       data['separation'] if 'separation' in data else None)
+
+    def columns(self, catalogue, catalogue0, names=('alpha', 'delta', 'muAlphaStar', 'muDelta'), rows=None):
+        """
+        Aligned columns of the matched sources, named as frameRotation.catalogueColumns:
+        the names from catalogue, then the names + '0' from the reference catalogue0.
+        Args:
+            catalogue, catalogue0: data frames, or mappings of column names to arrays.
+            rows (slice or np.ndarray): subset of the matches, all of them if None.
+        Returns:
+            dict: column name to (M,) array.
+        """
+        selected = slice(None) if rows is None else rows
+        columns = {}
+        for name in names:
+            columns[name] = np.asarray(catalogue[name])[self.rows[selected]]
+            columns[name + '0'] = np.asarray(catalogue0[name])[self.rows0[selected]]
+        return columns
+
+    def chunks(self, catalogue, catalogue0, chunksize=10**6):
+        """
+        Callable giving the aligned columns by chunks of chunksize matches, for
+        frameRotation.solveRotationStreaming.
+        """
+        def read():
+            for start in range(0, len(self), chunksize):
+                yield self.columns(catalogue, catalogue0, rows=slice(start, start + chunksize))
+        return read
+
+
+def match_source_id(catalogue, catalogue0, column='sourceId'):
+    """
+    CrossMatch of two catalogues by sourceId, with indexes built on the fly.
+    """
+    return SourceIdIndex.from_catalogue(catalogue, column).match(SourceIdIndex.from_catalogue(catalogue0, column))
+
+
+def match_positions(catalogue, catalogue0, radius, longitude='alpha', latitude='delta', column='sourceId',
+                    chunksize=10**6, unique=True, workers=1):
+    """
+    CrossMatch of two catalogues by position: every source of catalogue is matched to the
+    nearest source of catalogue0 closer than radius.
+
+    The reference catalogue0 is kept in a KD-tree of unit vectors, and catalogue is queried
+    by chunks of chunksize sources, so that the memory is that of the tree and of one chunk.
+
+    Args:
+        catalogue, catalogue0: data frames, or mappings of column names to arrays.
+        radius (float): matching radius [rad].
+        longitude, latitude (str): columns of the positions [rad].
+        column (str): identifiers of catalogue kept in CrossMatch.source_id, if it has them.
+        unique (bool): if True, a source of catalogue0 is only matched to the closest of
+            the sources of catalogue matched to it.
+        workers (int): processes of the tree queries, all of the CPUs if -1.
+    Returns:
+        CrossMatch: matches sorted by row of catalogue, with their separations [rad].
+    """
+    tree = cKDTree(ft.xyz_batch(catalogue0[longitude], catalogue0[latitude]))
+    longitudes, latitudes = np.asarray(catalogue[longitude]), np.asarray(catalogue[latitude])
+    rows, rows0, distances = [], [], []
+    vectors = np.empty((min(chunksize, len(longitudes)), 3))
+    for start in range(0, len(longitudes), chunksize):
+        stop = min(start + chunksize, len(longitudes))
+        chunk = ft.xyz_batch(longitudes[start:stop], latitudes[start:stop], out=vectors[:stop - start])
+        distance, index = tree.query(chunk, k=1, distance_upper_bound=chord(radius), workers=workers)
+        found = np.flatnonzero(np.isfinite(distance))
+        rows.append(found + start)
+        rows0.append(index[found])
+        distances.append(distance[found])
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+    rows0 = np.concatenate(rows0) if rows0 else np.empty(0, dtype=np.intp)
+    separation = 2 * np.arcsin(np.concatenate(distances) / 2) if distances else np.empty(0)
+
+    if unique and len(rows):
+        order = np.lexsort((separation, rows0))
+        first = order[np.concatenate(([True], rows0[order][1:] != rows0[order][:-1]))]
+        first.sort()
+        rows, rows0, separation = rows[first], rows0[first], separation[first]
+
+    source_id = np.asarray(catalogue[column])[rows] if column in catalogue else rows
+    return CrossMatch(source_id, rows, rows0, separation)
@@ -6,6 +6,7 @@ from LL-072 Equations (36) and (37) without galactic acceleration
 
 import numpy as np
 import time
+import warnings
 import matplotlib as mp
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -14,8 +15,17 @@ import glob as glob
 
 from astropy.table import Table
 
+import crossmatch
+
 identity = np.ones(3)/np.linalg.norm(np.ones(3))
 
+# sources per block of designEquation, bounds the temporary arrays to a few tens of MB
+blockSize = 2**17
+
+# columns of a chunk of matched sources for the streaming solver: the Gaia catalogue,
+# then the reference catalogue, as in the data frames of rotationPerMagPd
+catalogueColumns = ('alpha','delta','muAlphaStar','muDelta','alpha0','delta0','muAlphaStar0','muDelta0')
+
 def alphaDelta(r) :
     """
     from the direction r of the frame pqr computes and return 
@@ -43,6 +53,17 @@ def pqr(alpha,delta) :
     r=np.array([np.cos(delta)*np.cos(alpha),np.cos(delta)*np.sin(alpha),np.sin(delta)])
     return p,q,r
 
+def pqrArrays(alpha,delta) :
+    """
+    pqr for arrays of (alpha,delta), as (n,3) arrays p, q, r
+    """
+    sinAlpha, cosAlpha = np.sin(alpha), np.cos(alpha)
+    sinDelta, cosDelta = np.sin(delta), np.cos(delta)
+    p = np.stack((-sinAlpha, cosAlpha, np.zeros_like(alpha)), axis=1)
+    q = np.stack((-sinDelta*cosAlpha, -sinDelta*sinAlpha, cosDelta), axis=1)
+    r = np.stack((cosDelta*cosAlpha, cosDelta*sinAlpha, sinDelta), axis=1)
+    return p,q,r
+
 def qOmega(omega,t0,t1):
     """
     Equation 5 in LL-072
@@ -164,35 +185,78 @@ def designEquationRow(omega,epsilon,
     
     return rAlpha,rDelta, rMuAlpha , rMuDelta, drAlpha, drDelta, drMuAlpha, drMuDelta
 
+def designEquationBlock(EtG0,omega,t0,t1,
+                        alphaG,deltaG,muAlphaStarG,muDeltaG,
+                        alpha0E,delta0E,muAlphaStar0E,muDelta0E,
+                        M,r) :
+    """
+    designEquationRow for arrays of n sources at once, written into
+    M (n,4,6) and r (n,4), with the transformation EtG0 = EtG(omega,epsilon,t0,t1)
+    """
+    p0G,q0G,r0G = pqrArrays(alphaG,deltaG)
+    muG = muAlphaStarG[:,None] * p0G + muDeltaG[:,None] * q0G - np.cross(omega,r0G)
+
+    r0EG = r0G.dot(EtG0.T)
+    mu0EG = muG.dot(EtG0.T)
+
+    # alphaDelta of the rotated directions
+    cosDelta = np.sqrt(r0EG[:,0]**2+r0EG[:,1]**2)
+    delta0EG = np.arctan2(r0EG[:,2],cosDelta)
+    alpha0EG = np.arctan2(r0EG[:,1]/cosDelta,r0EG[:,0]/cosDelta)%(2*np.pi)
+    p0E,q0E,r0E = pqrArrays(alpha0EG,delta0EG)
+
+    r0E -= pqrArrays(alpha0E,delta0E)[2]
+    r[:,0] = np.einsum('ij,ij->i',p0E,r0E)
+    r[:,1] = np.einsum('ij,ij->i',q0E,r0E)
+    r[:,2] = np.einsum('ij,ij->i',p0E,mu0EG)-muAlphaStar0E
+    r[:,3] = np.einsum('ij,ij->i',q0E,mu0EG)-muDelta0E
+
+    M[:,0,0:3] = -q0E
+    M[:,0,3:6] = -q0E*(t0-t1)
+    M[:,1,0:3] = p0E
+    M[:,1,3:6] = p0E*(t0-t1)
+    M[:,2,0:3] = 0
+    M[:,2,3:6] = -q0E
+    M[:,3,0:3] = 0
+    M[:,3,3:6] = p0E
+
 def designEquation(omega,epsilon,
                    a00,d00,ma00,md00,t0,
-                   a11,d11,ma11,md11,t1) :
+                   a11,d11,ma11,md11,t1,
+                   M=None,r=None) :
     """
     00 : Gaia source catalogue 
     t0 : refence epoch of 00
     11 : reference source catalogue
     t1 : reference epoch of 11
+    M, r : optional (4n,6) and (4n) output arrays
+
+    rows 4i to 4i+3 of M and r are the alpha, delta, muAlphaStar and muDelta equations
+    of source i (designEquationRow), computed by blocks of blockSize sources
     """
-    n=len(a00)
-    M = np.zeros([4*n,6])
-    r = np.zeros(4*n)
+    columns = [np.asarray(c,dtype=np.float64) for c in (a00,d00,ma00,md00,a11,d11,ma11,md11)]
+    n=len(columns[0])
+    if M is None : M = np.empty([4*n,6])
+    if r is None : r = np.empty(4*n)
     
-    for i,a0,d0,ma0,md0,a1,d1,ma1,md1 in zip(range(n),a00,d00,ma00,md00,a11,d11,ma11,md11) :
-                
-        Ra,Rd,Rma,Rmd,dRa,dRd,dRma,dRmd = designEquationRow(omega,epsilon,t0,t1,a0,d0,ma0,md0,a1,d1,ma1,md1)
-        
-        M[2*i] = dRa
-        M[2*i+1]= dRd
-        M[2*i+2] = dRma
-        M[2*i+3]= dRmd
-        
-        r[2*i] = Ra
-        r[2*i+1] = Rd
-        r[2*i+2] = Rma
-        r[2*i+3] = Rmd
+    EtG0 = EtG(omega,epsilon,t0,t1)
+    MSources = M.reshape(n,4,6)
+    rSources = r.reshape(n,4)
+    for start in range(0,n,blockSize) :
+        block = slice(start,start+blockSize)
+        designEquationBlock(EtG0,omega,t0,t1,*[c[block] for c in columns],
+                            M=MSources[block],r=rSources[block])
         
     return M,r
 
+def designEquationColumns(omega,epsilon,columns,t0=2015.5,t1=2015.5,M=None,r=None) :
+    """
+    designEquation of matched sources given as a mapping of the catalogueColumns to arrays,
+    like the columns of a crossmatch.CrossMatch
+    """
+    a00,d00,ma00,md00,a11,d11,ma11,md11 = [columns[name] for name in catalogueColumns]
+    return designEquation(omega,epsilon,a00,d00,ma00,md00,t0,a11,d11,ma11,md11,t1,M=M,r=r)
+
 def solveRotation(i,d,omega=np.zeros(3),epsilon=np.zeros(3)) :
     for i in range(0,i) :
         M,r = designEquation(omega,epsilon,d.alpha,d.delta,d.muAlphaStar,d.muDelta,2015.5,
@@ -202,6 +266,160 @@ def solveRotation(i,d,omega=np.zeros(3),epsilon=np.zeros(3)) :
         epsilon -=  x[0][0:3]
     return epsilon, omega 
 
+def normalEquations(omega,epsilon,chunks,t0=2015.5,t1=2015.5) :
+    """
+    accumulates the normal equations of the design equation over chunks of matched sources,
+    with a constant memory of blockSize sources
+    chunks : iterable of data frames (or dicts of arrays) with the catalogueColumns,
+             sources with a missing value are skipped
+    returns N = M^T M (6,6), b = M^T r (6), r^T r and the number of equations, 4 per source used
+    """
+    N = np.zeros([6,6])
+    b = np.zeros(6)
+    rr = 0.
+    m = 0
+    M = np.empty([4*blockSize,6])
+    r = np.empty(4*blockSize)
+    for chunk in chunks :
+        columns = [np.asarray(chunk[name],dtype=np.float64) for name in catalogueColumns]
+        finite = np.all(np.isfinite(columns),axis=0)
+        if not finite.all() : columns = [c[finite] for c in columns]
+        n = len(columns[0])
+        for start in range(0,n,blockSize) :
+            block = {name: c[start:start+blockSize] for name,c in zip(catalogueColumns,columns)}
+            k = len(block['alpha'])
+            Mk,rk = designEquationColumns(omega,epsilon,block,t0,t1,M=M[:4*k],r=r[:4*k])
+            N += Mk.T.dot(Mk)
+            b += Mk.T.dot(rk)
+            rr += rk.dot(rk)
+            m += 4*k
+    return N,b,rr,m
+
+def solveRotationStreaming(chunks,omega=None,epsilon=None,t0=2015.5,t1=2015.5,
+                           tolerance=1e-12,maxIterations=10) :
+    """
+    solveRotation over chunks of matched sources, with only the 6x6 normal equations in memory,
+    iterated until the largest correction is below tolerance [rad, rad/yr]
+    chunks : callable returning a new iterable of chunks (see normalEquations) for every
+             iteration, e.g. pairedCsvChunks, or a list of chunks; an iterator or generator is
+             consumed by the first iteration and is rejected with a TypeError
+    returns epsilon, omega and the (6,6) covariance of (epsilon, omega), scaled by the
+    variance of unit weight
+    """
+    omega = np.zeros(3) if omega is None else np.array(omega,dtype=np.float64)
+    epsilon = np.zeros(3) if epsilon is None else np.array(epsilon,dtype=np.float64)
+    if not callable(chunks) and iter(chunks) is chunks :
+        raise TypeError("solveRotationStreaming: chunks must be a callable or a sequence, "
+                        "an iterator is read only once")
+    for iteration in range(maxIterations) :
+        N,b,rr,m = normalEquations(omega,epsilon,chunks() if callable(chunks) else chunks,t0,t1)
+        x = np.linalg.solve(N,b)
+        epsilon -= x[0:3]
+        omega -= x[3:6]
+        if np.max(np.abs(x)) < tolerance : break
+    else :
+        warnings.warn("solveRotationStreaming: corrections above %g after %d iterations" % (tolerance,maxIterations))
+    # residuals of the linearised problem at the solution
+    variance = max(rr-b.dot(x),0.)/max(m-6,1)
+    return epsilon, omega, variance*np.linalg.inv(N)
+
+def normalContribution(M,w,r) :
+    """
+    contribution to the normal equations of the sources with design equations M (k,4,6),
+    residuals r (k,4) and weights w (k,4): sum of M^T W M (6,6) and of M^T W r (6)
+    """
+    Mw = M*w[:,:,None]
+    return np.einsum('kij,kil->jl',Mw,M), np.einsum('kij,ki->j',Mw,r)
+
+def solveRotationRobust(columns,sigma=None,omega=None,epsilon=None,t0=2015.5,t1=2015.5,
+                        clip=3.,tolerance=1e-12,maxIterations=10,maxClipIterations=20,minSources=10) :
+    """
+    weighted solveRotation with sigma clipping of the sources
+    columns : mapping of the catalogueColumns to (n) arrays, e.g. crossmatch.CrossMatch.columns
+    sigma : uncertainties of the sources (n), or of the alpha, delta, muAlphaStar, muDelta
+            equations of every source (n,4), unit weights if None
+    clip : sources with an equation residual above clip times the robust standard deviation
+           of the normalised residuals of that equation (1.4826 median absolute residual of
+           the alpha, delta, muAlphaStar or muDelta equations of the sources kept) are rejected,
+           residuals below tolerance never are
+    minSources : smallest number of sources kept, the clipping stops before going below it
+    sources with a missing value in columns or sigma are given no weight and never kept
+
+    the design equations are computed once per linearisation; between two linearisations the
+    sources rejected or accepted again are removed from or added to the normal equations,
+    without rebuilding them, and the solution is iterated until the set of sources is stable,
+    then the linearisation is repeated only while the corrections are above tolerance
+    returns epsilon, omega, the (6,6) covariance of (epsilon, omega) and the mask of the
+    sources kept
+    """
+    omega = np.zeros(3) if omega is None else np.array(omega,dtype=np.float64)
+    epsilon = np.zeros(3) if epsilon is None else np.array(epsilon,dtype=np.float64)
+    n = len(columns['alpha'])
+    finite = np.all([np.isfinite(np.asarray(columns[name],dtype=np.float64)) for name in catalogueColumns],axis=0)
+    w = np.ones([n,4])
+    if sigma is not None :
+        sigma = np.asarray(sigma,dtype=np.float64).reshape(n,-1)
+        finite &= np.all(np.isfinite(sigma),axis=1)
+        with np.errstate(invalid='ignore') :
+            w = w/(sigma**2)
+    w[~finite] = 0.
+    # residuals within the tolerance of the solution are not rejected
+    zmin = tolerance*np.sqrt(w)
+    kept = finite.copy()
+    for iteration in range(maxIterations) :
+        M,r = designEquationColumns(omega,epsilon,columns,t0,t1)
+        M = M.reshape(n,4,6)
+        r = r.reshape(n,4)
+        # the sources with a missing value have no equations
+        M[~finite] = 0.
+        r[~finite] = 0.
+        N,b = normalContribution(M[kept],w[kept],r[kept])
+        for clipIteration in range(maxClipIterations) :
+            x = np.linalg.solve(N,b)
+            e = r-np.einsum('nij,j->ni',M,x)
+            z = np.abs(e)*np.sqrt(w)
+            scale = 1.4826*np.median(z[kept],axis=0)
+            accepted = finite & np.all(z <= np.maximum(clip*scale,zmin),axis=1)
+            if accepted.sum() < minSources :
+                warnings.warn("solveRotationRobust: clipping stopped at %d sources" % kept.sum())
+                break
+            removed = kept & ~accepted
+            added = accepted & ~kept
+            if not (removed.any() or added.any()) : break
+            Nr,br = normalContribution(M[removed],w[removed],r[removed])
+            Na,ba = normalContribution(M[added],w[added],r[added])
+            N += Na-Nr
+            b += ba-br
+            kept = accepted
+        else :
+            # the set of sources did not settle, solution of the last one
+            x = np.linalg.solve(N,b)
+            e = r-np.einsum('nij,j->ni',M,x)
+        epsilon -= x[0:3]
+        omega -= x[3:6]
+        if np.max(np.abs(x)) < tolerance : break
+    else :
+        warnings.warn("solveRotationRobust: corrections above %g after %d iterations" % (tolerance,maxIterations))
+    variance = np.sum(w[kept]*e[kept]**2)/max(4*kept.sum()-6,1)
+    return epsilon, omega, variance*np.linalg.inv(N), kept
+
+def pairedCsvChunks(path,path0,chunksize=10**6) :
+    """
+    chunks of the Gaia catalogue in path and the reference catalogue in path0, two csv files
+    with the same sources (sourceId) in the same order, read chunksize rows at a time
+    returns a callable for solveRotationStreaming
+    """
+    def read() :
+        for d,d0 in zip(pd.read_csv(path,chunksize=chunksize),pd.read_csv(path0,chunksize=chunksize)) :
+            if not np.array_equal(d.sourceId.values,d0.sourceId.values) :
+                raise ValueError("%s and %s do not list the same sources in the same order" % (path,path0))
+            d['alpha0']=d0.alpha.values
+            d['delta0']=d0.delta.values
+            d['muAlphaStar0']=d0.muAlphaStar.values
+            d['muDelta0']=d0.muDelta.values
+            yield d
+    return read
+
 def rotationPerMagPd(df0,df1,gmag0,gmag1,nmax=1000) :
     """
     a pandas implementation
@@ -302,4 +520,85 @@ def rotationPerColor(df0,df1,nuEff0,nuEff1,nmax=1000) :
     df['muAlphaStar0']=df.muAlphaStar
     df['muDelta0']=df.muDelta
     print(n,": processing",df.alpha.count(),"sources")
-    return solveRotation(2,df)
\ No newline at end of file
+    return solveRotation(2,df)
+
+def matchPerBin(df0,df1,key,edges,match=None) :
+    """
+    matches the reference catalogue df0 and the Gaia catalogue df1 by sourceId once, and sorts
+    the sources whose key (gMag, nuEff) is in the same bin [edges[i], edges[i+1]) in both
+    match : crossmatch.CrossMatch of df1 and df0, computed if None
+    returns the aligned columns (catalogueColumns) sorted by bin, and the first row of every bin (len(edges))
+    """
+    if match is None : match = crossmatch.match_source_id(df1,df0)
+    bin1 = np.searchsorted(edges,np.asarray(df1[key])[match.rows],side='right')-1
+    bin0 = np.searchsorted(edges,np.asarray(df0[key])[match.rows0],side='right')-1
+    keep = np.flatnonzero((bin0 == bin1) & (bin1 >= 0) & (bin1 < len(edges)-1))
+    keep = keep[np.argsort(bin1[keep],kind='stable')]
+    bounds = np.searchsorted(bin1[keep],np.arange(len(edges)))
+    return match.columns(df1,df0,rows=keep),bounds
+
+def rotationPerBinLocal(df0,df1,key,edges,t0=2015.5,t1=2015.5,tolerance=1e-12,maxIterations=10,match=None) :
+    """
+    local replacement of rotationPerMag and rotationPerColor, for all the bins of key at once,
+    with every source and without Spark: the catalogues are joined and sorted by bin once
+    (matchPerBin), then every iteration accumulates the normal equations of every bin and
+    solves them as one stack of 6x6 systems, until the corrections of every bin converge
+    df0 : reference catalogue, df1 : Gaia catalogue, pandas data frames with sourceId, key,
+          alpha, delta, muAlphaStar, muDelta
+    returns an astropy Table of the bins: bin0, bin1 (edges), n (number of sources used, without
+    those with a missing value), epsilon (3), omega (3), covariance (6,6); nan for the bins whose
+    normal equations are singular, e.g. with less than 2 sources
+    match : crossmatch.CrossMatch of df1 and df0, to reuse it for many solves
+    """
+    edges = np.asarray(edges,dtype=np.float64)
+    columns,bounds = matchPerBin(df0,df1,key,edges,match)
+    nBins = len(edges)-1
+    counts = np.zeros(nBins,dtype=np.int64)
+    epsilon = np.zeros([nBins,3])
+    omega = np.zeros([nBins,3])
+    N = np.zeros([nBins,6,6])
+    b = np.zeros([nBins,6])
+    rr = np.zeros(nBins)
+    solvable = np.diff(bounds) > 0
+    active = solvable.copy()
+    x = np.zeros([nBins,6])
+    for iteration in range(maxIterations) :
+        bins = np.flatnonzero(active)
+        if len(bins) == 0 : break
+        for i in bins :
+            chunk = {name: c[bounds[i]:bounds[i+1]] for name,c in columns.items()}
+            N[i],b[i],rr[i],m = normalEquations(omega[i],epsilon[i],[chunk],t0,t1)
+            counts[i] = m//4
+        # a singular bin (less than 2 sources, identical sources) is left out, not the others
+        singular = bins[np.linalg.matrix_rank(N[bins]) < 6]
+        solvable[singular] = False
+        active[singular] = False
+        bins = np.flatnonzero(active)
+        x[bins] = np.linalg.solve(N[bins],b[bins][:,:,None])[:,:,0]
+        epsilon[bins] -= x[bins,0:3]
+        omega[bins] -= x[bins,3:6]
+        active[bins] = np.max(np.abs(x[bins]),axis=1) >= tolerance
+    if active.any() :
+        warnings.warn("rotationPerBinLocal: corrections above %g after %d iterations in %d bins"
+                      % (tolerance,maxIterations,active.sum()))
+
+    covariance = np.full([nBins,6,6],np.nan)
+    bins = np.flatnonzero(solvable)
+    variance = np.maximum(rr[bins]-np.einsum('ij,ij->i',b[bins],x[bins]),0.)/np.maximum(4*counts[bins]-6,1)
+    covariance[bins] = variance[:,None,None]*np.linalg.inv(N[bins])
+    epsilon[~solvable] = np.nan
+    omega[~solvable] = np.nan
+    return Table([edges[:-1],edges[1:],counts,epsilon,omega,covariance],
+                 names=('bin0','bin1','n','epsilon','omega','covariance'))
+
+def rotationPerMagLocal(df0,df1,gmagEdges,**kwargs) :
+    """
+    rotationPerBinLocal for the bins of gMag between gmagEdges
+    """
+    return rotationPerBinLocal(df0,df1,'gMag',gmagEdges,**kwargs)
+
+def rotationPerColorLocal(df0,df1,nuEffEdges,**kwargs) :
+    """
+    rotationPerBinLocal for the bins of nuEff between nuEffEdges
+    """
+    return rotationPerBinLocal(df0,df1,'nuEff',nuEffEdges,**kwargs)
@@ -1,7 +1,37 @@
 # -*- coding: utf-8 -*-
 import numpy as np
+from numba import jit
 from quaternion import Quaternion
 
+# The *_batch functions work on arrays of attitudes and vectors with compiled
+# loops writing into an output buffer, which the caller may provide to avoid
+# allocations. Attitudes are (N, 4) arrays of quaternions (w, x, y, z). Where
+# a function takes attitudes and vectors, either of them can have one row,
+# which is then used with every row of the other (one-to-many). Arguments of
+# other lengths, and output buffers that are not C-contiguous float64 arrays
+# of the result's shape, raise a ValueError before the loops run.
+
+
+def _rows(*arrays):
+    """
+    Number of rows of the result of arrays used one-to-many.
+    """
+    lengths = set(array.shape[0] for array in arrays) - {1}
+    if len(lengths) > 1:
+        raise ValueError("arguments of %s rows cannot be used together" % sorted(lengths))
+    return lengths.pop() if lengths else 1
+
+
+def _output(out, shape):
+    """
+    Output buffer of the given shape, allocated if out is None.
+    """
+    if out is None:
+        return np.empty(shape)
+    if out.shape != shape or out.dtype != np.float64 or not out.flags.c_contiguous:
+        raise ValueError("out must be a C-contiguous float64 array of shape %s" % (shape,))
+    return out
+
 
 def to_quaternion(vector):
     """
@@ -12,11 +42,56 @@ def to_quaternion(vector):
     return Quaternion(0, vector[0], vector[1], vector[2])
 
 
+@jit(nopython=True)
+def _alpha_delta_kernel(vectors, out):
+    for i in range(vectors.shape[0]):
+        out[i, 0] = np.arctan2(vectors[i, 1], vectors[i, 0])
+        out[i, 1] = np.arctan2(vectors[i, 2], np.sqrt(vectors[i, 1]**2 + vectors[i, 0]**2))
+
+
+def alpha_delta_batch(vectors, out=None):
+    """
+    Batched alpha_delta.
+    :param vectors: (N, 3) array.
+    :param out: (N, 2) array for (alpha, delta), allocated if None.
+    :return: out
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float64).reshape(-1, 3)
+    out = _output(out, (vectors.shape[0], 2))
+    _alpha_delta_kernel(vectors, out)
+    return out
+
+
 def alpha_delta(vector):
+    vector = np.asarray(vector, dtype=np.float64)
+    angles = alpha_delta_batch(vector.reshape(3, -1).T)
+    if vector.ndim == 1:
+        return angles[0, 0], angles[0, 1]
+    return angles[:, 0], angles[:, 1]
 
-    alpha = np.arctan2(vector[1], vector[0])
-    delta = np.arctan2(vector[2], np.sqrt(vector[1]**2 + vector[0]**2))  
-    return alpha, delta
+
+@jit(nopython=True)
+def _xyz_kernel(azimuth, altitude, out):
+    for i in range(azimuth.shape[0]):
+        out[i, 0] = np.cos(azimuth[i])*np.cos(altitude[i])
+        out[i, 1] = np.sin(azimuth[i])*np.cos(altitude[i])
+        out[i, 2] = np.sin(altitude[i])
+
+
+def xyz_batch(azimuth, altitude, out=None):
+    """
+    Batched xyz.
+    :param azimuth: (N,) array [rad].
+    :param altitude: (N,) array [rad].
+    :param out: (N, 3) array for the unit vectors, allocated if None.
+    :return: out
+    """
+    azimuth, altitude = np.broadcast_arrays(np.asarray(azimuth, dtype=np.float64),
+                                            np.asarray(altitude, dtype=np.float64))
+    azimuth, altitude = np.ascontiguousarray(azimuth).ravel(), np.ascontiguousarray(altitude).ravel()
+    out = _output(out, (azimuth.shape[0], 3))
+    _xyz_kernel(azimuth, altitude, out)
+    return out
 
 
 def xyz(azimuth, altitude):
@@ -41,14 +116,71 @@ def ljk(epsilon):
     return l, j, k
 
 
+# Rotation from galactic to equatorial (ICRS) coordinates, the transpose of the
+# matrix A_G of the Hipparcos catalogue (ESA 1997, Vol. 1, Eq. 1.5.11).
+GALACTIC_TO_EQUATORIAL = np.array([[-0.0548755604162154, 0.4941094278755837, -0.8676661490190047],
+                                   [-0.8734370902348850, -0.4448296299600112, -0.1980763734312015],
+                                   [-0.4838350155487132, 0.7469822444972189, 0.4559837761750669]])
+
+
+def galactic_to_equatorial(l, b):
+    """
+    Converts galactic coordinates to equatorial ones.
+    :param l: galactic longitudes [rad].
+    :param b: galactic latitudes [rad].
+    :return: alpha, delta [rad], alpha in [-pi, pi].
+    """
+    l, b = np.broadcast_arrays(np.asarray(l, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    vectors = xyz_batch(l, b).dot(GALACTIC_TO_EQUATORIAL.T)
+    angles = alpha_delta_batch(vectors)
+    return angles[:, 0].reshape(l.shape), angles[:, 1].reshape(l.shape)
+
+
+@jit(nopython=True)
+def _rotation_to_quat_kernel(vectors, angles, out):
+    n = out.shape[0]
+    for i in range(n):
+        v = vectors[i if vectors.shape[0] > 1 else 0]
+        angle = angles[i if angles.shape[0] > 1 else 0]
+        norm = np.sqrt(v[0]**2 + v[1]**2 + v[2]**2)
+        s = np.sin(angle/2.) / norm
+        out[i, 0] = np.cos(angle/2.)
+        out[i, 1] = s * v[0]
+        out[i, 2] = s * v[1]
+        out[i, 3] = s * v[2]
+
+
+def rotation_to_quat_batch(vectors, angles, out=None):
+    """
+    Batched rotation_to_quat.
+    :param vectors: (N, 3) rotation axes, or (1, 3) for all the angles.
+    :param angles: (N,) angles [rad], or one for all the axes.
+    :param out: (N, 4) array for the quaternions, allocated if None.
+    :return: out
+    :raises ValueError: if the lengths of vectors and angles differ and neither is one,
+        if out is not a C-contiguous float64 (N, 4) array, or if an axis is zero.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float64).reshape(-1, 3)
+    angles = np.ascontiguousarray(angles, dtype=np.float64).reshape(-1)
+    out = _output(out, (_rows(vectors, angles), 4))
+    if not np.all(np.any(vectors != 0, axis=1)):
+        raise ValueError("rotation axes must be non-zero vectors")
+    _rotation_to_quat_kernel(vectors, angles, out)
+    return out
+
+
 def rotation_to_quat(vector, angle):
     """
     Calculates quaternion equivalent to rotation about (vector) by an (angle).
     :param vector:
     :param angle:
     :return:
+    :raises ValueError: if vector is zero.
     """
-    vector = vector / np.linalg.norm(vector)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        raise ValueError("rotation axis must be a non-zero vector")
+    vector = vector / norm
     t = np.cos(angle/2.)
     x = np.sin(angle/2.) * vector[0]
     y = np.sin(angle/2.) * vector[1]
@@ -57,20 +189,66 @@ def rotation_to_quat(vector, angle):
     return Quaternion(t, x, y, z)
 
 
+@jit(nopython=True)
+def _rotate_kernel(attitudes, vectors, out, sign):
+    # q v q* = (w^2 - u.u) v + 2 (u.v) u + 2 w (u x v), with u = sign * (x, y, z):
+    # sign = 1 for bcrs, -1 for srs where the conjugate is applied first.
+    n = out.shape[0]
+    for i in range(n):
+        q = attitudes[i if attitudes.shape[0] > 1 else 0]
+        v = vectors[i if vectors.shape[0] > 1 else 0]
+        w = q[0]
+        ux, uy, uz = sign * q[1], sign * q[2], sign * q[3]
+        v0, v1, v2 = v[0], v[1], v[2]
+        a = w*w - (ux*ux + uy*uy + uz*uz)
+        b = 2 * (ux*v0 + uy*v1 + uz*v2)
+        out[i, 0] = a*v0 + b*ux + 2*w*(uy*v2 - uz*v1)
+        out[i, 1] = a*v1 + b*uy + 2*w*(uz*v0 - ux*v2)
+        out[i, 2] = a*v2 + b*uz + 2*w*(ux*v1 - uy*v0)
+
+
+def _rotate(attitudes, vectors, out, sign):
+    attitudes = np.ascontiguousarray(attitudes, dtype=np.float64).reshape(-1, 4)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float64).reshape(-1, 3)
+    out = _output(out, (_rows(attitudes, vectors), 3))
+    _rotate_kernel(attitudes, vectors, out, sign)
+    return out
+
+
+def bcrs_batch(attitudes, vectors, out=None):
+    """
+    Batched bcrs: attitude * vector * attitude.conjugate() for every row.
+    :param attitudes: (N, 4) quaternions, or (1, 4).
+    :param vectors: (N, 3) vectors, or (1, 3).
+    :param out: (N, 3) array for the result, allocated if None.
+    :return: out
+    :raises ValueError: if the rows of attitudes and vectors differ and neither has one,
+        or if out is not a C-contiguous float64 (N, 3) array.
+    """
+    return _rotate(attitudes, vectors, out, 1.)
+
+
+def srs_batch(attitudes, vectors, out=None):
+    """
+    Batched srs: attitude.conjugate() * vector * attitude for every row.
+    Same arguments as bcrs_batch.
+    """
+    return _rotate(attitudes, vectors, out, -1.)
+
+
+def _components(attitude):
+    return np.array([attitude.w, attitude.x, attitude.y, attitude.z], dtype=np.float64)
+
+
 def bcrs(attitude, vector):
     '''
     Changes coordinates of a vector in BCRS to SRS frame.
     '''
-    q_vector_bcrs = to_quaternion(vector)
-    q_vector_srs = attitude * q_vector_bcrs * attitude.conjugate()
-
-    return q_vector_srs.to_vector()
+    return bcrs_batch(_components(attitude), vector)[0]
 
 
 def srs(attitude, vector):
     '''
     Changes coordinates of a vector in SRS to BCRS frame.
     '''
-    q_vector_srs = to_quaternion(vector)
-    q_vector_bcrs = attitude.conjugate() * q_vector_srs * attitude  
-    return q_vector_bcrs.to_vector()
\ No newline at end of file
+    return srs_batch(_components(attitude), vector)[0]
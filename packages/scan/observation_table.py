@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar table of observations (star transits).
+
+Observations are appended in batches to growing column arrays. A table can
+also stream to a file: once a row group is complete it is written out and
+dropped from memory, so the transits of a long simulation never need to be
+held at once. The formats are chosen by the extension of the path:
+    .parquet      Parquet row groups (needs pyarrow).
+    .h5, .hdf5    chunked, resizable HDF5 datasets (needs h5py), read back as
+                  the datasets, whose rows are only read when indexed.
+    .npz          one .npy member per column and row group, read back in memory:
+                  for tables larger than the memory use a directory or HDF5.
+    otherwise     a directory of raw column files, read back memory-mapped.
+"""
+
+import json
+import os
+import zipfile
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+ROW_GROUP_SIZE = 2 ** 20
+
+# dtype and shape of a row of every column.
+COLUMNS = (('source_id', np.int64, ()),
+           ('time', np.float64, ()),
+           ('along_scan', np.float64, ()),
+           ('across_scan', np.float64, ()),
+           ('direction', np.float64, (3,)),
+           ('attitude_index', np.int64, ()))
+
+
+class ObservationTable:
+    """
+    Observations as one array per column.
+
+    Args:
+        source_id (np.ndarray): (N,) index of the observed source in the catalogue.
+        time (np.ndarray): (N,) time of the observation [days].
+        along_scan (np.ndarray): (N,) along-scan field angle of the source [rad].
+        across_scan (np.ndarray): (N,) across-scan field angle of the source [rad].
+        direction (np.ndarray): (N, 3) telescope axis in BCRS.
+        attitude_index (np.ndarray): (N,) row of the attitude sample at or before the
+            observation in the attitude table, -1 if unknown.
+    """
+    columns = tuple(name for name, dtype, shape in COLUMNS)
+
+    def __init__(self, source_id, time, along_scan, across_scan, direction, attitude_index):
+        self._data = {}
+        for (name, dtype, shape), value in zip(COLUMNS, (source_id, time, along_scan, across_scan,
+                                                         direction, attitude_index)):
+            self._data[name] = value if _is_dataset(value, dtype, shape) else \
+                np.asarray(value, dtype=dtype).reshape((-1,) + shape)
+        self._size = len(self._data['time'])
+        if any(len(column) != self._size for column in self._data.values()):
+            raise ValueError("columns of different lengths")
+        self.writer = None
+
+    @classmethod
+    def empty(cls):
+        return cls(*(np.empty((0,) + shape, dtype) for name, dtype, shape in COLUMNS))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a table written by save or stream_to. Directories are memory-mapped and
+        HDF5 columns are the datasets of the open file; npz files are read in memory.
+        """
+        return cls(*_reader(path)(path))
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        """
+        Table of the rows selected by a slice, an index array or a boolean mask.
+        """
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 or None)
+        return ObservationTable(*(_take(getattr(self, name), index) for name in self.columns))
+
+    def __repr__(self):
+        return 'ObservationTable(%d rows)' % len(self)
+
+    def append(self, source_id, time, along_scan, across_scan, direction, attitude_index=-1):
+        """
+        Appends a batch of observations; scalars (e.g. the source_id of the transits
+        of one source) are broadcast to the length of time.
+        """
+        time = np.atleast_1d(np.asarray(time, dtype=np.float64))
+        n = len(time)
+        values = (source_id, time, along_scan, across_scan, direction, attitude_index)
+        batch = {name: np.broadcast_to(np.asarray(value, dtype=dtype), (n,) + shape)
+                 for (name, dtype, shape), value in zip(COLUMNS, values)}
+
+        # Capacities grow geometrically, so appends are amortized O(batch).
+        needed = self._size + n
+        capacity = len(self._data['time'])
+        if needed > capacity:
+            capacity = max(needed, 2 * capacity, 1024)
+            for name, dtype, shape in COLUMNS:
+                column = np.empty((capacity,) + shape, dtype)
+                column[:self._size] = self._data[name][:self._size]
+                self._data[name] = column
+        for name in self.columns:
+            self._data[name][self._size:needed] = batch[name]
+        self._size = needed
+
+        if self.writer is not None and self._size >= self.writer.row_group_size:
+            self.flush()
+
+    def sort(self):
+        """
+        Sorts the rows held in memory by time, keeping the order of equal times.
+        """
+        order = np.argsort(self.time, kind='stable')
+        for name in self.columns:
+            self._data[name] = np.asarray(getattr(self, name))[order]
+
+    def save(self, path, row_group_size=ROW_GROUP_SIZE):
+        """
+        Writes the table to path, in row groups of row_group_size rows.
+        """
+        writer = _writer(path)(path, row_group_size)
+        for start in range(0, len(self), row_group_size):
+            writer.write(self[start:start + row_group_size])
+        writer.close()
+
+    def stream_to(self, path, row_group_size=ROW_GROUP_SIZE):
+        """
+        From now on, writes the rows to path in row groups as they are appended and
+        drops them from memory. close() writes the last rows and closes the file.
+        """
+        self.writer = _writer(path)(path, row_group_size)
+        self.flush()
+
+    def flush(self):
+        """
+        Writes the complete row groups held in memory to the stream.
+        """
+        if self.writer is None:
+            return
+        size = self.writer.row_group_size
+        n = len(self) - len(self) % size
+        for start in range(0, n, size):
+            self.writer.write(self[start:start + size])
+        self._drop(n)
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.flush()
+        if len(self):
+            self.writer.write(self[:])
+            self._drop(len(self))
+        self.writer.close()
+        self.writer = None
+
+    def _drop(self, n):
+        for name in self.columns:
+            self._data[name] = getattr(self, name)[n:].copy()
+        self._size -= n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _is_dataset(value, dtype, shape):
+    """
+    True for array-likes read on indexing, such as h5py datasets, of the column's type.
+    """
+    return (not isinstance(value, np.ndarray) and hasattr(value, 'dtype') and hasattr(value, 'shape')
+            and value.dtype == dtype and tuple(value.shape[1:]) == shape)
+
+
+def _take(column, index):
+    """
+    Rows of a column; datasets are read whole for index arrays, which they may not support.
+    """
+    if isinstance(column, np.ndarray) or isinstance(index, slice):
+        return column[index]
+    return np.asarray(column)[index]
+
+
+def _column(name):
+    def column(self):
+        data = self._data[name]
+        # a whole dataset is returned as is rather than read by slicing it
+        return data if len(data) == self._size and not isinstance(data, np.ndarray) else data[:self._size]
+    return property(column)
+
+
+for _name in ObservationTable.columns:
+    setattr(ObservationTable, _name, _column(_name))
+
+
+def _extension(path):
+    return os.path.splitext(path)[1].lower()
+
+
+def _writer(path):
+    return {'.parquet': ParquetWriter, '.h5': HDF5Writer, '.hdf5': HDF5Writer,
+            '.npz': NpzWriter}.get(_extension(path), DirectoryWriter)
+
+
+def _reader(path):
+    return {'.parquet': read_parquet, '.h5': read_hdf5, '.hdf5': read_hdf5,
+            '.npz': read_npz}.get(_extension(path), read_directory)
+
+
+class DirectoryWriter:
+    """
+    Appends the rows to one raw file per column, described by a meta.json.
+    """
+
+    def __init__(self, path, row_group_size):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.rows = 0
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(os.path.join(path, name + '.bin'), 'wb') for name in ObservationTable.columns}
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {'rows': self.rows,
+                'columns': {name: [np.dtype(dtype).str, list(shape)] for name, dtype, shape in COLUMNS}}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def write(self, table):
+        for name in table.columns:
+            self.files[name].write(np.ascontiguousarray(getattr(table, name)).tobytes())
+        self.rows += len(table)
+        self._write_meta()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def read_directory(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = []
+    for name in ObservationTable.columns:
+        dtype, shape = meta['columns'][name]
+        shape = (meta['rows'],) + tuple(shape)
+        if meta['rows'] == 0:
+            columns.append(np.empty(shape, dtype))
+        else:
+            columns.append(np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r', shape=shape))
+    return columns
+
+
+class NpzWriter:
+    """
+    Writes every row group as .npy members '<column>/<group>' of a zip file.
+    """
+
+    def __init__(self, path, row_group_size):
+        self.row_group_size = row_group_size
+        self.groups = 0
+        self.file = zipfile.ZipFile(path, 'w', allowZip64=True)
+
+    def write(self, table):
+        for name in table.columns:
+            with self.file.open('%s/%08d.npy' % (name, self.groups), 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(getattr(table, name)))
+        self.groups += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_npz(path):
+    """
+    Columns of an npz file, the row groups of every column concatenated in memory.
+    """
+    with np.load(path) as data:
+        columns = []
+        for name, dtype, shape in COLUMNS:
+            groups = sorted(key for key in data.files if key.startswith(name + '/'))
+            columns.append(np.concatenate([data[key] for key in groups]) if groups
+                           else np.empty((0,) + shape, dtype))
+    return columns
+
+
+def _require(module, name):
+    if module is None:
+        raise ImportError("%s is needed to read and write this format" % name)
+
+
+class ParquetWriter:
+    """
+    Writes Parquet row groups, the direction as direction_x, direction_y and direction_z.
+    """
+
+    def __init__(self, path, row_group_size):
+        _require(pyarrow, 'pyarrow')
+        self.row_group_size = row_group_size
+        fields = []
+        for name, dtype, shape in COLUMNS:
+            names = [name + '_' + axis for axis in 'xyz'] if shape else [name]
+            fields += [(n, pyarrow.from_numpy_dtype(dtype)) for n in names]
+        self.schema = pyarrow.schema(fields)
+        self.file = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, table):
+        arrays = []
+        for name, dtype, shape in COLUMNS:
+            column = getattr(table, name)
+            arrays += [column[:, k] for k in range(3)] if shape else [column]
+        self.file.write_table(pyarrow.Table.from_arrays([pyarrow.array(a) for a in arrays], schema=self.schema),
+                              row_group_size=self.row_group_size)
+
+    def close(self):
+        self.file.close()
+
+
+def read_parquet(path):
+    _require(pyarrow, 'pyarrow')
+    data = pyarrow.parquet.read_table(path, memory_map=True)
+    columns = []
+    for name, dtype, shape in COLUMNS:
+        if shape:
+            columns.append(np.stack([data.column(name + '_' + axis).to_numpy() for axis in 'xyz'], axis=1))
+        else:
+            columns.append(data.column(name).to_numpy())
+    return columns
+
+
+class HDF5Writer:
+    """
+    Appends the rows to resizable HDF5 datasets chunked by row group.
+    """
+
+    def __init__(self, path, row_group_size):
+        _require(h5py, 'h5py')
+        self.row_group_size = row_group_size
+        self.file = h5py.File(path, 'w')
+        for name, dtype, shape in COLUMNS:
+            self.file.create_dataset(name, shape=(0,) + shape, maxshape=(None,) + shape, dtype=dtype,
+                                     chunks=(min(row_group_size, 2 ** 16),) + shape)
+
+    def write(self, table):
+        for name in table.columns:
+            dataset = self.file[name]
+            n = dataset.shape[0]
+            dataset.resize(n + len(table), axis=0)
+            dataset[n:] = getattr(table, name)
+
+    def close(self):
+        self.file.close()
+
+
+def read_hdf5(path):
+    """
+    Datasets of an HDF5 file, left open for reading as long as they are referenced.
+    """
+    _require(h5py, 'h5py')
+    f = h5py.File(path, 'r')
+    return [f[name] for name in ObservationTable.columns]
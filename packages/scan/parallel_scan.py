@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Process-parallel transit search.
+
+The attitude, the star vectors and the transits.bracket_geometry of the
+attitude samples are written once as .npy files, in /dev/shm when there is one,
+and every worker process maps them read-only, so the pool shares one copy of
+them in memory and the work on the whole attitude is only done once. The
+catalogue is split into partitions, each worker solves the transits of a
+partition with transits.solve_transits, which never modifies the attitude, and
+the columnar results are merged in time order.
+"""
+
+import concurrent.futures
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from attitude_table import AttitudeTable
+from observation_table import ObservationTable
+import propagator
+import transits
+
+SHARED_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Partitions per process, so that the slower partitions are balanced.
+PARTITIONS_PER_PROCESS = 4
+
+
+class SharedAttitude:
+    """
+    Read-only attitude mapped from the files written by SharedAttitude.write, with
+    the attributes of Attitude used by transits.solve_transits.
+
+    Attributes:
+        storage (AttitudeTable): memory-mapped samples.
+        solution (DenseSolution): memory-mapped dense output, or None.
+    """
+
+    def __init__(self, directory):
+        def load(name):
+            return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+        self.storage = AttitudeTable(*(load(name) for name in AttitudeTable.columns))
+        self.solution = None
+        if os.path.exists(os.path.join(directory, 'rcont.npy')):
+            p = np.load(os.path.join(directory, 'solution.npy'))
+            self.solution = propagator.DenseSolution(load('solution_t'), load('rcont'),
+                                                     p[0:4], p[4], p[5:8], p[8:11], p[11:14])
+
+    @staticmethod
+    def write(att, directory):
+        """
+        Writes att.storage and att.solution to directory.
+        """
+        for name in AttitudeTable.columns:
+            np.save(os.path.join(directory, name + '.npy'), getattr(att.storage, name))
+        solution = att.solution
+        if solution is not None:
+            np.save(os.path.join(directory, 'solution_t.npy'), solution.t)
+            np.save(os.path.join(directory, 'rcont.npy'), solution.rcont)
+            np.save(os.path.join(directory, 'solution.npy'),
+                    np.concatenate((solution.params, [solution.epsilon], solution.l_, solution.j_, solution.k_)))
+
+
+# State of a worker process, set by _initialize.
+_attitude = None
+_stars = None
+_geometry = None
+
+
+def _initialize(directory):
+    global _attitude, _stars, _geometry
+    _attitude = SharedAttitude(directory)
+    _stars = np.load(os.path.join(directory, 'stars.npy'), mmap_mode='r')
+    _geometry = transits.BracketGeometry(*(np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+                                           for name in transits.BracketGeometry._fields))
+
+
+def _solve(scanner, start, stop, xtol):
+    crossings = transits.solve_transits(scanner, _attitude, np.array(_stars[start:stop]), xtol,
+                                        geometry=_geometry)
+    return crossings.star_index + start, crossings.time, crossings.across_scan
+
+
+def scan_sky_parallel(scanner, att, sky, processes=None, partitions=None, xtol=1e-10,
+                      directory=SHARED_DIRECTORY):
+    """
+    transits.solve_transits of the stars of sky on a pool of processes.
+
+    Args:
+        scanner (Scanner): field of view, its obs_times, stars_positions and observations
+            are filled as by star_finder, with the telescope axis and the field angles
+            at the transit times, and the rows of the samples of att.storage at or
+            before them.
+        att (Attitude): attitude, left unchanged.
+        sky (Sky or SkyCatalog): stars to be scanned.
+        processes (int): size of the pool, os.cpu_count() by default.
+        partitions (int): number of parts of the catalogue, PARTITIONS_PER_PROCESS per process by default.
+        xtol (float): tolerance on the transit times [days].
+        directory (str): where the shared files are written, the default temporary
+            directory if None.
+    Returns:
+        transits.Crossings: the transits of all the stars, sorted by time.
+    """
+    stars = transits.star_vectors(sky)
+    processes = processes or os.cpu_count()
+    partitions = max(min(partitions or PARTITIONS_PER_PROCESS * processes, len(stars)), 1)
+    bounds = np.linspace(0, len(stars), partitions + 1).astype(int)
+
+    shared = tempfile.mkdtemp(dir=directory, prefix='gaialab-scan-')
+    try:
+        SharedAttitude.write(att, shared)
+        np.save(os.path.join(shared, 'stars.npy'), stars)
+        for name, column in zip(transits.BracketGeometry._fields, transits.bracket_geometry(att.storage)):
+            np.save(os.path.join(shared, name + '.npy'), column)
+        fov = type(scanner)(ccd=scanner.ccd, delta_z=scanner.delta_z, delta_y=scanner.delta_y)
+        with concurrent.futures.ProcessPoolExecutor(processes, initializer=_initialize,
+                                                    initargs=(shared,)) as pool:
+            futures = [pool.submit(_solve, fov, start, stop, xtol)
+                       for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            results = [future.result() for future in futures]
+    finally:
+        shutil.rmtree(shared, ignore_errors=True)
+
+    star_index, time, across_scan = (np.concatenate(column) for column in zip(*results)) if results else \
+        (np.empty(0, dtype=np.intp), np.empty(0), np.empty(0))
+    order = np.lexsort((star_index, time))
+    crossings = transits.Crossings(star_index[order], time[order], across_scan[order])
+
+    # Telescope axis in BCRS: first row of the rotation matrix of the attitude.
+    q = transits.attitude_function(att)(crossings.time) if len(crossings.time) else np.empty((0, 4))
+    positions = transits.rotation_matrices(q)[:, 0]
+    along_scan, _ = transits.field_angles(q, stars[crossings.star_index])
+    rows = att.storage.index_of(crossings.time) if len(crossings.time) else np.empty(0, dtype=np.intp)
+    scanner.obs_times = list(crossings.time)
+    scanner.stars_positions = list(positions)
+    scanner.observations = ObservationTable(crossings.star_index, crossings.time, along_scan,
+                                            crossings.across_scan, positions, rows)
+    return crossings
@@ -4,6 +4,8 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
+import frame_transformations as ft
+
 #def plot_att(scan):
 
 
@@ -22,21 +24,16 @@ def plot_attitude(satellite, ti, tf, dt):
     attitude = (t, x, y, z)
     Each graph plots time in days versus each component evolution wrt time.
     '''
-    n_steps = (tf-ti)/dt
-    t = np.linspace(ti, tf, n_steps)
-
-    qt_list = []
-    qx_list = []
-    qy_list = []
-    qz_list = []
+    # The table starts one step after its initial time and may stop short of its final
+    # time by rounding, so the requested span is clipped to the stored one.
+    n_steps = int(round((tf-ti)/dt)) + 1
+    t = np.clip(np.linspace(ti, tf, n_steps), satellite.storage.t[0], satellite.storage.t[-1])
 
-    satellite.reset_to_time(ti)
-    for i in np.arange(n_steps):
-        satellite.update(dt)
-        qt_list.append(satellite.attitude.w)
-        qx_list.append(satellite.attitude.x)
-        qy_list.append(satellite.attitude.y)
-        qz_list.append(satellite.attitude.z)
+    attitude = satellite.attitude_at(t)
+    qt_list = attitude[:, 0]
+    qx_list = attitude[:, 1]
+    qy_list = attitude[:, 2]
+    qz_list = attitude[:, 3]
 
     fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2)
     fig.subplots_adjust(left=0.2, wspace=0.6)
@@ -105,13 +102,8 @@ def plot_xi(satellite, dt, n):
     
                           
 def plot_3DX(satellite, dt, n):
-    satellite.Reset()
-    x_list = []
-    for i in np.arange(n/dt):
-        satellite.Update(dt)
-        x_quat = satellite.attitude * Quaternion(0,1,0,0) * satellite.attitude.conjugate() 
-        x_ = quaternion_to_vector(x_quat)
-        x_list.append(x_)
+    t = dt * np.arange(1, int(n/dt) + 1)
+    x_list = ft.bcrs_batch(satellite.attitude_at(t), np.array([1, 0, 0]))
     
     x_listx = [i[0] for i in x_list]
     x_listy = [i[1] for i in x_list]
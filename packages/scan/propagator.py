@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled propagation of the Nominal Scanning Law.
+
+The kernels here are nopython versions of Attitude.update: they step the
+scanning law angles, the z-axis and the attitude quaternion and write every
+step straight into the columns of an AttitudeTable.
+
+Besides the first order 'euler' kernel, the state (lambda, nu, omega, z) can be
+integrated with a fixed step 'rk4' or an adaptive Dormand-Prince 5(4) 'dopri'
+scheme. Both keep a dense output (DenseSolution) so that the attitude can be
+evaluated at any time of the integrated span without stepping again.
+"""
+
+import numpy as np
+from numba import jit
+
+from attitude_table import AttitudeTable
+from quaternion import multiply_arrays
+
+INTEGRATORS = ('euler', 'rk4', 'dopri')
+
+# Default tolerances of the adaptive integrator, on angles [rad].
+DOPRI_ATOL = 1e-12
+DOPRI_RTOL = 0.
+
+
+@jit(nopython=True)
+def quat_mult(a, b, out):
+    """
+    Hamilton product a*b of quaternions stored as (w, x, y, z), as in Quaternion.__mul__.
+    """
+    w = -a[1] * b[1] - a[2] * b[2] - a[3] * b[3] + a[0] * b[0]
+    x = a[1] * b[0] + a[2] * b[3] - a[3] * b[2] + a[0] * b[1]
+    y = -a[1] * b[3] + a[2] * b[0] + a[3] * b[1] + a[0] * b[2]
+    z = a[1] * b[2] - a[2] * b[1] + a[3] * b[0] + a[0] * b[3]
+    out[0] = w
+    out[1] = x
+    out[2] = y
+    out[3] = z
+
+
+@jit(nopython=True)
+def euler_kernel(n_steps, dt, t, angles, z, q, params, l_, j_, k_,
+                 out_t, out_w, out_z, out_x, out_q, out_angles):
+    """
+    Euler integration of the scanning law, step for step equivalent to Attitude.update.
+
+    Args:
+        n_steps (int): number of steps to integrate.
+        dt (float): step [days].
+        t (float): time before the first step [days].
+        angles (np.ndarray): (lambda, nu, omega), updated in place.
+        z (np.ndarray): z-axis of SRS, updated in place.
+        q (np.ndarray): attitude quaternion (w, x, y, z), updated in place.
+        params (np.ndarray): (lambda_dot, S, xi, wz).
+        l_, j_, k_ (np.ndarray): ecliptic triad.
+        out_* (np.ndarray): preallocated columns with at least n_steps rows.
+    Returns:
+        float: time after the last step.
+    """
+    lambda_dot = params[0]
+    S = params[1]
+    xi = params[2]
+    wz = params[3]
+    s = np.empty(3)
+    w = np.empty(3)
+    dq = np.empty(4)
+    tmp = np.empty(4)
+    e_x = np.array([0., 1., 0., 0.])
+    q_conj = np.empty(4)
+
+    for i in range(n_steps):
+        t = t + dt
+        angles[0] = angles[0] + lambda_dot * dt
+
+        nu_dot = lambda_dot * (np.sqrt(S ** 2 - np.cos(angles[1]) ** 2)
+                               + np.cos(xi) * np.sin(angles[1])) / np.sin(xi)
+        angles[1] = angles[1] + nu_dot * dt
+
+        omega_dot = wz - nu_dot * np.cos(xi) - angles[0] * np.sin(xi) * np.sin(angles[1])
+        angles[2] = angles[2] + omega_dot * dt
+
+        for k in range(3):
+            s[k] = l_[k] * np.cos(angles[0]) + j_[k] * np.sin(angles[0])
+
+        # z_dot = (k x z)*lambda_dot + (s x z)*nu_dot
+        z0 = z[0] + ((k_[1] * z[2] - k_[2] * z[1]) * lambda_dot + (s[1] * z[2] - s[2] * z[1]) * nu_dot) * dt
+        z1 = z[1] + ((k_[2] * z[0] - k_[0] * z[2]) * lambda_dot + (s[2] * z[0] - s[0] * z[2]) * nu_dot) * dt
+        z2 = z[2] + ((k_[0] * z[1] - k_[1] * z[0]) * lambda_dot + (s[0] * z[1] - s[1] * z[0]) * nu_dot) * dt
+        z_norm = np.sqrt(z0 ** 2 + z1 ** 2 + z2 ** 2)
+        z[0] = z0 / z_norm
+        z[1] = z1 / z_norm
+        z[2] = z2 / z_norm
+
+        for k in range(3):
+            w[k] = k_[k] * lambda_dot + s[k] * nu_dot + z[k] * omega_dot
+
+        # Same rotation angle as Attitude.update, which only uses w_[0].
+        d_zheta = np.sqrt(w[0] ** 2 + w[0] ** 2 + w[0] ** 2) * dt
+        w_norm = np.sqrt(w[0] ** 2 + w[1] ** 2 + w[2] ** 2)
+        dq[0] = np.cos(d_zheta / 2.)
+        for k in range(3):
+            dq[k + 1] = np.sin(d_zheta / 2.) * (w[k] / w_norm)
+        quat_mult(dq, q, tmp)
+        q[:] = tmp
+
+        # x axis: q * (0, 1, 0, 0) * q.conjugate()
+        q_conj[0] = q[0]
+        for k in range(1, 4):
+            q_conj[k] = -q[k]
+        quat_mult(q, e_x, tmp)
+        quat_mult(tmp, q_conj, dq)
+
+        out_t[i] = t
+        for k in range(3):
+            out_w[i, k] = w[k]
+            out_z[i, k] = z[k]
+            out_x[i, k] = dq[k + 1]
+            out_angles[i, k] = angles[k]
+        for k in range(4):
+            out_q[i, k] = q[k]
+
+    return t
+
+
+@jit(nopython=True)
+def nsl_derivatives(y, params, l_, j_, k_, dy):
+    """
+    Time derivative of the scanning law state y = (lambda, nu, omega, z0, z1, z2).
+    (Lindegren, SAG-LL-35, Eq.9-13)
+    """
+    lambda_dot = params[0]
+    S = params[1]
+    xi = params[2]
+    wz = params[3]
+    nu_dot = lambda_dot * (np.sqrt(S ** 2 - np.cos(y[1]) ** 2) + np.cos(xi) * np.sin(y[1])) / np.sin(xi)
+    s0 = l_[0] * np.cos(y[0]) + j_[0] * np.sin(y[0])
+    s1 = l_[1] * np.cos(y[0]) + j_[1] * np.sin(y[0])
+    s2 = l_[2] * np.cos(y[0]) + j_[2] * np.sin(y[0])
+    dy[0] = lambda_dot
+    dy[1] = nu_dot
+    dy[2] = wz - nu_dot * np.cos(xi) - lambda_dot * np.sin(xi) * np.sin(y[1])
+    dy[3] = (k_[1] * y[5] - k_[2] * y[4]) * lambda_dot + (s1 * y[5] - s2 * y[4]) * nu_dot
+    dy[4] = (k_[2] * y[3] - k_[0] * y[5]) * lambda_dot + (s2 * y[3] - s0 * y[5]) * nu_dot
+    dy[5] = (k_[0] * y[4] - k_[1] * y[3]) * lambda_dot + (s0 * y[4] - s1 * y[3]) * nu_dot
+
+
+@jit(nopython=True)
+def rk4_kernel(n_steps, dt, t, y, params, l_, j_, k_, out_t, out_y, out_rcont):
+    """
+    Classical Runge-Kutta integration of the scanning law state.
+
+    Args:
+        n_steps (int): number of steps.
+        dt (float): step [days].
+        t (float): initial time [days].
+        y (np.ndarray): (6,) state, updated in place.
+        params, l_, j_, k_: as in euler_kernel.
+        out_t (np.ndarray): (n_steps,) time at the end of every step.
+        out_y (np.ndarray): (n_steps, 6) state at the end of every step.
+        out_rcont (np.ndarray): (n_steps, 5, 6) dense output coefficients (cubic Hermite).
+    Returns:
+        float: time after the last step.
+    """
+    m = y.shape[0]
+    k1 = np.empty(m)
+    k2 = np.empty(m)
+    k3 = np.empty(m)
+    k4 = np.empty(m)
+    tmp = np.empty(m)
+    t0 = t
+    nsl_derivatives(y, params, l_, j_, k_, k1)
+    for i in range(n_steps):
+        for c in range(m):
+            tmp[c] = y[c] + 0.5 * dt * k1[c]
+        nsl_derivatives(tmp, params, l_, j_, k_, k2)
+        for c in range(m):
+            tmp[c] = y[c] + 0.5 * dt * k2[c]
+        nsl_derivatives(tmp, params, l_, j_, k_, k3)
+        for c in range(m):
+            tmp[c] = y[c] + dt * k3[c]
+        nsl_derivatives(tmp, params, l_, j_, k_, k4)
+        for c in range(m):
+            tmp[c] = y[c] + dt / 6. * (k1[c] + 2. * k2[c] + 2. * k3[c] + k4[c])
+        # k1 of the next step is the derivative at the end of this one.
+        for c in range(m):
+            out_rcont[i, 0, c] = y[c]
+            out_rcont[i, 1, c] = tmp[c] - y[c]
+            out_rcont[i, 2, c] = dt * k1[c] - out_rcont[i, 1, c]
+        nsl_derivatives(tmp, params, l_, j_, k_, k1)
+        for c in range(m):
+            out_rcont[i, 3, c] = out_rcont[i, 1, c] - dt * k1[c] - out_rcont[i, 2, c]
+            out_rcont[i, 4, c] = 0.
+            y[c] = tmp[c]
+            out_y[i, c] = y[c]
+        t = t0 + (i + 1) * dt
+        out_t[i] = t
+    return t
+
+
+@jit(nopython=True)
+def dopri_kernel(t, tf, h, y, atol, rtol, params, l_, j_, k_, out_t, out_y, out_rcont):
+    """
+    Adaptive Dormand-Prince 5(4) integration of the scanning law state, with the
+    dense output of Hairer, Norsett & Wanner (Solving ODEs I, II.6).
+
+    Integrates from t towards tf until tf is reached or the output buffers are full.
+
+    Args:
+        t (float): initial time [days].
+        tf (float): final time [days].
+        h (float): trial step [days].
+        y (np.ndarray): (6,) state, updated in place.
+        atol, rtol (float): absolute and relative tolerances on the state.
+        params, l_, j_, k_: as in euler_kernel.
+        out_*: buffers for accepted steps, as in rk4_kernel.
+    Returns:
+        (int, float, float): accepted steps written, time reached, next trial step.
+    """
+    m = y.shape[0]
+    k1 = np.empty(m)
+    k2 = np.empty(m)
+    k3 = np.empty(m)
+    k4 = np.empty(m)
+    k5 = np.empty(m)
+    k6 = np.empty(m)
+    k7 = np.empty(m)
+    y1 = np.empty(m)
+    tmp = np.empty(m)
+    capacity = out_t.shape[0]
+    n = 0
+    nsl_derivatives(y, params, l_, j_, k_, k1)
+    while t < tf and n < capacity:
+        last = False
+        if t + h >= tf:
+            h = tf - t
+            last = True
+        for c in range(m):
+            tmp[c] = y[c] + h * (k1[c] / 5.)
+        nsl_derivatives(tmp, params, l_, j_, k_, k2)
+        for c in range(m):
+            tmp[c] = y[c] + h * (3. / 40. * k1[c] + 9. / 40. * k2[c])
+        nsl_derivatives(tmp, params, l_, j_, k_, k3)
+        for c in range(m):
+            tmp[c] = y[c] + h * (44. / 45. * k1[c] - 56. / 15. * k2[c] + 32. / 9. * k3[c])
+        nsl_derivatives(tmp, params, l_, j_, k_, k4)
+        for c in range(m):
+            tmp[c] = y[c] + h * (19372. / 6561. * k1[c] - 25360. / 2187. * k2[c]
+                                 + 64448. / 6561. * k3[c] - 212. / 729. * k4[c])
+        nsl_derivatives(tmp, params, l_, j_, k_, k5)
+        for c in range(m):
+            tmp[c] = y[c] + h * (9017. / 3168. * k1[c] - 355. / 33. * k2[c] + 46732. / 5247. * k3[c]
+                                 + 49. / 176. * k4[c] - 5103. / 18656. * k5[c])
+        nsl_derivatives(tmp, params, l_, j_, k_, k6)
+        for c in range(m):
+            y1[c] = y[c] + h * (35. / 384. * k1[c] + 500. / 1113. * k3[c] + 125. / 192. * k4[c]
+                                - 2187. / 6784. * k5[c] + 11. / 84. * k6[c])
+        nsl_derivatives(y1, params, l_, j_, k_, k7)
+
+        err = 0.
+        for c in range(m):
+            e = h * (71. / 57600. * k1[c] - 71. / 16695. * k3[c] + 71. / 1920. * k4[c]
+                     - 17253. / 339200. * k5[c] + 22. / 525. * k6[c] - 1. / 40. * k7[c])
+            scale = atol + rtol * max(abs(y[c]), abs(y1[c]))
+            err += (e / scale) ** 2
+        err = np.sqrt(err / m)
+
+        if err <= 1.:
+            for c in range(m):
+                dy = y1[c] - y[c]
+                bspl = h * k1[c] - dy
+                out_rcont[n, 0, c] = y[c]
+                out_rcont[n, 1, c] = dy
+                out_rcont[n, 2, c] = bspl
+                out_rcont[n, 3, c] = dy - h * k7[c] - bspl
+                out_rcont[n, 4, c] = h * (-12715105075. / 11282082432. * k1[c]
+                                          + 87487479700. / 32700410799. * k3[c]
+                                          - 10690763975. / 1880347072. * k4[c]
+                                          + 701980252875. / 199316789632. * k5[c]
+                                          - 1453857185. / 822651844. * k6[c]
+                                          + 69997945. / 29380423. * k7[c])
+                y[c] = y1[c]
+                k1[c] = k7[c]
+                out_y[n, c] = y[c]
+            t = tf if last else t + h
+            out_t[n] = t
+            n += 1
+            fac = 10. if err == 0. else min(10., max(0.2, 0.9 * err ** -0.2))
+        else:
+            fac = max(0.2, 0.9 * err ** -0.2)
+        h = h * fac
+    return n, t, h
+
+
+class DenseSolution:
+    """
+    Continuous solution of the scanning law state between the integration nodes.
+
+    On every step [t_i, t_i+1] of length h the state at t_i + theta*h is
+        r0 + theta*(r1 + (1-theta)*(r2 + theta*(r3 + (1-theta)*r4)))
+    which is the Dormand-Prince dense output, or a cubic Hermite polynomial when r4 = 0.
+
+    Args:
+        t (np.ndarray): (M+1,) integration nodes [days].
+        rcont (np.ndarray): (M, 5, 6) dense output coefficients of every step.
+        params (np.ndarray): (lambda_dot, S, xi, wz).
+        epsilon (float): obliquity of the equator [rad].
+        l_, j_, k_ (np.ndarray): ecliptic triad.
+    """
+
+    def __init__(self, t, rcont, params, epsilon, l_, j_, k_):
+        self.t = t
+        self.rcont = rcont
+        self.params = params
+        self.epsilon = epsilon
+        self.l_, self.j_, self.k_ = l_, j_, k_
+
+    @property
+    def n_steps(self):
+        return self.rcont.shape[0]
+
+    def covers(self, times):
+        """
+        True if all the times are within the integrated span.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        return times.size == 0 or (self.t[0] <= times.min() and times.max() <= self.t[-1])
+
+    def state(self, times):
+        """
+        State (lambda, nu, omega, z0, z1, z2) at the given times, shape (N, 6).
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        if np.any(times < self.t[0]) or np.any(times > self.t[-1]):
+            raise ValueError("times outside of the integrated span [%r, %r]" % (self.t[0], self.t[-1]))
+        seg = np.clip(np.searchsorted(self.t, times, side='right') - 1, 0, self.n_steps - 1)
+        h = self.t[seg + 1] - self.t[seg]
+        theta = ((times - self.t[seg]) / h)[:, None]
+        r = self.rcont[seg]
+        return r[:, 0] + theta * (r[:, 1] + (1 - theta) * (r[:, 2] + theta * (r[:, 3] + (1 - theta) * r[:, 4])))
+
+    def derivatives(self, y):
+        """
+        Vectorised nsl_derivatives for an (N, 6) array of states.
+        """
+        lambda_dot, S, xi, wz = self.params
+        nu_dot = lambda_dot * (np.sqrt(S ** 2 - np.cos(y[:, 1]) ** 2) + np.cos(xi) * np.sin(y[:, 1])) / np.sin(xi)
+        omega_dot = wz - nu_dot * np.cos(xi) - lambda_dot * np.sin(xi) * np.sin(y[:, 1])
+        return np.full_like(nu_dot, lambda_dot), nu_dot, omega_dot
+
+    def quaternions(self, y):
+        """
+        Attitude quaternions q1*q2*q3*q4*q5 of the scanning law angles in y, shape (N, 4).
+        """
+        xi = self.params[2]
+        n = y.shape[0]
+        zero = np.zeros(n)
+        q = np.tile([np.cos(self.epsilon / 2), np.sin(self.epsilon / 2), 0., 0.], (n, 1))
+        q = multiply_arrays(q, np.stack((np.cos(y[:, 0] / 2), zero, zero, np.sin(y[:, 0] / 2)), axis=1))
+        half_nu = (y[:, 1] - np.pi / 2.) / 2
+        q = multiply_arrays(q, np.stack((np.cos(half_nu), np.sin(half_nu), zero, zero), axis=1))
+        half_xi = (np.pi / 2. - xi) / 2
+        q = multiply_arrays(q, np.tile([np.cos(half_xi), 0., np.sin(half_xi), 0.], (n, 1)))
+        return multiply_arrays(q, np.stack((np.cos(y[:, 2] / 2), zero, zero, np.sin(y[:, 2] / 2)), axis=1))
+
+    def table(self, times):
+        """
+        Evaluates the attitude at the given times.
+        Returns:
+            AttitudeTable: one row per time.
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        y = self.state(times)
+        z = y[:, 3:6] / np.linalg.norm(y[:, 3:6], axis=1)[:, None]
+        lambda_dot, nu_dot, omega_dot = self.derivatives(y)
+        s = np.outer(np.cos(y[:, 0]), self.l_) + np.outer(np.sin(y[:, 0]), self.j_)
+        w = np.outer(lambda_dot, self.k_) + s * nu_dot[:, None] + z * omega_dot[:, None]
+        q = self.quaternions(y)
+        # x axis: first column of the rotation matrix of q.
+        x = np.stack((1 - 2 * (q[:, 2] ** 2 + q[:, 3] ** 2),
+                      2 * (q[:, 1] * q[:, 2] + q[:, 0] * q[:, 3]),
+                      2 * (q[:, 1] * q[:, 3] - q[:, 0] * q[:, 2])), axis=1)
+        return AttitudeTable(times, w, z, x, q, y[:, 0:3])
+
+    def __call__(self, times):
+        return self.table(times)
+
+
+def integrate(att, ti, tf, integrator='rk4', dt=0.01, atol=DOPRI_ATOL, rtol=DOPRI_RTOL, seed=None):
+    """
+    Integrates the scanning law state of att from ti to tf with a higher order scheme.
+
+    Args:
+        att (Attitude): attitude providing the initial state and the law parameters.
+        ti, tf (float): integration span [days].
+        integrator (str): 'rk4' (fixed step dt) or 'dopri' (adaptive, dt is the first trial step).
+        dt (float): step [days].
+        atol, rtol (float): tolerances of 'dopri'.
+        seed (AttitudeTable): one row table with the initial state, instead of the state of att.
+    Returns:
+        DenseSolution: continuous solution over [ti, tf].
+    """
+    if seed is None:
+        y = np.array([att.lambda_, att.nu, att.omega, att.z_[0], att.z_[1], att.z_[2]], dtype=np.float64)
+    else:
+        y = np.concatenate((seed.angles[0], seed.z[0]))
+    params = np.array([att.lambda_dot, att.S, att.xi, att.wz], dtype=np.float64)
+    l_, j_, k_ = (np.asarray(v, dtype=np.float64) for v in (att.l_, att.j_, att.k_))
+
+    if integrator == 'rk4':
+        n = n_steps(ti, tf, dt)
+        t = np.empty(n + 1)
+        out_y = np.empty((n, 6))
+        rcont = np.empty((n, 5, 6))
+        t[0] = ti
+        rk4_kernel(n, float(dt), float(ti), y, params, l_, j_, k_, t[1:], out_y, rcont)
+    elif integrator == 'dopri':
+        times = [np.array([float(ti)])]
+        rconts = []
+        t, h = float(ti), float(dt)
+        capacity = max(n_steps(ti, tf, dt), 16)
+        while t < tf:
+            out_t = np.empty(capacity)
+            out_y = np.empty((capacity, 6))
+            rcont = np.empty((capacity, 5, 6))
+            n, t, h = dopri_kernel(t, float(tf), h, y, atol, rtol, params, l_, j_, k_, out_t, out_y, rcont)
+            times.append(out_t[:n])
+            rconts.append(rcont[:n])
+        t = np.concatenate(times)
+        rcont = np.concatenate(rconts) if rconts else np.empty((0, 5, 6))
+    else:
+        raise ValueError("unknown integrator %r, expected one of %r" % (integrator, INTEGRATORS[1:]))
+
+    return DenseSolution(t, rcont, params, att.epsilon, l_, j_, k_)
+
+
+def n_steps(ti, tf, dt):
+    """
+    Number of steps taken by Attitude.create_storage between ti and tf,
+    the same as len(np.arange((tf - ti) / dt)).
+    """
+    return max(int(np.ceil((tf - ti) / dt)), 0)
+
+
+def propagate(att, ti, tf, dt, n=None, seed=None):
+    """
+    Integrates the attitude of att from ti to tf and returns the samples.
+
+    The integration starts from the current state of att (angles, z_ and attitude),
+    with its clock set to ti, uses the scheme named by att.integrator and leaves
+    att in the state of the last sample. With 'rk4' and 'dopri' the continuous
+    solution is kept in att.solution.
+
+    Args:
+        att (Attitude): attitude whose state is propagated.
+        ti (float): integrating time lower limit [days].
+        tf (float): integrating time upper limit [days].
+        dt (float): step of the integration [days], sampling step for 'dopri'.
+        n (int): number of steps, instead of the number of steps between ti and tf.
+        seed (AttitudeTable): one row table with the state at ti. When given, the
+            integration starts from it and att is left untouched.
+    Returns:
+        AttitudeTable: one row per step.
+    """
+    if n is None:
+        n = n_steps(ti, tf, dt)
+    integrator = getattr(att, 'integrator', 'euler')
+
+    if integrator == 'euler':
+        table = AttitudeTable.allocate(n)
+        if seed is None:
+            angles = np.array([att.lambda_, att.nu, att.omega], dtype=np.float64)
+            z = np.array(att.z_, dtype=np.float64)
+            q = np.array([att.attitude.w, att.attitude.x, att.attitude.y, att.attitude.z], dtype=np.float64)
+        else:
+            angles, z, q = seed.angles[0].copy(), seed.z[0].copy(), seed.q[0].copy()
+        params = np.array([att.lambda_dot, att.S, att.xi, att.wz], dtype=np.float64)
+        l_, j_, k_ = (np.asarray(v, dtype=np.float64) for v in (att.l_, att.j_, att.k_))
+        t = euler_kernel(n, float(dt), float(ti), angles, z, q, params, l_, j_, k_,
+                         table.t, table.w, table.z, table.x, table.q, table.angles)
+    else:
+        solution = integrate(att, ti, ti + n * dt, integrator, dt, seed=seed)
+        table = solution.table(ti + dt * np.arange(1, n + 1))
+        t = table.t[-1] if n > 0 else ti
+
+    if seed is not None:
+        return table
+
+    att.t = t
+    if integrator != 'euler':
+        att.solution = solution
+    if n > 0:
+        att.lambda_, att.nu, att.omega = table.angles[-1]
+        att.s_ = att.l_ * np.cos(att.lambda_) + att.j_ * np.sin(att.lambda_)
+        att.z_ = table.z[-1].copy()
+        att.w_ = table.w[-1].copy()
+        att.x_ = table.x[-1].copy()
+        att.attitude = table[n - 1][4]
+    return table
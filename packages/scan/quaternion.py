@@ -91,6 +91,8 @@ class Quaternion():
 
     def __mul__(self, other):
         # Allow for right multiplication by scalars, matrices and quaternions
+        if isinstance(other, QuaternionArray):
+            return NotImplemented
         if isinstance(other, Quaternion):
             x = self.x * other.w + self.y * other.z - self.z * other.y + self.w * other.x
             y = -self.x *other.z + self.y * other.w + self.z * other.x + self.w * other.y
@@ -163,3 +165,190 @@ class Quaternion():
 
 
     __array_priority__ = 10000  # big number so numpy respects left matrix multiplication with quaternions
+
+
+def multiply_arrays(a, b):
+    """
+    Hamilton product of the rows of two (N,4) arrays of quaternions stored as (w,x,y,z),
+    with the same convention as Quaternion.__mul__.
+    """
+    w = a[:, 0]*b[:, 0] - a[:, 1]*b[:, 1] - a[:, 2]*b[:, 2] - a[:, 3]*b[:, 3]
+    x = a[:, 0]*b[:, 1] + a[:, 1]*b[:, 0] + a[:, 2]*b[:, 3] - a[:, 3]*b[:, 2]
+    y = a[:, 0]*b[:, 2] - a[:, 1]*b[:, 3] + a[:, 2]*b[:, 0] + a[:, 3]*b[:, 1]
+    z = a[:, 0]*b[:, 3] + a[:, 1]*b[:, 2] - a[:, 2]*b[:, 1] + a[:, 3]*b[:, 0]
+    return np.stack((w, x, y, z), axis=1)
+
+
+def slerp(q0, q1, theta):
+    """
+    Spherical linear interpolation between the rows of two (N, 4) arrays of
+    quaternions, along the shortest arc.
+    Args:
+        q0, q1 (np.ndarray): quaternions at theta = 0 and theta = 1.
+        theta (np.ndarray): (N,) interpolation parameters in [0, 1].
+    Returns:
+        np.ndarray: (N, 4) interpolated quaternions.
+    """
+    q0 = np.atleast_2d(q0)
+    q1 = np.atleast_2d(q1)
+    theta = np.asarray(theta, dtype=np.float64).reshape(-1)
+    dot = np.sum(q0 * q1, axis=1)
+    sign = np.where(dot < 0, -1., 1.)
+    dot = np.clip(dot * sign, -1., 1.)
+    angle = np.arccos(dot)
+    sin_angle = np.sin(angle)
+    close = sin_angle < 1e-12
+    safe = np.where(close, 1., sin_angle)
+    a = np.where(close, 1 - theta, np.sin((1 - theta) * angle) / safe)
+    b = np.where(close, theta, np.sin(theta * angle) / safe) * sign
+    return a[:, None] * q0 + b[:, None] * q1
+
+
+class QuaternionArray:
+    """
+    Array of N quaternions, the vectorised counterpart of Quaternion.
+
+    Args:
+        q (np.ndarray or list of Quaternion): (N, 4) components (w, x, y, z), or quaternions.
+    Attributes:
+        q (np.ndarray): (N, 4) float64 components.
+
+    Indexing with an integer gives a Quaternion, with a slice or an index array a
+    QuaternionArray. Products follow Quaternion.__mul__, with a Quaternion operand
+    broadcast to all the elements, and
+        rotate(v) = ft.bcrs(q, v) = q v q*
+        basis() @ v = ft.srs(q, v) = q* v q
+    element by element.
+    """
+
+    def __init__(self, q):
+        if len(q) and isinstance(q[0], Quaternion):
+            q = [[quat.w, quat.x, quat.y, quat.z] for quat in q]
+        self.q = np.ascontiguousarray(q, dtype=np.float64).reshape(-1, 4)
+
+    @classmethod
+    def from_axis_angle(cls, axes, angles):
+        """
+        Rotations by angles [rad] about axes, as ft.rotation_to_quat.
+        Args:
+            axes (np.ndarray): (N, 3) or (3,) rotation axes, normalised here.
+            angles (np.ndarray): (N,) angles.
+        """
+        axes = np.atleast_2d(np.asarray(axes, dtype=np.float64))
+        angles = np.asarray(angles, dtype=np.float64).reshape(-1, 1)
+        axes = axes / np.linalg.norm(axes, axis=1)[:, None]
+        return cls(np.hstack((np.cos(angles / 2), np.sin(angles / 2) * axes)))
+
+    @property
+    def w(self):
+        return self.q[:, 0]
+
+    @property
+    def x(self):
+        return self.q[:, 1]
+
+    @property
+    def y(self):
+        return self.q[:, 2]
+
+    @property
+    def z(self):
+        return self.q[:, 3]
+
+    @property
+    def magnitude(self):
+        return np.linalg.norm(self.q, axis=1)
+
+    def __len__(self):
+        return self.q.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Quaternion(*self.q[index])
+        return QuaternionArray(self.q[index])
+
+    def __iter__(self):
+        for row in self.q:
+            yield Quaternion(*row)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.q if dtype is None else self.q.astype(dtype)
+
+    def __repr__(self):
+        return "QuaternionArray(%r)" % self.q
+
+    def _operand(self, other):
+        if isinstance(other, QuaternionArray):
+            return other.q
+        if isinstance(other, Quaternion):
+            return np.array([[other.w, other.x, other.y, other.z]])
+        return None
+
+    def __mul__(self, other):
+        q = self._operand(other)
+        if q is not None:
+            return QuaternionArray(multiply_arrays(*np.broadcast_arrays(self.q, q)))
+        if isinstance(other, (int, float, np.ndarray)):
+            return QuaternionArray(self.q * np.reshape(other, (-1, 1)))
+        return NotImplemented
+
+    def __rmul__(self, other):
+        q = self._operand(other)
+        if q is not None:
+            return QuaternionArray(multiply_arrays(*np.broadcast_arrays(q, self.q)))
+        if isinstance(other, (int, float, np.ndarray)):
+            return QuaternionArray(self.q * np.reshape(other, (-1, 1)))
+        return NotImplemented
+
+    def conjugate(self):
+        return QuaternionArray(self.q * np.array([1., -1., -1., -1.]))
+
+    def normalize(self):
+        """
+        Unit quaternions, as Quaternion.unit.
+        """
+        return QuaternionArray(self.q / self.magnitude[:, None])
+
+    unit = normalize
+
+    def basis(self):
+        """
+        Batched Quaternion.basis(): (N, 3, 3) matrices A with A @ v = ft.srs(q, v).
+        """
+        w, x, y, z = self.q.T
+        A = np.empty((len(self), 3, 3))
+        A[:, 0, 0] = 1 - 2 * (y ** 2 + z ** 2)
+        A[:, 0, 1] = 2 * (x * y + z * w)
+        A[:, 0, 2] = 2 * (x * z - y * w)
+        A[:, 1, 0] = 2 * (x * y - z * w)
+        A[:, 1, 1] = 1 - 2 * (x ** 2 + z ** 2)
+        A[:, 1, 2] = 2 * (y * z + x * w)
+        A[:, 2, 0] = 2 * (x * z + y * w)
+        A[:, 2, 1] = 2 * (y * z - x * w)
+        A[:, 2, 2] = 1 - 2 * (x ** 2 + y ** 2)
+        return A
+
+    def to_matrix(self):
+        """
+        Rotation matrices R @ v = q v q*, i.e. the transposes of basis().
+        """
+        return self.basis().transpose(0, 2, 1)
+
+    def rotate(self, vectors, inverse=False):
+        """
+        Rotates vectors by the quaternions, q v q* like ft.bcrs, or q* v q like
+        ft.srs if inverse. One quaternion per vector, or either of them broadcast.
+        Args:
+            vectors (np.ndarray): (N, 3) or (3,) vectors.
+        Returns:
+            np.ndarray: (N, 3) rotated vectors.
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+        A = self.basis() if inverse else self.to_matrix()
+        return np.einsum('nij,nj->ni', A, vectors)
+
+    def slerp(self, other, theta):
+        """
+        Spherical linear interpolation towards other, see slerp.
+        """
+        return QuaternionArray(slerp(self.q, self._operand(other), theta))
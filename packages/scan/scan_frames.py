@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Attitude-derived quantities shared by the scans of many stars.
+
+Scanner.intercept and star_finder rotate the telescope axis and every star to
+the SRS at every attitude sample. The rotation matrices, the telescope axis in
+the SRS and the field of view angles only depend on the attitude table and the
+scanner, so a ScanFrames computes them once, and changing the frame of a star
+at all the samples is then a single matrix product.
+"""
+
+import numpy as np
+
+from quaternion import QuaternionArray
+
+
+class ScanFrames:
+    """
+    Rotation matrices and field of view of a scanner at every attitude sample.
+
+    Args:
+        table (AttitudeTable): attitude samples.
+        ccd, delta_z (float): field of view of the scanner.
+    Attributes:
+        t (np.ndarray): (N,) times of the samples [days].
+        q (np.ndarray): (N, 4) attitude quaternions.
+        matrices (np.ndarray): (N, 3, 3) matrices A with A @ v = ft.srs(q, v).
+        x_srs (np.ndarray): (N, 3) telescope axis in the SRS.
+        width_angle, aperture_angle (np.ndarray): (N,) full width and height of
+            the field of view, as used by Scanner.intercept.
+        half_aperture (np.ndarray): (N,) half height of the field of view, as used
+            by star_finder.
+    """
+
+    def __init__(self, table, ccd, delta_z):
+        self.t = table.t
+        self.q = table.q
+        self.matrices = QuaternionArray(table.q).basis()
+        self.x_srs = np.einsum('nij,nj->ni', self.matrices, table.x)
+        self.width_angle = 2 * np.arctan2(ccd / 2, self.x_srs[:, 0])
+        self.half_aperture = np.arctan2(delta_z / 2, self.x_srs[:, 0])
+        self.aperture_angle = 2 * np.arctan2(delta_z / 2, self.x_srs[:, 0])
+
+    def __len__(self):
+        return self.t.shape[0]
+
+    def srs(self, vector):
+        """
+        A fixed BCRS vector in the SRS of every sample.
+        Args:
+            vector (np.ndarray): (3,) vector.
+        Returns:
+            np.ndarray: (N, 3) coordinates in the SRS.
+        """
+        return self.matrices.reshape(-1, 3).dot(vector).reshape(-1, 3)
+
+
+class FrameCache:
+    """
+    ScanFrames of the current attitude table of an Attitude, rebuilt when its
+    storage is replaced or refined (MultiResolutionStore.version changes).
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def frames(self, att, ccd, delta_z):
+        """
+        ScanFrames of att.storage for a field of view (ccd, delta_z).
+        """
+        store = att.store
+        key = (store.version, ccd, delta_z)
+        if store is not self._store or key != self._key:
+            self._frames = ScanFrames(store.table, ccd, delta_z)
+            self._store, self._key = store, key
+        return self._frames
+
+    def clear(self):
+        self._store = None
+        self._key = None
+        self._frames = None
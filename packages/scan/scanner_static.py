@@ -7,12 +7,16 @@ Created on Mon Jun 18 14:59:19 2018
 """
 
 from quaternion import*
-from sympy import*
-from sympy import Line3D, Point3D
+import frame_transformations as ft
 import numpy as np
 import math
 import matplotlib.pyplot as plt
 
+try:
+    import sympy
+except ImportError:
+    sympy = None
+
 class Observation:    
     '''
     Creates and object equivalent to an observation. 
@@ -72,72 +76,68 @@ class Satellite:
         Altitude angle (zeta):the altitude width angle of the scanner (width of vertical field of view wrt satellite plane)
 
     '''
-    def __init__(self,z1,z2,z3, origin = Point3D(0,0,0)):  
+    def __init__(self,z1,z2,z3, origin = (0., 0., 0.)):  
         self.zaxis = unit_vector(np.array([z1,z2,z3]))               
-        self.xyplane = Plane(origin, vector_to_point(self.zaxis))
+        self.origin = np.array(origin, dtype=np.float64)
         self.attitude = Quaternion(1.,0.,0.,0.).unit()
 
+    @property
+    def xyplane(self):
+        '''
+        Plane of the satellite as a SymPy Plane, only needed by the 'sympy' geometry backend.
+        '''
+        _require_sympy()
+        return sympy.Plane(vector_to_point(self.origin), normal_vector=vector_to_point(self.zaxis))
    
     def Rotate(self, newrotation):        
         self.attitude = newrotation.unit() * self.attitude 
-        self.attitude.basis()
+        A = self.attitude.basis()
                                           
-        self.zaxis = unit_vector(np.dot(self.attitude.A, self.zaxis))      
-        self.xyplane = Plane((0.,0.,0.), vector_to_point(self.zaxis))
+        self.zaxis = unit_vector(np.dot(A, self.zaxis))      
         
     def ViewLine(self, phi, zeta):
         self.phi = phi
         self.zeta = zeta    
 
-    def Scan(self, sky, zeta = np.radians(5.), phi= math.radians(360.), deltaphi = math.radians(1.)):    
+    def Scan(self, sky, zeta = np.radians(5.), phi= math.radians(360.), deltaphi = math.radians(1.), backend='numpy'):    
 
         '''
         Calculates in the BCRS the angle between the plane of the satellite and the line from the centre of the satellite to the star.
         This angle is - zeta_angle_star_plane.
+
+        backend: 'numpy' to process the whole sky at once in floating point, or 'sympy' for the
+        symbolic Plane and Line3D geometry (slow, requires SymPy).
         '''
+        if backend not in GEOMETRY:
+            raise ValueError("unknown geometry backend %r, expected one of %r" % (backend, tuple(GEOMETRY)))
+        angle_between, projection = GEOMETRY[backend]
+
         self.observations = []  
         self.measurements = []  
         self.times = [] 
         self.indexes = []
-        
-        for idx, star in enumerate(sky.elements):    
-            star_point = vector_to_point(star.vector)             
-            star_line =  Line3D(self.xyplane.args[0], star_point)      
-            arc_angle_star_xyplane = self.xyplane.angle_between(star_line)    
-            if len(arc_angle_star_xyplane.args) == 2:
-                zeta_angle_star_plane = -float(arc_angle_star_xyplane.args[1])
-            if len(arc_angle_star_xyplane.args) == 1:
-                zeta_angle_star_plane = float(arc_angle_star_xyplane.args[0])
-                 
-
-            if  -zeta/2. < (zeta_angle_star_plane) < zeta/2.:       
-                self.indexes.append(idx)
-                
-                proy_star_point = self.xyplane.projection(star_point)             
-                proy_star_vector = point_to_vector(proy_star_point)                
-                proy_star_vector_srs = SRS(self, proy_star_vector) 
-                               
-                phi_angle_obs =  np.arctan2(float(proy_star_vector_srs[1]), float(proy_star_vector_srs[0]))
-                zeta_angle = np.arctan2(float(proy_star_vector_srs[2]), float(np.sqrt((proy_star_vector_srs[0])**2+(proy_star_vector_srs[0])**2)))
-                
-                if phi_angle_obs < 0.:
-                    phi_angle_obs = phi_angle_obs + 2*np.pi
-                observation = Observation(phi_angle_obs, zeta_angle)
-                self.observations.append(observation)
+
+        star_vectors = np.array([star.vector for star in sky.elements]).reshape(-1, 3)
+        zeta_angle_star_plane = angle_between(self.origin, self.zaxis, star_vectors)
+        self.indexes = list(np.flatnonzero((-zeta/2. < zeta_angle_star_plane) & (zeta_angle_star_plane < zeta/2.)))
+
+        proy_star_vector = projection(self.origin, self.zaxis, star_vectors[self.indexes])
+        proy_star_vector_srs = SRS_array(self, proy_star_vector)
+
+        phi_angle_obs = np.arctan2(proy_star_vector_srs[:, 1], proy_star_vector_srs[:, 0])
+        zeta_angle = np.arctan2(proy_star_vector_srs[:, 2], np.sqrt((proy_star_vector_srs[:, 0])**2+(proy_star_vector_srs[:, 0])**2))
+        phi_angle_obs = np.where(phi_angle_obs < 0., phi_angle_obs + 2*np.pi, phi_angle_obs)
+        self.observations = [Observation(azimuth, altitude) for azimuth, altitude in zip(phi_angle_obs, zeta_angle)]
         
         '''
         Once observations are made, now we pass the scan to see at what times if the star in the detector's range
         '''
         #maybe change this to +- deltaphiphi/2 at some point? but careful that phi > 0
-        for i in np.arange(0, phi, deltaphi):
-            self.ViewLine(i, 0)
-            axis1phi = self.phi%(2*np.pi)            
-            axis2phi = (self.phi + deltaphi)%(2*np.pi)
-            
-            for observation in self.observations:
-                if axis1phi < observation.azimuth and observation.azimuth < axis2phi:
-                    time = i%(np.pi*2)
-                    self.times.append(time) 
+        steps = np.arange(0, phi, deltaphi)
+        if len(steps):
+            self.ViewLine(steps[-1], 0)
+        azimuths = np.array([observation.azimuth for observation in self.observations])
+        self.times = list(scan_times(steps, deltaphi, azimuths)[0])
                                                                                                                                                                                                                                   
         
 ################################## FUNCTIONS ##################################
@@ -149,12 +149,17 @@ def unit_vector(vector):
     return vector / np.linalg.norm(vector) 
             
 def vector_to_point(vector):
-    return Point3D(vector[0], vector[1], vector[2])
+    _require_sympy()
+    return sympy.Point3D(vector[0], vector[1], vector[2])
     
 def point_to_vector(point):
     #return np.array([point[0], point[1], point[2]])           
     return np.array([point.x, point.y, point.z])           
 
+def _require_sympy():
+    if sympy is None:
+        raise ImportError("the 'sympy' geometry backend requires sympy, which is not installed")
+
 def vector_to_quaternion(vector):
     return Quaternion(0, float(vector[0]), float(vector[1]), float(vector[2]))  #added float arguments to prevent Point3D fractions from being passed to the quaternion class.
        
@@ -172,6 +177,43 @@ def rotation_quaternion(vector, angle):
     return qvector
 
     
+def scan_times(steps, deltaphi, azimuths):
+    '''
+    Times at which the view line, moving from every step to step + deltaphi, passes the azimuths.
+
+    An azimuth is in a step if step%(2*pi) < azimuth < (step + deltaphi)%(2*pi). The steps
+    are split in revolutions, where step%(2*pi) wraps around, and every azimuth is looked up
+    by binary search in the sorted steps of every revolution, so the cost is
+    O((steps + azimuths*revolutions) log(steps)) instead of O(steps*azimuths).
+
+    Returns:
+        times (np.ndarray): step%(2*pi) of every passage, ordered by step, then by azimuth.
+        indexes (np.ndarray): index in azimuths of every passage.
+    '''
+    azimuths = np.asarray(azimuths, dtype=np.float64)
+    starts = np.asarray(steps, dtype=np.float64) % (2*np.pi)
+    ends = (np.asarray(steps, dtype=np.float64) + deltaphi) % (2*np.pi)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(starts) < 0) + 1, [len(starts)]))
+
+    step_index, azimuth_index = [], []
+    candidates = np.arange(len(azimuths))
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        if last <= first:
+            continue
+        # last step starting before every azimuth, and the one before, which may still
+        # end after it by rounding.
+        j = first + np.searchsorted(starts[first:last], azimuths, side='left') - 1
+        for k in (j - 1, j):
+            inside = k >= first
+            inside[inside] &= azimuths[inside] < ends[k[inside]]
+            step_index.append(k[inside])
+            azimuth_index.append(candidates[inside])
+
+    step_index = np.concatenate(step_index) if step_index else np.empty(0, dtype=np.intp)
+    azimuth_index = np.concatenate(azimuth_index) if azimuth_index else np.empty(0, dtype=np.intp)
+    order = np.lexsort((azimuth_index, step_index))
+    return starts[step_index[order]], azimuth_index[order]
+
 def SRS(satellite, vector):
     '''
     Changes coordinates of a vector in BCRS to SRS frame.
@@ -190,30 +232,75 @@ def BCRS(satellite, vector):
     
     return np.array([q_vector_bcrs.x, q_vector_bcrs.y, q_vector_bcrs.z])
     
+def attitude_array(satellite):
+    q = satellite.attitude
+    return np.array([q.w, q.x, q.y, q.z], dtype=np.float64)
+
+def SRS_array(satellite, vectors):
+    '''
+    SRS of an (N, 3) array of vectors, as an (N, 3) array.
+    '''
+    return ft.bcrs_batch(attitude_array(satellite), vectors)
+
+def BCRS_array(satellite, vectors):
+    '''
+    BCRS of an (N, 3) array of vectors, as an (N, 3) array.
+    '''
+    return ft.srs_batch(attitude_array(satellite), vectors)
+
 def Measurements(satellite): 
     '''
     Takes all observation objects of the satellite (which are in the SRS frame) and converts them into the BCRS frame, making them observation-objects.
     self.measurements are objects with bcrs coordinates.
     '''
-    satellite.measurements =[] 
-    for obs in satellite.observations: 
-        star_vector = BCRS(satellite, obs.vector)
-        alpha = np.arctan2(star_vector[1], star_vector[0])
-        delta = np.arctan2(star_vector[2], np.sqrt(star_vector[0]**2 + star_vector[1]**2))
-        if alpha < 0 :
-            alpha = alpha + 2*np.pi
-        star = Observation(alpha, delta)
-        satellite.measurements.append(star) 
+    star_vector = BCRS_array(satellite, [obs.vector for obs in satellite.observations])
+    alpha = np.arctan2(star_vector[:, 1], star_vector[:, 0])
+    delta = np.arctan2(star_vector[:, 2], np.sqrt(star_vector[:, 0]**2 + star_vector[:, 1]**2))
+    alpha = np.where(alpha < 0, alpha + 2*np.pi, alpha)
+    satellite.measurements = [Observation(a, d) for a, d in zip(alpha, delta)]
       
 def Psi(satellite, sky):
     '''
     Calculates the difference between the coordinates of a star versus its correspondient coordinates (bcrs-framed) from Gaia.
     '''
-    bcrs_stars_vector = [BCRS(satellite, obs.vector) for obs in satellite.observations]
-    list_true_star_vector = [sky.elements[idx].vector for idx in satellite.indexes]
+    bcrs_stars_vector = BCRS_array(satellite, [obs.vector for obs in satellite.observations])
+    list_true_star_vector = np.array([sky.elements[idx].vector for idx in satellite.indexes]).reshape(-1, 3)
     diff = np.subtract(bcrs_stars_vector, list_true_star_vector)
     return    diff
 
+############################### PLANE GEOMETRY ################################
+# Functions of (origin, normal, vectors) for the plane through origin with the given
+# normal, and the (N, 3) points vectors. GEOMETRY maps the name of a backend to its
+# (angle_between, projection) pair.
+
+def angle_between(origin, normal, vectors):
+    '''
+    Signed angles between the plane and the lines from origin to the points, as Plane.angle_between.
+    '''
+    directions = np.asarray(vectors, dtype=np.float64).reshape(-1, 3) - origin
+    sines = directions.dot(normal) / (np.linalg.norm(normal) * np.linalg.norm(directions, axis=1))
+    return np.arcsin(sines)
+
+def projection(origin, normal, vectors):
+    '''
+    Orthogonal projections of the points on the plane, as Plane.projection.
+    '''
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+    distances = (vectors - origin).dot(normal) / normal.dot(normal)
+    return vectors - distances[:, None] * normal
+
+def sympy_angle_between(origin, normal, vectors):
+    plane = sympy.Plane(vector_to_point(origin), normal_vector=vector_to_point(normal))
+    return np.array([float(plane.angle_between(sympy.Line3D(plane.p1, vector_to_point(v))))
+                     for v in vectors])
+
+def sympy_projection(origin, normal, vectors):
+    plane = sympy.Plane(vector_to_point(origin), normal_vector=vector_to_point(normal))
+    return np.array([point_to_vector(plane.projection(vector_to_point(v))) for v in vectors],
+                    dtype=np.float64).reshape(-1, 3)
+
+GEOMETRY = {'numpy': (angle_between, projection),
+            'sympy': (sympy_angle_between, sympy_projection)}
     
 def Plot(satellite, sky):   
     '''
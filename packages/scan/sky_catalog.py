@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar catalogue of sources.
+
+NSL.Sky keeps a list of Source objects, each with two small arrays of its own.
+SkyCatalog keeps one contiguous float64 array per parameter instead, i.e.
+64 bytes per source, and hands out SourceView objects where code expects a
+Source, so that it can be passed as the sky of star_finder or scan_sky.
+
+positions_at gives the directions of the sources at other epochs, with their
+proper motion and the parallax seen from the satellite.
+"""
+
+import collections
+import hashlib
+
+import numpy as np
+
+import frame_transformations as ft
+
+MAS = np.radians(1. / 3600000.)
+DAYS_PER_YEAR = 365.25
+
+# Epoch grids whose positions are kept by a catalogue.
+MEMO_SIZE = 4
+
+
+def sun_directions(att, times):
+    """
+    Nominal direction of the Sun s_ = l_*cos(lambda) + j_*sin(lambda) of the scanning
+    law at the given times, the satellite being 1 AU away from it in the opposite direction.
+    Args:
+        att (Attitude): attitude giving lambda, from att.solution when it covers the
+            times or else interpolated from att.storage.
+        times (np.ndarray): times from J2000 [days].
+    Returns:
+        np.ndarray: (T, 3) unit vectors in BCRS.
+    """
+    times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+    if att.solution is not None and att.solution.covers(times):
+        lambda_ = att.solution.state(times)[:, 0]
+    else:
+        lambda_ = np.interp(times, att.storage.t, att.storage.angles[:, 0])
+    return np.outer(np.cos(lambda_), att.l_) + np.outer(np.sin(lambda_), att.j_)
+
+
+class SourceView:
+    """
+    Source-like view of one row of a SkyCatalog.
+
+    Attributes:
+        coor (np.ndarray): unit vector of the source in BCRS, a view of the catalogue.
+        velocity (np.ndarray): (mualpha, mudelta, parallax), a copy.
+    """
+    __slots__ = ('catalog', 'index')
+
+    def __init__(self, catalog, index):
+        self.catalog = catalog
+        self.index = index
+
+    @property
+    def coor(self):
+        return self.catalog.vectors[self.index]
+
+    @property
+    def velocity(self):
+        c, i = self.catalog, self.index
+        return np.array([c.mualpha[i], c.mudelta[i], c.parallax[i]])
+
+    @property
+    def alpha(self):
+        return self.catalog.alpha[self.index]
+
+    @property
+    def delta(self):
+        return self.catalog.delta[self.index]
+
+    def __repr__(self):
+        return 'SourceView(%d of %d)' % (self.index, len(self.catalog))
+
+
+class SkyCatalog:
+    """
+    Structure of arrays of sources, parameters as in NSL.Source.
+
+    Args:
+        alpha (np.ndarray): longitudinal angles [rad].
+        delta (np.ndarray): altitude angles [rad].
+        mualpha (np.ndarray): velocities in alpha [mas/yr], 0 by default.
+        mudelta (np.ndarray): velocities in delta [mas/yr], 0 by default.
+        parallax (np.ndarray): parallaxes [mas], 1 by default.
+    Attributes:
+        vectors (np.ndarray): (N, 3) unit vectors of the sources in BCRS.
+    """
+    columns = ('alpha', 'delta', 'mualpha', 'mudelta', 'parallax')
+
+    def __init__(self, alpha, delta, mualpha=None, mudelta=None, parallax=None):
+        self.alpha = np.ascontiguousarray(alpha, dtype=np.float64).ravel()
+        n = len(self.alpha)
+        self.delta = np.ascontiguousarray(delta, dtype=np.float64).ravel()
+        self.mualpha = np.zeros(n) if mualpha is None else np.ascontiguousarray(mualpha, dtype=np.float64).ravel()
+        self.mudelta = np.zeros(n) if mudelta is None else np.ascontiguousarray(mudelta, dtype=np.float64).ravel()
+        self.parallax = np.ones(n) if parallax is None else np.ascontiguousarray(parallax, dtype=np.float64).ravel()
+        if any(len(getattr(self, name)) != n for name in self.columns):
+            raise ValueError("columns of different lengths")
+        self.vectors = np.ascontiguousarray(ft.xyz(self.alpha, self.delta).T)
+        self._positions = collections.OrderedDict()
+
+    @classmethod
+    def random(cls, n):
+        """
+        n random sources drawn from the same distributions as NSL.Sky, with np.random.
+        """
+        return cls(np.random.uniform(0, 2 * np.pi, n),
+                   np.random.uniform(-np.pi / 2, np.pi / 2, n),
+                   np.random.uniform(0, 0.1, n),
+                   np.random.uniform(0, 0.1, n))
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Catalogue file like data/gdr1set*.csv, with angles in degrees, proper motions in
+        mas/yr (pmra including the cos(dec) factor) and parallaxes in mas.
+
+        The positions are read from the ra, dec columns, or else converted from the
+        galactic l, b columns; pmra, pmdec and parallax are optional.
+
+        Raises:
+            ValueError: if the file has neither ra, dec nor l, b columns.
+        """
+        data = np.genfromtxt(path, delimiter=',', names=True)
+        names = data.dtype.names
+        if 'ra' in names and 'dec' in names:
+            alpha, delta = np.radians(data['ra']), np.radians(data['dec'])
+        elif 'l' in names and 'b' in names:
+            alpha, delta = ft.galactic_to_equatorial(np.radians(data['l']), np.radians(data['b']))
+            alpha = np.mod(alpha, 2 * np.pi)
+        else:
+            raise ValueError("%s has neither ra, dec nor l, b columns" % path)
+        mualpha, mudelta, parallax = (data[name] if name in names else None
+                                      for name in ('pmra', 'pmdec', 'parallax'))
+        return cls(alpha, delta, mualpha, mudelta, parallax)
+
+    @property
+    def elements(self):
+        """
+        The catalogue itself, which behaves like the list of sources of NSL.Sky.
+        """
+        return self
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.columns) + self.vectors.nbytes
+
+    def __len__(self):
+        return len(self.alpha)
+
+    def proper_motions(self):
+        """
+        Proper motions as (N, 3) vectors tangent to the sphere [rad/day]; mualpha is
+        taken to include the cos(delta) factor.
+        """
+        p = np.stack((-np.sin(self.alpha), np.cos(self.alpha), np.zeros(len(self))), axis=1)
+        q = np.stack((-np.sin(self.delta) * np.cos(self.alpha), -np.sin(self.delta) * np.sin(self.alpha),
+                      np.cos(self.delta)), axis=1)
+        return (self.mualpha[:, None] * p + self.mudelta[:, None] * q) * (MAS / DAYS_PER_YEAR)
+
+    def positions_at(self, times, att, sources=None):
+        """
+        Directions of the sources seen from the satellite, at the J2000 positions plus
+        proper motion, displaced by the parallax towards the Sun (see sun_directions).
+
+        Args:
+            times (np.ndarray): times from J2000 [days].
+            att (Attitude): attitude of the scanning law giving the Sun direction.
+            sources (np.ndarray): indexes of the sources, one per time. If None, the
+                positions of all the sources are computed on the epoch grid times.
+        Returns:
+            np.ndarray: (P, 3) unit vectors for (source, time) pairs, or (T, N, 3) on a grid.
+
+        Notes:
+            Grids are memoized (the last MEMO_SIZE ones, keyed by the times and the Sun
+            directions), so do not modify the returned array or the columns afterwards.
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        sun = sun_directions(att, times)
+        if sources is not None:
+            sources = np.asarray(sources, dtype=np.intp)
+            u = (self.vectors[sources] + times[:, None] * self.proper_motions()[sources]
+                 + (self.parallax[sources] * MAS)[:, None] * sun)
+            return u / np.linalg.norm(u, axis=1)[:, None]
+
+        key = hashlib.sha1(times.tobytes() + sun.tobytes()).hexdigest()
+        if key in self._positions:
+            self._positions.move_to_end(key)
+            return self._positions[key]
+        u = (self.vectors[None] + times[:, None, None] * self.proper_motions()[None]
+             + (self.parallax * MAS)[None, :, None] * sun[:, None, :])
+        u /= np.linalg.norm(u, axis=2)[:, :, None]
+        self._positions[key] = u
+        if len(self._positions) > MEMO_SIZE:
+            self._positions.popitem(last=False)
+        return u
+
+    def __getitem__(self, index):
+        """
+        A SourceView for an integer, a SkyCatalog for a slice or an index array.
+        """
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("source index out of range")
+            return SourceView(self, index)
+        subset = SkyCatalog.__new__(SkyCatalog)
+        for name in self.columns:
+            setattr(subset, name, np.ascontiguousarray(getattr(self, name)[index]))
+        subset.vectors = np.ascontiguousarray(self.vectors[index])
+        subset._positions = collections.OrderedDict()
+        return subset
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield SourceView(self, i)
+
+    def __repr__(self):
+        return 'SkyCatalog(%d sources)' % len(self)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial index of the stars of a sky on the unit sphere.
+
+The stars are kept in a KD-tree of their unit vectors, where an angular radius
+r on the sphere is a chord of length 2*sin(r/2). At any attitude sample only
+the stars close to the telescope axis can transit, so querying the tree makes
+the work per sample scale with the local density of stars rather than with the
+size of the catalogue.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from sky_catalog import SkyCatalog
+
+
+def chord(angle):
+    """
+    Length of the chord of an arc of the unit circle [rad].
+    """
+    return 2 * np.sin(np.minimum(angle, np.pi) / 2)
+
+
+def field_radius(scanner, margin=1e-3):
+    """
+    Angular radius [rad] around the telescope axis out of which a star cannot meet
+    the conditions of Scanner.intercept or star_finder.
+    """
+    return 2 * np.arctan2(max(scanner.ccd, scanner.delta_z) / 2, 1.) + margin
+
+
+class SkyIndex:
+    """
+    KD-tree of the unit vectors of the stars.
+
+    Args:
+        vectors (np.ndarray): (S, 3) unit vectors of the stars in BCRS.
+    Attributes:
+        vectors (np.ndarray): the unit vectors, indexes of the queries refer to them.
+    """
+
+    def __init__(self, vectors):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float64).reshape(-1, 3)
+        self.tree = cKDTree(self.vectors)
+
+    @classmethod
+    def from_sky(cls, sky):
+        """
+        Index of the stars of an NSL.Sky (or any object with a list of sources in .elements)
+        or of a SkyCatalog.
+        """
+        if hasattr(sky, 'vectors'):
+            return cls(sky.vectors)
+        return cls(np.array([star.coor for star in sky.elements], dtype=np.float64).reshape(-1, 3))
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Index of a catalogue file like data/gdr1set*.csv, read as by SkyCatalog.from_csv
+        so that the stars are in BCRS, converted from galactic coordinates if needed.
+        """
+        return cls(SkyCatalog.from_csv(path).vectors)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def cone(self, direction, radius):
+        """
+        Indexes of the stars within an angle radius [rad] of direction.
+        """
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        return np.sort(np.asarray(self.tree.query_ball_point(direction, chord(radius)), dtype=np.intp))
+
+    def band(self, pole, half_width):
+        """
+        Indexes of the stars within half_width [rad] of the great circle of the given pole,
+        e.g. the stars swept by the field of view in one revolution about the spin axis.
+        """
+        pole = np.asarray(pole, dtype=np.float64)
+        pole = pole / np.linalg.norm(pole)
+        # The circle is covered by cones whose centres are half_width apart.
+        u = np.cross(pole, [1., 0., 0.] if abs(pole[0]) < 0.9 else [0., 1., 0.])
+        u /= np.linalg.norm(u)
+        v = np.cross(pole, u)
+        n = int(np.ceil(2 * np.pi / max(half_width, 1e-6)))
+        phi = np.linspace(0, 2 * np.pi, n, endpoint=False)
+        centres = np.outer(np.cos(phi), u) + np.outer(np.sin(phi), v)
+        radius = np.hypot(half_width, np.pi / n) * 1.01
+        found = self.tree.query_ball_point(centres, chord(radius))
+        candidates = np.unique(np.concatenate([np.asarray(f, dtype=np.intp) for f in found]))
+        inside = np.abs(self.vectors[candidates].dot(pole)) <= np.sin(half_width)
+        return candidates[inside]
+
+    def pairs(self, directions, radius):
+        """
+        All the (direction, star) pairs closer than radius [rad].
+        Args:
+            directions (np.ndarray): (N, 3) unit vectors, e.g. the telescope axes of attitude samples.
+            radius (float or np.ndarray): one radius, or one per direction.
+        Returns:
+            (np.ndarray, np.ndarray): index of the direction and index of the star of every pair.
+        """
+        found = self.tree.query_ball_point(np.asarray(directions, dtype=np.float64).reshape(-1, 3),
+                                           chord(radius))
+        lengths = np.array([len(f) for f in found], dtype=np.intp)
+        rows = np.repeat(np.arange(len(found)), lengths)
+        if lengths.sum() == 0:
+            return rows, np.empty(0, dtype=np.intp)
+        return rows, np.concatenate([np.asarray(f, dtype=np.intp) for f in found if len(f)])
@@ -0,0 +1,291 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+
+from NSL import Attitude
+from attitude_table import AttitudeTable, slerp
+from attitude_spline import AttitudeSpline
+from attitude_cache import AttitudeCache
+from quaternion import Quaternion, multiply_arrays
+import propagator
+
+
+def legacy_storage(att, ti, tf, dt):
+    # Reference: the interpreted loop that create_storage used to run.
+    att.t = ti
+    rows = []
+    for i in np.arange((tf - ti) / dt):
+        att.update(dt)
+        rows.append([att.t, att.w_, att.z_, att.x_, att.attitude])
+    return rows
+
+
+class AttitudePropagatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.att = Attitude(0, 5, 0.01)
+        self.reference = Attitude(0, 0, 0.01)
+        self.rows = legacy_storage(self.reference, 0, 5, 0.01)
+
+    def test_storage_is_columnar(self):
+        storage = self.att.storage
+        self.assertIsInstance(storage, AttitudeTable)
+        self.assertEqual(len(storage), len(self.rows))
+        self.assertEqual(storage.q.shape, (len(self.rows), 4))
+        for name in ('w', 'z', 'x'):
+            self.assertEqual(getattr(storage, name).shape, (len(self.rows), 3))
+
+    def test_matches_python_update(self):
+        storage = self.att.storage
+        t = np.array([row[0] for row in self.rows])
+        z = np.array([row[2] for row in self.rows])
+        x = np.array([row[3] for row in self.rows])
+        q = np.array([[row[4].w, row[4].x, row[4].y, row[4].z] for row in self.rows])
+        np.testing.assert_allclose(storage.t, t, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(storage.z, z, rtol=0, atol=1e-10)
+        np.testing.assert_allclose(storage.x, x, rtol=0, atol=1e-10)
+        np.testing.assert_allclose(storage.q, q, rtol=0, atol=1e-10)
+
+    def test_final_state(self):
+        self.assertAlmostEqual(self.att.t, self.reference.t)
+        self.assertAlmostEqual(self.att.nu, self.reference.nu)
+        self.assertAlmostEqual(self.att.omega, self.reference.omega, places=8)
+        self.assertIsInstance(self.att.attitude, Quaternion)
+
+    def test_rows_behave_like_legacy_storage(self):
+        for obj in self.att.storage[:3]:
+            self.assertEqual(len(obj), 5)
+            self.assertIsInstance(obj[4], Quaternion)
+
+    def test_create_storage_keeps_storage_sorted(self):
+        self.att.create_storage(1, 2, 0.001)
+        self.assertEqual(len(self.att.storage), len(self.rows) + 1000)
+        self.assertTrue(np.all(np.diff(self.att.storage.t) >= 0))
+
+    def test_iter_storage_matches_create_storage(self):
+        att = Attitude(0, 0, 0.01)
+        chunks = list(att.iter_storage(0, 5, 0.01, chunk_size=128))
+        self.assertTrue(all(len(chunk) == 128 for chunk in chunks[:-1]))
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(self.att.storage))
+        self.assertEqual(len(att.storage), 0)
+        for name in AttitudeTable.columns:
+            np.testing.assert_array_equal(np.concatenate([getattr(chunk, name) for chunk in chunks]),
+                                          getattr(self.att.storage, name))
+        self.assertEqual(att.nu, self.att.nu)
+
+
+class HigherOrderIntegratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rk4 = Attitude(0, 5, 0.05, integrator='rk4')
+        self.dopri = Attitude(0, 5, 0.05, integrator='dopri')
+
+    def test_unknown_integrator(self):
+        with self.assertRaises(ValueError):
+            Attitude(0, 1, 0.01, integrator='leapfrog')
+
+    def test_rk4_and_dopri_agree(self):
+        np.testing.assert_allclose(self.rk4.storage.t, self.dopri.storage.t)
+        np.testing.assert_allclose(self.rk4.storage.z, self.dopri.storage.z, atol=1e-9)
+        np.testing.assert_allclose(self.rk4.storage.x, self.dopri.storage.x, atol=1e-9)
+
+    def test_dopri_takes_fewer_steps(self):
+        self.assertLess(self.dopri.solution.n_steps, self.rk4.solution.n_steps)
+
+    def test_dense_output_between_samples(self):
+        times = np.linspace(0.01, 4.99, 37)
+        fine = propagator.integrate(Attitude(0, 0, 0.001, integrator='rk4'), 0, 5, 'rk4', 0.001)
+        for att in (self.rk4, self.dopri):
+            np.testing.assert_allclose(att.solution(times).x, fine(times).x, atol=1e-9)
+
+    def test_integrated_z_is_the_z_axis_of_the_attitude(self):
+        q = self.dopri.storage.q
+        z = np.stack((2 * (q[:, 1] * q[:, 3] + q[:, 0] * q[:, 2]),
+                      2 * (q[:, 2] * q[:, 3] - q[:, 0] * q[:, 1]),
+                      1 - 2 * (q[:, 1] ** 2 + q[:, 2] ** 2)), axis=1)
+        np.testing.assert_allclose(self.dopri.storage.z, z, atol=1e-10)
+
+    def test_iter_storage(self):
+        att = Attitude(0, 0, 0.05, integrator='rk4')
+        chunks = list(att.iter_storage(0, 5, 0.05, chunk_size=30))
+        t = np.concatenate([chunk.t for chunk in chunks])
+        x = np.concatenate([chunk.x for chunk in chunks])
+        np.testing.assert_allclose(t, self.rk4.storage.t)
+        np.testing.assert_allclose(x, self.rk4.storage.x, atol=1e-12)
+
+    def test_dense_output_outside_span(self):
+        with self.assertRaises(ValueError):
+            self.rk4.solution(6.)
+
+
+def max_angle(q, reference):
+    # rotation angle [rad] between two (N, 4) arrays of unit quaternions
+    dot = np.abs(np.sum(q * reference, axis=1))
+    return np.max(2 * np.arccos(np.clip(dot, 0, 1)))
+
+
+class AttitudeLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.att = Attitude(0, 10, 0.01, integrator='rk4')
+        self.times = np.random.uniform(0.01, 10, 1000)
+
+    def test_index_of(self):
+        storage = self.att.storage
+        index = storage.index_of(self.times)
+        self.assertTrue(np.all(storage.t[index] <= self.times))
+        self.assertTrue(np.all(storage.t[np.minimum(index + 1, len(storage) - 1)] >= self.times))
+
+    def test_index_of_outside_table(self):
+        with self.assertRaises(ValueError):
+            self.att.storage.index_of(-1.)
+
+    def test_attitude_at_samples_is_exact(self):
+        storage = self.att.storage
+        np.testing.assert_allclose(self.att.attitude_at(storage.t), storage.q, atol=1e-12)
+
+    def test_attitude_at_between_samples(self):
+        reference = self.att.solution(self.times).q
+        q = self.att.attitude_at(self.times)
+        self.assertEqual(q.shape, (len(self.times), 4))
+        self.assertLess(max_angle(q, reference), np.radians(20. / 3600))
+        hermite = self.att.attitude_at(self.times, method='hermite')
+        self.assertLess(max_angle(hermite, reference), np.radians(1. / 3600))
+
+    def test_slerp_takes_shortest_arc(self):
+        q0 = np.array([[1., 0., 0., 0.]])
+        q1 = -np.array([[np.cos(0.1), np.sin(0.1), 0., 0.]])
+        q = slerp(q0, q1, np.array([0.5]))
+        np.testing.assert_allclose(q, [[np.cos(0.05), np.sin(0.05), 0., 0.]])
+
+    def test_reset_to_time(self):
+        self.att.reset_to_time(5.005)
+        self.assertEqual(self.att.t, 5.005)
+        q = np.array([[self.att.attitude.w, self.att.attitude.x, self.att.attitude.y, self.att.attitude.z]])
+        self.assertLess(max_angle(q, self.att.solution(5.005).q), np.radians(20. / 3600))
+        self.assertAlmostEqual(self.att.nu, self.att.solution(5.005).angles[0, 1], places=6)
+
+
+class AttitudeSplineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.att = Attitude(0, 1, 0.01, integrator='rk4')
+        self.spline = AttitudeSpline.from_attitude(self.att, knot_interval=60.)
+        self.times = np.random.uniform(0, 1, 2000)
+        self.reference = self.att.solution(self.times)
+
+    def test_compact_storage(self):
+        self.assertEqual(self.spline.coefficients.shape, (1440 + 3, 4))
+
+    def test_quaternion(self):
+        q = self.spline.quaternion(self.times)
+        # angle of the relative rotation q * reference^-1
+        relative = multiply_arrays(q, self.reference.q * np.array([1., -1., -1., -1.]))
+        angle = 2 * np.arctan2(np.linalg.norm(relative[:, 1:], axis=1), np.abs(relative[:, 0]))
+        self.assertLess(angle.max(), np.radians(1e-3 / 3600))
+
+    def test_spin_and_axes(self):
+        np.testing.assert_allclose(self.spline.spin(self.times), self.reference.w, rtol=1e-8, atol=1e-8)
+        table = self.spline.table(self.times)
+        np.testing.assert_allclose(table.z, self.reference.z, atol=1e-10)
+        np.testing.assert_allclose(table.x, self.reference.x, atol=1e-10)
+
+    def test_rate_is_tangent(self):
+        q = self.spline.quaternion(self.times)
+        rate = self.spline.rate(self.times)
+        np.testing.assert_allclose(np.sum(q * rate, axis=1), 0, atol=1e-8)
+
+    def test_outside_span(self):
+        with self.assertRaises(ValueError):
+            self.spline.quaternion(2.)
+
+
+class MultiResolutionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.att = Attitude(0, 5, 0.01, integrator='rk4')
+        self.coarse = len(self.att.storage)
+
+    def test_refined_window_replaces_coarse_samples(self):
+        self.att.refine(2.0037, 3.0037, 0.001)
+        storage = self.att.storage
+        self.assertTrue(np.all(np.diff(storage.t) > 0))
+        inside = (storage.t > 2.0037) & (storage.t <= 3.0037)
+        self.assertEqual(np.count_nonzero(inside), 1000)
+        self.assertEqual(len(storage), self.coarse - 100 + 1000)
+
+    def test_refined_window_is_seeded_from_interpolated_state(self):
+        state = (self.att.t, self.att.nu, self.att.omega)
+        self.att.refine(2.0037, 3.0037, 0.001)
+        self.assertEqual((self.att.t, self.att.nu, self.att.omega), state)
+        window = self.att.store.windows[0]
+        np.testing.assert_allclose(window.z, self.att.solution(window.t).z, atol=1e-7)
+        np.testing.assert_allclose(window.x, self.att.solution(window.t).x, atol=1e-6)
+
+    def test_overlapping_refinements_are_not_integrated_twice(self):
+        self.att.refine(2, 3, 0.001)
+        self.att.refine(2.5, 3.5, 0.001)
+        self.att.refine(1.5, 2.2, 0.001)
+        self.assertEqual([len(window) for window in self.att.store.windows], [500, 1000, 500])
+        t = self.att.storage.t
+        self.assertTrue(np.all(np.diff(t) > 0))
+        self.assertEqual(np.count_nonzero((t > 1.5) & (t <= 3.5)), 2000)
+
+    def test_refinement_is_lazy(self):
+        self.att.refine(2, 3, 0.001)
+        self.assertIsNone(self.att.store._table)
+        version = self.att.store.version
+        self.att.refine(2.2, 2.8, 0.001)
+        self.assertEqual(self.att.store.version, version)
+        self.assertEqual(len(self.att.storage), self.coarse - 100 + 1000)
+
+
+class AttitudeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = AttitudeCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_restore_from_cache(self):
+        att = Attitude(0, 10, 0.01, cache=self.cache)
+        cached = Attitude(0, 10, 0.01, cache=self.cache)
+        self.assertEqual(len(self.cache.entries()), 1)
+        np.testing.assert_array_equal(cached.storage.q, att.storage.q)
+        np.testing.assert_array_equal(cached.storage.t, att.storage.t)
+        self.assertEqual(cached.nu, att.nu)
+        self.assertEqual(cached.attitude.w, att.attitude.w)
+
+    def test_restored_dense_solution(self):
+        att = Attitude(0, 10, 0.01, integrator='dopri', cache=self.cache)
+        cached = Attitude(0, 10, 0.01, integrator='dopri', cache=self.cache)
+        np.testing.assert_array_equal(cached.solution(4.321).q, att.solution(4.321).q)
+
+    def test_key_depends_on_parameters(self):
+        Attitude(0, 10, 0.01, cache=self.cache)
+        Attitude(0, 10, 0.02, cache=self.cache)
+        Attitude(0, 10, 0.01, integrator='rk4', cache=self.cache)
+        self.assertEqual(len(self.cache.entries()), 3)
+
+    def test_eviction_by_size(self):
+        Attitude(0, 10, 0.01, cache=self.cache)
+        size = self.cache.size()
+        self.cache.max_bytes = 1.5 * size
+        Attitude(0, 10, 0.02, cache=self.cache)
+        self.assertLessEqual(self.cache.size(), self.cache.max_bytes)
+        self.assertEqual(len(self.cache.entries()), 1)
+
+    def test_invalidate(self):
+        att = Attitude(0, 10, 0.01, cache=self.cache)
+        Attitude(0, 10, 0.02, cache=self.cache)
+        self.cache.invalidate(att, 0, 10, 0.01)
+        self.assertEqual(len(self.cache.entries()), 1)
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache.entries()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
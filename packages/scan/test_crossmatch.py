@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+import crossmatch
+from crossmatch import CrossMatch, SourceIdIndex
+import frameRotation
+from test_frame_rotation import rotated_catalogues
+
+
+class SourceIdMatchTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(12)
+        self.directory = tempfile.mkdtemp()
+        self.catalogue = {'sourceId': np.random.permutation(5000)[:3000] * 7, 'alpha': np.random.normal(size=3000)}
+        self.catalogue0 = {'sourceId': np.random.permutation(5000)[:2000] * 7, 'alpha': np.random.normal(size=2000)}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_matches_merge(self):
+        match = crossmatch.match_source_id(self.catalogue, self.catalogue0)
+        merged = pd.merge(pd.DataFrame(self.catalogue), pd.DataFrame(self.catalogue0),
+                          on='sourceId', suffixes=('', '0')).sort_values('sourceId')
+        np.testing.assert_array_equal(match.source_id, merged.sourceId)
+        columns = match.columns(self.catalogue, self.catalogue0, names=('sourceId', 'alpha'))
+        np.testing.assert_array_equal(columns['sourceId'], columns['sourceId0'])
+        np.testing.assert_array_equal(columns['alpha'], merged.alpha)
+        np.testing.assert_array_equal(columns['alpha0'], merged.alpha0)
+
+    def test_persistence(self):
+        path = os.path.join(self.directory, 'index.npz')
+        SourceIdIndex.from_catalogue(self.catalogue).save(path)
+        match = SourceIdIndex.load(path).match(SourceIdIndex.from_catalogue(self.catalogue0))
+        match.save(os.path.join(self.directory, 'match.npz'))
+        loaded = CrossMatch.load(os.path.join(self.directory, 'match.npz'))
+        np.testing.assert_array_equal(loaded.rows, match.rows)
+        np.testing.assert_array_equal(loaded.rows0, match.rows0)
+        self.assertIsNone(loaded.separation)
+
+    def test_unique(self):
+        with self.assertRaises(ValueError):
+            SourceIdIndex([3, 1, 3])
+
+    def test_streaming_solve(self):
+        epsilon, omega = np.array([1e-6, 2e-6, -1e-6]), np.array([-1e-8, 1e-8, 2e-8])
+        d = rotated_catalogues(2000, epsilon, omega)
+        catalogue = d[['sourceId', 'alpha', 'delta', 'muAlphaStar', 'muDelta']].sample(frac=1)
+        catalogue0 = d[['sourceId', 'alpha0', 'delta0', 'muAlphaStar0', 'muDelta0']][::3]
+        catalogue0.columns = catalogue.columns
+        match = crossmatch.match_source_id(catalogue, catalogue0)
+        self.assertEqual(len(match), len(catalogue0))
+        solution = frameRotation.solveRotationStreaming(match.chunks(catalogue, catalogue0, chunksize=100))
+        np.testing.assert_allclose(solution[0], epsilon, rtol=0, atol=1e-14)
+        np.testing.assert_allclose(solution[1], omega, rtol=0, atol=1e-16)
+
+
+class PositionalMatchTest(unittest.TestCase):
+
+    def test_nearest_neighbours(self):
+        np.random.seed(13)
+        epsilon, omega = np.array([1e-6, 2e-6, -1e-6]), np.array([-1e-8, 1e-8, 2e-8])
+        d = rotated_catalogues(3000, epsilon, omega)
+        catalogue = d[['alpha', 'delta', 'muAlphaStar', 'muDelta']].iloc[np.random.permutation(3000)]
+        catalogue0 = d[['alpha0', 'delta0', 'muAlphaStar0', 'muDelta0']][:2500]
+        catalogue0.columns = catalogue.columns
+        match = crossmatch.match_positions(catalogue, catalogue0, radius=1e-4, chunksize=700)
+
+        self.assertEqual(len(match), 2500)
+        np.testing.assert_array_equal(catalogue.index.values[match.rows], match.rows0)
+        np.testing.assert_array_equal(match.source_id, match.rows)
+        self.assertTrue(np.all(match.separation < 1e-5))
+
+        columns = match.columns(catalogue, catalogue0)
+        M, r = frameRotation.designEquationColumns(omega, epsilon, columns)
+        self.assertEqual(M.shape, (10000, 6))
+        np.testing.assert_allclose(r, 0., atol=1e-14)
+
+    def test_radius_and_unique(self):
+        catalogue = {'alpha': np.array([0., 1e-5, 3e-5, 1.]), 'delta': np.zeros(4), 'sourceId': np.arange(4) + 10}
+        catalogue0 = {'alpha': np.array([0., 2.]), 'delta': np.zeros(2)}
+        match = crossmatch.match_positions(catalogue, catalogue0, radius=2e-5)
+        np.testing.assert_array_equal(match.rows, [0])
+        np.testing.assert_array_equal(match.source_id, [10])
+        match = crossmatch.match_positions(catalogue, catalogue0, radius=2e-5, unique=False)
+        np.testing.assert_array_equal(match.rows, [0, 1])
+        np.testing.assert_allclose(match.separation, [0., 1e-5], atol=1e-15)
+
+
+if __name__ == "__main__":
+    unittest.main()
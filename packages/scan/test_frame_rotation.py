@@ -0,0 +1,273 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+import numpy as np
+import pandas as pd
+
+import frameRotation
+
+
+def random_catalogues(n):
+    alpha = np.random.uniform(0, 2 * np.pi, n)
+    delta = np.random.uniform(-1.5, 1.5, n)
+    muAlphaStar, muDelta = np.random.normal(size=(2, n)) * 1e-8
+    return (alpha, delta, muAlphaStar, muDelta,
+            alpha + np.random.normal(size=n) * 1e-6, delta + np.random.normal(size=n) * 1e-6,
+            muAlphaStar + np.random.normal(size=n) * 1e-9, muDelta + np.random.normal(size=n) * 1e-9)
+
+
+class DesignEquationTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(9)
+        self.omega = np.array([1e-8, 2e-8, -1e-8])
+        self.epsilon = np.array([1e-6, -2e-6, 3e-6])
+        self.catalogues = random_catalogues(200)
+
+    def designEquation(self, **kwargs):
+        a0, d0, ma0, md0, a1, d1, ma1, md1 = self.catalogues
+        return frameRotation.designEquation(self.omega, self.epsilon, a0, d0, ma0, md0, 2015.5,
+                                            a1, d1, ma1, md1, 2000., **kwargs)
+
+    def test_rows_match_design_equation_row(self):
+        M, r = self.designEquation()
+        self.assertEqual(M.shape, (800, 6))
+        for i, source in enumerate(zip(*self.catalogues)):
+            row = frameRotation.designEquationRow(self.omega, self.epsilon, 2015.5, 2000., *source)
+            np.testing.assert_allclose(r[4 * i:4 * i + 4], row[:4], rtol=0, atol=1e-14)
+            np.testing.assert_allclose(M[4 * i:4 * i + 4], row[4:], rtol=1e-13, atol=1e-14)
+
+    def test_blocks_and_output_buffers(self):
+        expected_M, expected_r = self.designEquation()
+        M, r = np.full((800, 6), np.nan), np.full(800, np.nan)
+        blockSize = frameRotation.blockSize
+        frameRotation.blockSize = 7
+        try:
+            result = self.designEquation(M=M, r=r)
+        finally:
+            frameRotation.blockSize = blockSize
+        self.assertIs(result[0], M)
+        np.testing.assert_array_equal(M, expected_M)
+        np.testing.assert_array_equal(r, expected_r)
+
+
+def rotated_catalogues(n, epsilon, omega):
+    """
+    Reference catalogue and the Gaia catalogue seen in a frame rotated by epsilon, spinning at omega.
+    """
+    alpha0 = np.random.uniform(0, 2 * np.pi, n)
+    delta0 = np.arcsin(np.random.uniform(-1, 1, n))
+    muAlphaStar0, muDelta0 = np.random.normal(size=(2, n)) * 1e-8
+    p0, q0, r0 = frameRotation.pqrArrays(alpha0, delta0)
+    EtG = frameRotation.EtG(np.zeros(3), epsilon, 2015.5, 2015.5)
+    r = r0.dot(EtG)
+    mu = (muAlphaStar0[:, None] * p0 + muDelta0[:, None] * q0).dot(EtG) + np.cross(omega, r)
+    alpha = np.arctan2(r[:, 1], r[:, 0]) % (2 * np.pi)
+    delta = np.arctan2(r[:, 2], np.hypot(r[:, 0], r[:, 1]))
+    p, q, _ = frameRotation.pqrArrays(alpha, delta)
+    return pd.DataFrame(dict(sourceId=np.arange(n), alpha=alpha, delta=delta,
+                             muAlphaStar=np.einsum('ij,ij->i', p, mu), muDelta=np.einsum('ij,ij->i', q, mu),
+                             alpha0=alpha0, delta0=delta0, muAlphaStar0=muAlphaStar0, muDelta0=muDelta0))
+
+
+class SolveRotationStreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(10)
+        self.epsilon = np.array([2e-6, -1e-6, 3e-6])
+        self.omega = np.array([1e-8, -2e-8, 5e-9])
+        self.d = rotated_catalogues(3000, self.epsilon, self.omega)
+
+    def test_recovers_rotation(self):
+        chunks = [self.d[start:start + 700] for start in range(0, len(self.d), 700)]
+        epsilon, omega, covariance = frameRotation.solveRotationStreaming(chunks)
+        np.testing.assert_allclose(epsilon, self.epsilon, rtol=0, atol=1e-14)
+        np.testing.assert_allclose(omega, self.omega, rtol=0, atol=1e-16)
+        self.assertEqual(covariance.shape, (6, 6))
+        self.assertTrue(np.all(np.diag(covariance) >= 0))
+
+    def test_rejects_iterators(self):
+        chunks = (self.d[start:start + 700] for start in range(0, len(self.d), 700))
+        with self.assertRaises(TypeError):
+            frameRotation.solveRotationStreaming(chunks)
+
+    def test_normal_equations_do_not_depend_on_chunks(self):
+        whole = frameRotation.normalEquations(self.omega, self.epsilon * 0.5, [self.d])
+        blockSize = frameRotation.blockSize
+        frameRotation.blockSize = 128
+        try:
+            chunked = frameRotation.normalEquations(self.omega, self.epsilon * 0.5,
+                                                    [self.d[:1000], self.d[1000:]])
+        finally:
+            frameRotation.blockSize = blockSize
+        M, r = frameRotation.designEquation(self.omega, self.epsilon * 0.5,
+                                            *[self.d[name] for name in frameRotation.catalogueColumns[:4]], 2015.5,
+                                            *[self.d[name] for name in frameRotation.catalogueColumns[4:]], 2015.5)
+        for a, b in zip(whole, chunked):
+            np.testing.assert_allclose(a, b, rtol=1e-10)
+        np.testing.assert_allclose(whole[0], M.T.dot(M), rtol=1e-10)
+        np.testing.assert_allclose(whole[1], M.T.dot(r), rtol=1e-10, atol=1e-20)
+        self.assertEqual(whole[3], 4 * len(self.d))
+
+    def test_paired_csv_chunks(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path, path0 = os.path.join(directory, 'gaia.csv'), os.path.join(directory, 'reference.csv')
+            self.d[['sourceId', 'alpha', 'delta', 'muAlphaStar', 'muDelta']].to_csv(path, index=False)
+            reference = self.d[['sourceId', 'alpha0', 'delta0', 'muAlphaStar0', 'muDelta0']]
+            reference.columns = ['sourceId', 'alpha', 'delta', 'muAlphaStar', 'muDelta']
+            reference.to_csv(path0, index=False)
+            epsilon, omega, _ = frameRotation.solveRotationStreaming(
+                frameRotation.pairedCsvChunks(path, path0, chunksize=1000))
+            np.testing.assert_allclose(epsilon, self.epsilon, rtol=0, atol=1e-13)
+            np.testing.assert_allclose(omega, self.omega, rtol=0, atol=1e-15)
+
+            reference[::-1].to_csv(path0, index=False)
+            with self.assertRaises(ValueError):
+                frameRotation.solveRotationStreaming(frameRotation.pairedCsvChunks(path, path0))
+        finally:
+            shutil.rmtree(directory)
+
+
+class SolveRotationRobustTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(14)
+        n = 5000
+        self.epsilon = np.array([2e-6, -1e-6, 3e-6])
+        self.omega = np.array([1e-8, -2e-8, 5e-9])
+        d = rotated_catalogues(n, self.epsilon, self.omega)
+        sigma = np.random.uniform(0.5, 2, n) * 1e-8
+        d['alpha'] += np.random.normal(size=n) * sigma / np.cos(d.delta)
+        d['delta'] += np.random.normal(size=n) * sigma
+        d['muAlphaStar'] += np.random.normal(size=n) * sigma * 0.1
+        d['muDelta'] += np.random.normal(size=n) * sigma * 0.1
+        self.outliers = np.random.rand(n) < 0.05
+        d.loc[self.outliers, 'delta'] += 1e-5
+        self.columns = {name: d[name].values for name in frameRotation.catalogueColumns}
+        self.sigma = np.stack((sigma, sigma, sigma * 0.1, sigma * 0.1), axis=1)
+
+    def test_rejects_outliers(self):
+        epsilon, omega, covariance, kept = frameRotation.solveRotationRobust(self.columns, self.sigma)
+        self.assertFalse(np.any(kept & self.outliers))
+        self.assertLess(np.sum(~kept & ~self.outliers), 0.03 * len(kept))
+        error = np.sqrt(np.diag(covariance))
+        np.testing.assert_array_less(np.abs(np.concatenate((epsilon - self.epsilon, omega - self.omega))), 5 * error)
+
+        # the normal equations updated as sources are clipped give the solution of the sources
+        # kept, up to the tolerance of the linearisations
+        columns = {name: c[kept] for name, c in self.columns.items()}
+        solution = frameRotation.solveRotationRobust(columns, self.sigma[kept], clip=np.inf)
+        np.testing.assert_allclose(solution[0], epsilon, rtol=0, atol=1e-11)
+        np.testing.assert_allclose(solution[1], omega, rtol=0, atol=1e-13)
+        self.assertTrue(np.all(solution[3]))
+
+    def test_source_uncertainties(self):
+        for sigma, lost in ((self.sigma[:, 0], 0.03), (None, 0.12)):
+            epsilon, omega, covariance, kept = frameRotation.solveRotationRobust(self.columns, sigma)
+            self.assertFalse(np.any(kept & self.outliers))
+            self.assertLess(np.sum(~kept & ~self.outliers), lost * len(kept))
+            error = np.sqrt(np.diag(covariance))
+            np.testing.assert_array_less(np.abs(np.concatenate((epsilon - self.epsilon, omega - self.omega))),
+                                         5 * error)
+
+    def test_noise_free_catalogues(self):
+        d = rotated_catalogues(2000, self.epsilon, self.omega)
+        columns = {name: d[name].values for name in frameRotation.catalogueColumns}
+        for sigma in (None, np.full(2000, 1e-8)):
+            epsilon, omega, _, kept = frameRotation.solveRotationRobust(columns, sigma)
+            self.assertTrue(np.all(kept))
+            np.testing.assert_allclose(epsilon, self.epsilon, rtol=0, atol=1e-14)
+            np.testing.assert_allclose(omega, self.omega, rtol=0, atol=1e-16)
+
+    def test_minimum_number_of_sources(self):
+        columns = {name: c[:20] for name, c in self.columns.items()}
+        with self.assertWarns(UserWarning):
+            kept = frameRotation.solveRotationRobust(columns, self.sigma[:20], clip=0.1, minSources=15)[3]
+        self.assertGreaterEqual(kept.sum(), 15)
+
+    def test_unweighted_without_outliers(self):
+        columns = {name: c[~self.outliers] for name, c in self.columns.items()}
+        epsilon, omega, _, kept = frameRotation.solveRotationRobust(columns, clip=np.inf)
+        reference = frameRotation.solveRotationStreaming([columns])
+        np.testing.assert_allclose(epsilon, reference[0], rtol=1e-9)
+        np.testing.assert_allclose(omega, reference[1], rtol=1e-9)
+
+    def test_missing_values(self):
+        columns = {name: c.copy() for name, c in self.columns.items()}
+        sigma = self.sigma.copy()
+        columns['muDelta'][3] = np.nan
+        columns['alpha0'][10] = np.nan
+        sigma[20, 1] = np.nan
+        missing = np.isin(np.arange(len(sigma)), [3, 10, 20])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            epsilon, omega, covariance, kept = frameRotation.solveRotationRobust(columns, sigma)
+        self.assertFalse(np.any(kept & missing))
+        self.assertFalse(np.any(kept & self.outliers))
+        self.assertTrue(np.all(np.isfinite(covariance)))
+        # the same as without those sources
+        reference = frameRotation.solveRotationRobust({name: c[~missing] for name, c in self.columns.items()},
+                                                      self.sigma[~missing])
+        np.testing.assert_array_equal(kept[~missing], reference[3])
+        np.testing.assert_allclose(epsilon, reference[0], rtol=0, atol=1e-11)
+        np.testing.assert_allclose(omega, reference[1], rtol=0, atol=1e-13)
+
+
+class RotationPerBinLocalTest(unittest.TestCase):
+
+    def test_bins(self):
+        np.random.seed(11)
+        epsilons = np.random.normal(size=(3, 3)) * 1e-6
+        omegas = np.random.normal(size=(3, 3)) * 1e-8
+        parts = [rotated_catalogues(400, epsilon, omega) for epsilon, omega in zip(epsilons, omegas)]
+        for i, part in enumerate(parts):
+            part['sourceId'] += 1000 * i
+            part['gMag'] = np.random.uniform(12 + 2 * i, 14 + 2 * i, len(part))
+        d = pd.concat(parts).sample(frac=1)
+        df1 = d[['sourceId', 'gMag', 'alpha', 'delta', 'muAlphaStar', 'muDelta']]
+        df0 = d[['sourceId', 'gMag', 'alpha0', 'delta0', 'muAlphaStar0', 'muDelta0']].copy()
+        df0.columns = ['sourceId', 'gMag', 'alpha', 'delta', 'muAlphaStar', 'muDelta']
+        df0 = df0.iloc[::-1]
+        df0.loc[df0.sourceId == 5, 'gMag'] = 20.   # in another bin of the reference catalogue
+
+        table = frameRotation.rotationPerMagLocal(df0, df1, [12, 14, 16, 18, 19])
+        self.assertEqual(len(table), 4)
+        np.testing.assert_array_equal(table['n'], [399, 400, 400, 0])
+        np.testing.assert_allclose(table['epsilon'][:3], epsilons, rtol=0, atol=1e-14)
+        np.testing.assert_allclose(table['omega'][:3], omegas, rtol=0, atol=1e-16)
+        self.assertEqual(table['covariance'].shape, (4, 6, 6))
+        self.assertTrue(np.all(np.isnan(table['epsilon'][3])))
+
+    def test_singular_bins_and_missing_values(self):
+        np.random.seed(12)
+        epsilon, omega = np.array([1e-6, -2e-6, 5e-7]), np.array([1e-8, 3e-9, -2e-8])
+        d = rotated_catalogues(300, epsilon, omega)
+        d['gMag'] = np.random.uniform(12, 14, len(d))
+        d.iloc[:10, d.columns.get_loc('gMag')] = 14.5
+        d.iloc[2:10, d.columns.get_loc('muDelta')] = np.nan
+        # two identical sources
+        d.iloc[10:12, d.columns.get_loc('gMag')] = 15.5
+        for name in frameRotation.catalogueColumns:
+            d.iloc[11, d.columns.get_loc(name)] = d.iloc[10][name]
+        df1 = d[['sourceId', 'gMag', 'alpha', 'delta', 'muAlphaStar', 'muDelta']]
+        df0 = d[['sourceId', 'gMag', 'alpha0', 'delta0', 'muAlphaStar0', 'muDelta0']].copy()
+        df0.columns = df1.columns
+
+        table = frameRotation.rotationPerMagLocal(df0, df1, [12, 14, 15, 16])
+        np.testing.assert_array_equal(table['n'], [288, 2, 2])
+        # the 2 sources left of the bin of 10 are enough
+        for i in (0, 1):
+            np.testing.assert_allclose(table['epsilon'][i], epsilon, rtol=0, atol=1e-14)
+            np.testing.assert_allclose(table['omega'][i], omega, rtol=0, atol=1e-16)
+            self.assertTrue(np.all(np.isfinite(table['covariance'][i])))
+        # 2 identical sources are not, without stopping the other bins
+        self.assertTrue(np.all(np.isnan(table['epsilon'][2])))
+        self.assertTrue(np.all(np.isnan(table['omega'][2])))
+        self.assertTrue(np.all(np.isnan(table['covariance'][2])))
+
+
+if __name__ == "__main__":
+    unittest.main()
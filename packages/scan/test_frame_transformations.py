@@ -0,0 +1,120 @@
+import unittest
+import numpy as np
+
+from quaternion import Quaternion
+import frame_transformations as ft
+from NSL import Attitude, Scanner
+
+
+def quaternion_rotation(q, v):
+    product = q * Quaternion(0, *v) * q.conjugate()
+    return np.array([product.x, product.y, product.z])
+
+
+class BatchTransformationsTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(5)
+        self.q = np.random.normal(size=(40, 4))
+        self.v = np.random.normal(size=(40, 3))
+
+    def test_rotations_match_quaternion_products(self):
+        bcrs, srs = ft.bcrs_batch(self.q, self.v), ft.srs_batch(self.q, self.v)
+        for i in range(len(self.q)):
+            q = Quaternion(*self.q[i])
+            np.testing.assert_allclose(bcrs[i], quaternion_rotation(q, self.v[i]), atol=1e-12)
+            np.testing.assert_allclose(srs[i], quaternion_rotation(q.conjugate(), self.v[i]), atol=1e-12)
+            np.testing.assert_allclose(ft.srs(q, self.v[i]), srs[i], atol=1e-15)
+
+    def test_broadcasting(self):
+        many_vectors = ft.srs_batch(self.q[3], self.v)
+        many_attitudes = ft.bcrs_batch(self.q, self.v[3])
+        for i in range(len(self.q)):
+            np.testing.assert_array_equal(many_vectors[i], ft.srs_batch(self.q[3], self.v[i])[0])
+            np.testing.assert_array_equal(many_attitudes[i], ft.bcrs_batch(self.q[i], self.v[3])[0])
+
+    def test_output_buffer(self):
+        out = np.empty((40, 3))
+        self.assertIs(ft.bcrs_batch(self.q, self.v, out=out), out)
+        np.testing.assert_array_equal(out, ft.bcrs_batch(self.q, self.v))
+        # rotating back in place
+        ft.srs_batch(self.q / np.linalg.norm(self.q, axis=1)[:, None], out, out=out)
+        np.testing.assert_allclose(out, self.v * np.sum(self.q ** 2, axis=1)[:, None], atol=1e-12)
+
+    def test_mismatched_rows(self):
+        with self.assertRaises(ValueError):
+            ft.srs_batch(np.ones((5, 4)), np.ones((3, 3)))
+        with self.assertRaises(ValueError):
+            ft.bcrs_batch(self.q, self.v[:2])
+        with self.assertRaises(ValueError):
+            ft.rotation_to_quat_batch(np.ones((2, 3)), np.ones(4))
+
+    def test_bad_output_buffer(self):
+        for out in (np.empty((10, 3)), np.empty((40, 3), dtype=np.float32), np.empty((3, 40)).T,
+                    np.empty((40, 4))):
+            with self.assertRaises(ValueError):
+                ft.bcrs_batch(self.q, self.v, out=out)
+        with self.assertRaises(ValueError):
+            ft.rotation_to_quat_batch(self.v, np.arange(40.), out=np.empty((40, 3)))
+        with self.assertRaises(ValueError):
+            ft.xyz_batch(np.zeros(40), np.zeros(40), out=np.empty((39, 3)))
+
+    def test_angles(self):
+        angles = np.random.uniform(-1, 1, size=(40, 2))
+        vectors = ft.xyz_batch(angles[:, 0], angles[:, 1])
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.)
+        np.testing.assert_allclose(ft.alpha_delta_batch(vectors), angles, atol=1e-14)
+        np.testing.assert_array_equal(ft.xyz(angles[:, 0], angles[:, 1]), vectors.T)
+        alpha, delta = ft.alpha_delta(vectors[0])
+        self.assertAlmostEqual(alpha, angles[0, 0])
+        self.assertAlmostEqual(delta, angles[0, 1])
+
+    def test_rotation_to_quat(self):
+        quats = ft.rotation_to_quat_batch(self.v, np.arange(40.))
+        for i in range(len(self.v)):
+            q = ft.rotation_to_quat(self.v[i], float(i))
+            np.testing.assert_allclose([q.w, q.x, q.y, q.z], quats[i], rtol=0, atol=1e-15)
+        np.testing.assert_allclose(np.linalg.norm(quats, axis=1), 1.)
+
+    def test_zero_rotation_axis(self):
+        with self.assertRaises(ValueError):
+            ft.rotation_to_quat(np.zeros(3), 1.)
+        axes = self.v.copy()
+        axes[7] = 0
+        with self.assertRaises(ValueError):
+            ft.rotation_to_quat_batch(axes, np.arange(40.))
+
+    def test_galactic_to_equatorial(self):
+        # The galactic centre and the north galactic pole.
+        alpha, delta = ft.galactic_to_equatorial(np.array([0., 0.]), np.radians([0., 90.]))
+        np.testing.assert_allclose(np.degrees(np.mod(alpha, 2 * np.pi)), [266.40499, 192.85948], atol=1e-5)
+        np.testing.assert_allclose(np.degrees(delta), [-28.93617, 27.12825], atol=1e-5)
+
+
+class ScanFramesTest(unittest.TestCase):
+
+    def test_frames_match_srs(self):
+        att = Attitude(0, 10, 0.01)
+        frames = Scanner().frames(att)
+        star = np.array([0.6, 0., 0.8])
+        np.testing.assert_allclose(frames.srs(star), ft.srs_batch(att.storage.q, star), atol=1e-14)
+        np.testing.assert_allclose(frames.x_srs, ft.srs_batch(att.storage.q, att.storage.x), atol=1e-14)
+
+    def test_cache_is_invalidated_by_refinement(self):
+        att = Attitude(0, 10, 0.01)
+        scanner = Scanner()
+        frames = scanner.frames(att)
+        self.assertIs(scanner.frames(att), frames)
+        att.refine(2, 3, 0.001)
+        refined = scanner.frames(att)
+        self.assertIsNot(refined, frames)
+        self.assertEqual(len(refined), len(att.storage))
+        # refining a span already refined keeps the table and its frames
+        att.refine(2, 3, 0.001)
+        self.assertIs(scanner.frames(att), refined)
+        att.storage = att.storage[:100]
+        self.assertEqual(len(scanner.frames(att)), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from NSL import Attitude, Scanner, Sky, star_finder
+import observation_table
+from observation_table import ObservationTable
+import transits
+
+
+def random_batch(n, source_id=0):
+    direction = np.random.normal(size=(n, 3))
+    return (source_id, np.sort(np.random.uniform(0, 100, n)), np.random.normal(size=n),
+            np.random.normal(size=n), direction, np.arange(n))
+
+
+class ObservationTableTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2)
+        self.directory = tempfile.mkdtemp()
+        self.table = ObservationTable.empty()
+        for source_id in range(5):
+            self.table.append(*random_batch(700, source_id))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertTablesEqual(self, a, b):
+        self.assertEqual(len(a), len(b))
+        for name in ObservationTable.columns:
+            np.testing.assert_array_equal(getattr(a, name), getattr(b, name))
+
+    def test_append(self):
+        self.assertEqual(len(self.table), 3500)
+        np.testing.assert_array_equal(self.table.source_id[695:705], [0] * 5 + [1] * 5)
+        self.assertEqual(self.table.direction.shape, (3500, 3))
+        self.assertEqual(len(self.table[10:20]), 10)
+        self.table.sort()
+        self.assertTrue(np.all(np.diff(self.table.time) >= 0))
+
+    def check_round_trip(self, name):
+        path = os.path.join(self.directory, name)
+        self.table.save(path, row_group_size=1000)
+        self.assertTablesEqual(ObservationTable.load(path), self.table)
+
+    def test_directory_is_memory_mapped(self):
+        self.check_round_trip('observations')
+        loaded = ObservationTable.load(os.path.join(self.directory, 'observations'))
+        # Read-only views of the mapped files rather than copies.
+        self.assertFalse(loaded.time.flags['OWNDATA'])
+        self.assertFalse(loaded.direction.flags['WRITEABLE'])
+
+    def test_npz(self):
+        self.check_round_trip('observations.npz')
+
+    @unittest.skipIf(observation_table.pyarrow is None, "pyarrow is not installed")
+    def test_parquet(self):
+        self.check_round_trip('observations.parquet')
+
+    @unittest.skipIf(observation_table.h5py is None, "h5py is not installed")
+    def test_hdf5(self):
+        self.check_round_trip('observations.h5')
+
+    @unittest.skipIf(observation_table.h5py is None, "h5py is not installed")
+    def test_hdf5_is_read_on_indexing(self):
+        path = os.path.join(self.directory, 'observations.h5')
+        self.table.save(path, row_group_size=1000)
+        loaded = ObservationTable.load(path)
+        for name in ObservationTable.columns:
+            self.assertIsInstance(getattr(loaded, name), observation_table.h5py.Dataset)
+        part = loaded[1000:1010]
+        self.assertIsInstance(part.direction, np.ndarray)
+        np.testing.assert_array_equal(part.direction, self.table.direction[1000:1010])
+        np.testing.assert_array_equal(loaded.time[::7], self.table.time[::7])
+        rows = np.random.permutation(len(self.table))[:50]
+        np.testing.assert_array_equal(loaded[rows].time, self.table.time[rows])
+        loaded.sort()
+        self.assertTrue(np.all(np.diff(loaded.time) >= 0))
+
+    def test_stream(self):
+        path = os.path.join(self.directory, 'stream.npz')
+        streamed = ObservationTable.empty()
+        streamed.stream_to(path, row_group_size=1000)
+        for start in range(0, len(self.table), 300):
+            chunk = self.table[start:start + 300]
+            streamed.append(*(getattr(chunk, name) for name in ObservationTable.columns))
+            self.assertLess(len(streamed), 1000)
+        streamed.close()
+        self.assertEqual(len(streamed), 0)
+        self.assertTablesEqual(ObservationTable.load(path), self.table)
+
+
+class ScannerObservationsTest(unittest.TestCase):
+
+    def test_star_finder_keeps_all_stars(self):
+        np.random.seed(4)
+        sky = Sky(3)
+        scanner = Scanner()
+        att = Attitude(0, 60, 0.01)
+        star_finder(scanner, att, sky)
+        observations = scanner.observations
+        self.assertEqual(len(observations), len(scanner.obs_times))
+        self.assertGreater(len(np.unique(observations.source_id)), 1)
+        np.testing.assert_array_equal(observations.time, scanner.obs_times)
+        np.testing.assert_allclose(observations.direction, scanner.stars_positions)
+        self.assertTrue(np.all(np.abs(observations.along_scan) < scanner.delta_y))
+        # rows of the attitude table refined by the deep scans of all the stars
+        np.testing.assert_array_equal(att.storage.t[observations.attitude_index], observations.time)
+
+        batched = Scanner()
+        transits.scan_sky(batched, Attitude(0, 60, 0.01), sky)
+        self.assertEqual(len(batched.observations), len(observations))
+        self.assertEqual(set(batched.observations.source_id), set(observations.source_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import numpy as np
+
+from quaternion import Quaternion, QuaternionArray
+import frame_transformations as ft
+
+
+class QuaternionArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(8)
+        self.a = QuaternionArray(np.random.normal(size=(30, 4)))
+        self.b = QuaternionArray(np.random.normal(size=(30, 4)))
+        self.v = np.random.normal(size=(30, 3))
+
+    def assertQuaternionsEqual(self, quat, row):
+        np.testing.assert_allclose([quat.w, quat.x, quat.y, quat.z], row, atol=1e-14)
+
+    def test_interoperates_with_quaternion(self):
+        quats = [Quaternion(*row) for row in self.a.q]
+        array = QuaternionArray(quats)
+        np.testing.assert_array_equal(array.q, self.a.q)
+        self.assertIsInstance(array[3], Quaternion)
+        self.assertIsInstance(array[1:4], QuaternionArray)
+        self.assertEqual(len(list(array)), 30)
+        np.testing.assert_allclose(array.magnitude, [quat.magnitude for quat in quats])
+
+    def test_products(self):
+        product = self.a * self.b
+        single = self.a[0]
+        left, right = single * self.b, self.b * single
+        for i in range(len(self.a)):
+            self.assertQuaternionsEqual(self.a[i] * self.b[i], product.q[i])
+            self.assertQuaternionsEqual(single * self.b[i], left.q[i])
+            self.assertQuaternionsEqual(self.b[i] * single, right.q[i])
+        np.testing.assert_allclose((self.a * 2.).q, 2 * self.a.q)
+
+    def test_conjugate_and_normalize(self):
+        unit = self.a.normalize()
+        np.testing.assert_allclose(unit.magnitude, 1.)
+        identity = unit * unit.conjugate()
+        np.testing.assert_allclose(identity.q, np.tile([1., 0, 0, 0], (30, 1)), atol=1e-15)
+        self.assertQuaternionsEqual(self.a[2].conjugate(), self.a.conjugate().q[2])
+
+    def test_rotations_match_frame_transformations(self):
+        unit = self.a.normalize()
+        bcrs, srs = unit.rotate(self.v), unit.rotate(self.v, inverse=True)
+        A = unit.basis()
+        for i in range(len(unit)):
+            np.testing.assert_allclose(bcrs[i], ft.bcrs(unit[i], self.v[i]), atol=1e-14)
+            np.testing.assert_allclose(srs[i], ft.srs(unit[i], self.v[i]), atol=1e-14)
+            np.testing.assert_allclose(A[i], unit[i].basis(), atol=1e-15)
+        # one quaternion, many vectors
+        np.testing.assert_allclose(unit[:1].rotate(self.v)[5], ft.bcrs(unit[0], self.v[5]), atol=1e-14)
+
+    def test_from_axis_angle(self):
+        angles = np.random.uniform(0, np.pi, 30)
+        array = QuaternionArray.from_axis_angle(self.v, angles)
+        for i in range(len(array)):
+            self.assertQuaternionsEqual(ft.rotation_to_quat(self.v[i], angles[i]), array.q[i])
+
+    def test_slerp(self):
+        a, b = self.a.normalize(), self.b.normalize()
+        np.testing.assert_allclose(a.slerp(b, np.zeros(30)).q, a.q, atol=1e-15)
+        half = a.slerp(b, np.full(30, 0.5))
+        np.testing.assert_allclose(half.magnitude, 1.)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+
+import scanner_static
+
+
+class GeometryTest(unittest.TestCase):
+
+    def test_plane_geometry(self):
+        normal = np.array([0., 0., 2.])
+        points = np.array([[1., 0., 1.], [0., 2., -2.], [3., 0., 0.]])
+        np.testing.assert_allclose(scanner_static.angle_between(np.zeros(3), normal, points),
+                                   [np.pi / 4, -np.pi / 4, 0.], atol=1e-15)
+        np.testing.assert_allclose(scanner_static.projection(np.zeros(3), normal, points),
+                                   [[1., 0., 0.], [0., 2., 0.], [3., 0., 0.]])
+
+    def test_unknown_backend(self):
+        sky = scanner_static.Sky(3)
+        with self.assertRaises(ValueError):
+            scanner_static.Satellite(0, 0, 1).Scan(sky, backend='exact')
+
+
+class ScanTimesTest(unittest.TestCase):
+
+    @staticmethod
+    def loop_times(phi, deltaphi, azimuths):
+        times = []
+        for i in np.arange(0, phi, deltaphi):
+            axis1phi, axis2phi = i % (2 * np.pi), (i + deltaphi) % (2 * np.pi)
+            times.extend(i % (2 * np.pi) for azimuth in azimuths if axis1phi < azimuth < axis2phi)
+        return times
+
+    def test_matches_step_loop(self):
+        np.random.seed(6)
+        for phi, deltaphi in ((2 * np.pi, np.radians(1.)), (7 * np.pi, 0.0123)):
+            steps = np.arange(0, phi, deltaphi)
+            azimuths = np.random.uniform(0, 2 * np.pi, 100)
+            azimuths[:3] = steps[[5, 10, 20]] % (2 * np.pi)   # on the edge of a step
+            times, indexes = scanner_static.scan_times(steps, deltaphi, azimuths)
+            self.assertEqual(list(times), self.loop_times(phi, deltaphi, azimuths))
+            np.testing.assert_array_less(times, azimuths[indexes])
+
+    def test_revolutions(self):
+        np.random.seed(7)
+        deltaphi = np.radians(1 / 3600.)
+        azimuths = np.random.uniform(0, 2 * np.pi, 1000)
+        times, indexes = scanner_static.scan_times(np.arange(0, 3 * 2 * np.pi, deltaphi), deltaphi, azimuths)
+        self.assertEqual(len(times), 3000)
+        np.testing.assert_array_equal(np.bincount(indexes), 3)
+
+
+@unittest.skipIf(scanner_static.sympy is None, "sympy is not installed")
+class SympyBackendTest(unittest.TestCase):
+
+    def test_backends_agree(self):
+        np.random.seed(3)
+        sky = scanner_static.Sky(40)
+        results = []
+        for backend in ('numpy', 'sympy'):
+            satellite = scanner_static.Satellite(0, 0.3, 1)
+            satellite.Scan(sky, zeta=np.radians(40.), backend=backend)
+            scanner_static.Measurements(satellite)
+            results.append((satellite.indexes, [obs.coor for obs in satellite.observations],
+                            [star.coor for star in satellite.measurements],
+                            scanner_static.Psi(satellite, sky), satellite.times))
+        numeric, symbolic = results
+        self.assertGreater(len(numeric[0]), 0)
+        self.assertEqual(list(numeric[0]), list(symbolic[0]))
+        for a, b in zip(numeric[1:4], symbolic[1:4]):
+            np.testing.assert_allclose(a, b, rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(numeric[4], symbolic[4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import unittest
+import numpy as np
+
+from NSL import Attitude, Scanner, Sky, Source, star_finder
+from sky_catalog import SkyCatalog, SourceView, sun_directions, MAS
+import transits
+
+
+class SkyCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(7)
+        self.catalog = SkyCatalog.random(1000)
+
+    def test_columns(self):
+        self.assertEqual(len(self.catalog), 1000)
+        self.assertEqual(self.catalog.nbytes / len(self.catalog), 64)
+        for name in SkyCatalog.columns:
+            column = getattr(self.catalog, name)
+            self.assertEqual(column.dtype, np.float64)
+            self.assertTrue(column.flags['C_CONTIGUOUS'])
+        np.testing.assert_allclose(np.linalg.norm(self.catalog.vectors, axis=1), 1.)
+
+    def test_views_match_source(self):
+        star = self.catalog[3]
+        self.assertIsInstance(star, SourceView)
+        source = Source(star.alpha, star.delta, self.catalog.mualpha[3], self.catalog.mudelta[3])
+        np.testing.assert_array_equal(star.coor, source.coor)
+        np.testing.assert_array_equal(star.velocity, source.velocity)
+        self.assertEqual(len(list(self.catalog.elements)), len(self.catalog))
+        np.testing.assert_array_equal(self.catalog[-1].coor, self.catalog.vectors[-1])
+        with self.assertRaises(IndexError):
+            self.catalog[1000]
+
+    def test_slicing(self):
+        subset = self.catalog[10:20]
+        self.assertIsInstance(subset, SkyCatalog)
+        self.assertEqual(len(subset), 10)
+        np.testing.assert_array_equal(subset.vectors, self.catalog.vectors[10:20])
+        picked = self.catalog[np.array([5, 1])]
+        np.testing.assert_array_equal(picked.parallax, self.catalog.parallax[[5, 1]])
+
+    def test_star_finder_accepts_catalog(self):
+        catalog = self.catalog[:2]
+        sky = Sky(0)
+        sky.elements = [Source(a, d) for a, d in zip(catalog.alpha, catalog.delta)]
+        scanner, expected = Scanner(), Scanner()
+        star_finder(scanner, Attitude(0, 30, 0.01), catalog)
+        star_finder(expected, Attitude(0, 30, 0.01), sky)
+        self.assertGreater(len(scanner.obs_times), 0)
+        self.assertEqual(scanner.obs_times, expected.obs_times)
+        np.testing.assert_array_equal(transits.star_vectors(catalog), catalog.vectors)
+
+    def test_from_csv(self):
+        data = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+        catalog = SkyCatalog.from_csv(os.path.join(data, 'gdr1set03.csv'))
+        self.assertGreater(len(catalog), 0)
+        self.assertTrue(np.all(np.abs(catalog.delta) <= np.pi / 2))
+        self.assertTrue(np.all(catalog.mualpha != 0))
+        self.assertTrue(np.all(catalog.mudelta != 0))
+        np.testing.assert_allclose(np.degrees(catalog.alpha[0]), 55.87979622773264)
+        np.testing.assert_allclose(catalog.mualpha[0], 19.719670270041995)
+        # gdr1set01 only has galactic coordinates.
+        galactic = SkyCatalog.from_csv(os.path.join(data, 'gdr1set01.csv'))
+        self.assertTrue(np.all((galactic.alpha >= 0) & (galactic.alpha < 2 * np.pi)))
+        self.assertTrue(np.all(np.abs(galactic.delta) <= np.pi / 2))
+
+
+class PositionsAtTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(11)
+        self.att = Attitude(0, 400, 0.1)
+        self.catalog = SkyCatalog.random(50)
+        self.catalog.parallax = np.random.uniform(1, 100, 50)
+        self.times = np.linspace(0, 365.25, 9)
+
+    def test_proper_motion(self):
+        catalog = self.catalog[:]
+        catalog.parallax = np.zeros(len(catalog))
+        u = catalog.positions_at(self.times, self.att)
+        np.testing.assert_allclose(u[0], catalog.vectors, atol=1e-15)
+        # After one year the sources have moved by mu on the sky.
+        moved = np.linalg.norm(u[-1] - catalog.vectors, axis=1)
+        mu = np.hypot(catalog.mualpha, catalog.mudelta) * MAS
+        np.testing.assert_allclose(moved, mu, rtol=1e-6)
+
+    def test_parallax_towards_sun(self):
+        catalog = self.catalog[:]
+        catalog.mualpha = catalog.mudelta = np.zeros(len(catalog))
+        u = catalog.positions_at(self.times, self.att)
+        sun = sun_directions(self.att, self.times)
+        shift = u - catalog.vectors[None]
+        # To first order, the component of the Sun direction normal to the source, times the parallax.
+        normal = sun[:, None, :] - np.sum(sun[:, None, :] * catalog.vectors[None], axis=2)[:, :, None] * catalog.vectors[None]
+        np.testing.assert_allclose(shift, normal * (catalog.parallax * MAS)[None, :, None], atol=1e-12)
+
+    def test_extended_attitude(self):
+        att = Attitude(0, 200, 0.1, integrator='rk4')
+        att.create_storage(200, 400, 0.1)
+        np.testing.assert_allclose(sun_directions(att, self.times), sun_directions(self.att, self.times), atol=1e-6)
+        np.testing.assert_allclose(self.catalog.positions_at(self.times, att),
+                                   self.catalog.positions_at(self.times, self.att), atol=1e-12)
+
+    def test_pairs_match_grid(self):
+        grid = self.catalog.positions_at(self.times, self.att)
+        sources = np.random.randint(0, len(self.catalog), 20)
+        epochs = np.random.randint(0, len(self.times), 20)
+        pairs = self.catalog.positions_at(self.times[epochs], self.att, sources)
+        np.testing.assert_allclose(pairs, grid[epochs, sources], atol=1e-15)
+
+    def test_memoized(self):
+        grid = self.catalog.positions_at(self.times, self.att)
+        self.assertIs(self.catalog.positions_at(self.times.copy(), self.att), grid)
+        self.assertIsNot(self.catalog.positions_at(self.times + 1, self.att), grid)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import os
+import unittest
+import numpy as np
+
+from NSL import Attitude, Scanner, Sky, star_finder
+from quaternion import Quaternion
+import frame_transformations as ft
+import transits
+import parallel_scan
+from sky_index import SkyIndex
+
+
+class RotationMatricesTest(unittest.TestCase):
+
+    def test_matches_srs(self):
+        q = np.random.uniform(-1, 1, (20, 4))
+        q /= np.linalg.norm(q, axis=1)[:, None]
+        v = np.random.uniform(-1, 1, 3)
+        A = transits.rotation_matrices(q)
+        for i in range(len(q)):
+            quat = Quaternion(*q[i])
+            np.testing.assert_allclose(A[i], quat.basis(), atol=1e-15)
+            np.testing.assert_allclose(A[i].dot(v), ft.srs(quat, v), atol=1e-14)
+
+
+class FindTransitsTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(3)
+        self.sky = Sky(1)
+        self.scanner = Scanner()
+        self.att = Attitude(0, 60, 0.01)
+
+    def test_scan_sky_matches_star_finder(self):
+        star_finder(self.scanner, self.att, self.sky)
+
+        scanner = Scanner()
+        att = Attitude(0, 60, 0.01)
+        found = transits.scan_sky(scanner, att, self.sky)
+        self.assertGreater(len(scanner.obs_times), 0)
+        np.testing.assert_array_equal(scanner.obs_times, self.scanner.obs_times)
+        np.testing.assert_allclose(scanner.stars_positions, self.scanner.stars_positions, atol=1e-13)
+        self.assertTrue(np.all(found.star_index == 0))
+
+    def test_intercept_matches_scanner(self):
+        self.scanner.intercept(self.att, self.sky.elements[0])
+        candidates = transits.find_transits(self.scanner, self.att.storage,
+                                            transits.star_vectors(self.sky), transits.intercept_mask)
+        np.testing.assert_array_equal(candidates.time, self.scanner.times_deep_scan)
+
+    def test_many_stars_in_chunks(self):
+        stars = np.random.normal(size=(500, 3))
+        stars /= np.linalg.norm(stars, axis=1)[:, None]
+        whole = transits.find_transits(self.scanner, self.att.storage, stars)
+        chunked = transits.find_transits(self.scanner, self.att.storage, stars, chunk_size=7)
+        np.testing.assert_array_equal(whole.time, chunked.time)
+        np.testing.assert_array_equal(whole.star_index, chunked.star_index)
+        self.assertTrue(np.all(np.diff(whole.time) >= 0))
+        np.testing.assert_array_equal(self.att.storage.t[whole.row], whole.time)
+
+    def test_indexed_matches_brute_force(self):
+        stars = np.random.normal(size=(2000, 3))
+        stars /= np.linalg.norm(stars, axis=1)[:, None]
+        for mask in (transits.intercept_mask, transits.transit_mask):
+            whole = transits.find_transits(self.scanner, self.att.storage, stars, mask)
+            indexed = transits.find_transits(self.scanner, self.att.storage, SkyIndex(stars), mask,
+                                             chunk_size=500)
+            self.assertGreater(len(whole.time), 0)
+            np.testing.assert_array_equal(whole.row, indexed.row)
+            np.testing.assert_array_equal(whole.star_index, indexed.star_index)
+
+
+class SolveTransitsTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(3)
+        self.sky = Sky(3)
+        self.stars = transits.star_vectors(self.sky)
+        self.scanner = Scanner()
+
+    def test_comparable_with_star_finder(self):
+        sky = Sky(1)
+        att = Attitude(0, 60, 0.01)
+        star_finder(self.scanner, att, sky)
+        crossings = transits.solve_transits(self.scanner, att, transits.star_vectors(sky))
+        self.assertGreater(len(self.scanner.obs_times), 0)
+        self.assertGreaterEqual(len(crossings.time), len(self.scanner.obs_times))
+        # star_finder keeps the samples within delta_y of the axis: the star stays
+        # within the line of intercept from every one of them to the nearest root.
+        obs_times = np.array(self.scanner.obs_times)
+        nearest = crossings.time[np.abs(np.subtract.outer(obs_times, crossings.time)).argmin(axis=1)]
+        times = np.linspace(obs_times, nearest, 5).ravel()
+        star = np.tile(sky.elements[0].coor, (len(times), 1))
+        along_scan = transits.field_angles(att.attitude_at(times), star)[0]
+        self.assertLess(np.abs(along_scan).max(), self.scanner.delta_y)
+
+    def test_roots_on_dense_solution(self):
+        att = Attitude(0, 30, 0.01, integrator='rk4')
+        crossings = transits.solve_transits(self.scanner, att, self.stars)
+        self.assertGreater(len(crossings.time), 0)
+        self.assertTrue(np.all(np.diff(crossings.time) >= 0))
+        q = transits.attitude_function(att)(crossings.time)
+        along_scan, across_scan = transits.field_angles(q, self.stars[crossings.star_index])
+        self.assertLess(np.abs(along_scan).max(), 1e-9)
+        np.testing.assert_allclose(across_scan, crossings.across_scan, atol=1e-12)
+        self.assertTrue(np.all(np.abs(across_scan) < np.arctan2(self.scanner.delta_z / 2, 1)))
+
+    def test_extended_attitude(self):
+        att = Attitude(0, 15, 0.01, integrator='rk4')
+        att.create_storage(15, 30, 0.01)
+        self.assertFalse(att.solution.covers(att.storage.t))
+        crossings = transits.solve_transits(self.scanner, att, self.stars)
+        self.assertGreater(len(crossings.time), 0)
+        q = att.storage.attitude_at(crossings.time)
+        along_scan, _ = transits.field_angles(q, self.stars[crossings.star_index])
+        self.assertLess(np.abs(along_scan).max(), 1e-9)
+
+    def test_shared_geometry(self):
+        att = Attitude(0, 15, 0.01, integrator='rk4')
+        geometry = transits.bracket_geometry(att.storage, chunk_size=100)
+        np.testing.assert_allclose(geometry.xy, transits.rotation_matrices(att.storage.q)[:, :2], atol=1e-15)
+        expected = transits.solve_transits(self.scanner, att, self.stars, chunk_size=250)
+        crossings = transits.solve_transits(self.scanner, att, self.stars, chunk_size=250, geometry=geometry)
+        self.assertGreater(len(crossings.time), 0)
+        for column, expected_column in zip(crossings, expected):
+            np.testing.assert_array_equal(column, expected_column)
+
+
+class ParallelScanTest(unittest.TestCase):
+
+    def test_matches_serial(self):
+        np.random.seed(9)
+        sky = Sky(40)
+        att = Attitude(0, 30, 0.01, integrator='rk4')
+        n_samples, t = len(att.storage), att.t
+        scanner = Scanner()
+        crossings = parallel_scan.scan_sky_parallel(scanner, att, sky, processes=2, partitions=3)
+        serial = transits.solve_transits(Scanner(), att, transits.star_vectors(sky))
+        self.assertGreater(len(crossings.time), 0)
+        np.testing.assert_array_equal(crossings.time, serial.time)
+        np.testing.assert_array_equal(crossings.star_index, serial.star_index)
+        # The attitude is shared read-only.
+        self.assertEqual((len(att.storage), att.t), (n_samples, t))
+        self.assertEqual(scanner.obs_times, list(crossings.time))
+        x = att.solution(crossings.time).x
+        np.testing.assert_allclose(scanner.stars_positions, x, atol=1e-12)
+        observations = scanner.observations
+        self.assertLess(np.abs(observations.along_scan).max(), 1e-9)
+        rows = observations.attitude_index
+        self.assertTrue(np.all(att.storage.t[rows] <= observations.time))
+        self.assertTrue(np.all(observations.time < att.storage.t[rows + 1]))
+
+
+class SkyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(5)
+        stars = np.random.normal(size=(5000, 3))
+        self.stars = stars / np.linalg.norm(stars, axis=1)[:, None]
+        self.index = SkyIndex(self.stars)
+
+    def test_cone(self):
+        direction = np.array([1., 2., -1.]) / np.sqrt(6)
+        expected = np.nonzero(self.stars.dot(direction) > np.cos(0.3))[0]
+        np.testing.assert_array_equal(self.index.cone(direction, 0.3), expected)
+
+    def test_band(self):
+        pole = np.array([0.3, -0.2, 0.9])
+        pole /= np.linalg.norm(pole)
+        expected = np.nonzero(np.abs(self.stars.dot(pole)) <= np.sin(0.05))[0]
+        np.testing.assert_array_equal(self.index.band(pole, 0.05), expected)
+
+    def test_pairs(self):
+        directions = self.stars[:10]
+        rows, stars = self.index.pairs(directions, 0.1)
+        expected = np.nonzero(directions.dot(self.stars.T) > np.cos(0.1))
+        self.assertEqual(set(zip(rows, stars)), set(zip(*expected)))
+
+    def test_from_csv(self):
+        data = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+        index = SkyIndex.from_csv(os.path.join(data, 'gdr1set03.csv'))
+        self.assertGreater(len(index), 0)
+        np.testing.assert_allclose(np.linalg.norm(index.vectors, axis=1), 1.)
+        # The stars are in BCRS: the first one is at ra 55.88, dec 22.16 [deg].
+        direction = ft.xyz(np.radians(55.87979622773264), np.radians(22.15818737072371))
+        np.testing.assert_allclose(index.vectors[0], direction, atol=1e-15)
+        self.assertIn(0, index.cone(direction, 1e-6))
+        galactic = SkyIndex.from_csv(os.path.join(data, 'gdr1set01.csv'))
+        np.testing.assert_allclose(np.linalg.norm(galactic.vectors, axis=1), 1.)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Batched detection of star transits.
+
+Instead of looping over stars and attitude samples like Scanner.intercept and
+star_finder, the attitude samples are turned into rotation matrices once, and
+for a chunk of samples all the stars are rotated to SRS with one matrix
+product. The scanner conditions are then applied as boolean masks.
+With a SkyIndex of the stars, only the (sample, star) pairs close to the
+telescope axis are rotated and tested.
+
+solve_transits does not sample the transits at all: the along-scan field
+angle of a star changes sign when it crosses the telescope axis, so the
+crossings are bracketed between the samples of the attitude table and refined
+on the interpolated attitude.
+"""
+
+import collections
+
+import numpy as np
+
+from observation_table import ObservationTable
+from quaternion import QuaternionArray
+from sky_index import SkyIndex, field_radius
+
+Transits = collections.namedtuple('Transits', ['star_index', 'row', 'time'])
+Transits.__doc__ = """
+Star transits found in an attitude table, sorted by time.
+    star_index (np.ndarray): index of the star in the catalogue.
+    row (np.ndarray): index of the attitude sample in the table.
+    time (np.ndarray): time of the attitude sample [days].
+"""
+
+Crossings = collections.namedtuple('Crossings', ['star_index', 'time', 'across_scan'])
+Crossings.__doc__ = """
+Transits of stars through the telescope axis solved for their time, sorted by time.
+    star_index (np.ndarray): index of the star in the catalogue.
+    time (np.ndarray): time at which the along-scan field angle is zero [days].
+    across_scan (np.ndarray): across-scan field angle of the star at that time [rad].
+"""
+
+BracketGeometry = collections.namedtuple('BracketGeometry', ['step', 'xy'])
+BracketGeometry.__doc__ = """
+Geometry of the samples of an attitude table used by solve_transits, which depends
+on the table only and can be computed once for many calls (see bracket_geometry).
+    step (np.ndarray): (N - 1,) angles between consecutive telescope axes [rad].
+    xy (np.ndarray): (N, 2, 3) x and y rows of the rotation matrices of the samples.
+"""
+
+# Number of (sample, star) pairs processed at once.
+CHUNK_PAIRS = 2 ** 21
+
+
+def rotation_matrices(q):
+    """
+    Batched Quaternion.basis(): matrices A such that A.dot(v) = ft.srs(q, v).
+    Args:
+        q (np.ndarray): (N, 4) quaternions (w, x, y, z).
+    Returns:
+        np.ndarray: (N, 3, 3) rotation matrices.
+    """
+    return QuaternionArray(q).basis()
+
+
+def star_vectors(sky):
+    """
+    (S, 3) array of the unit vectors of the stars of a sky, an NSL.Sky or a SkyCatalog.
+    """
+    if hasattr(sky, 'vectors'):
+        return np.asarray(sky.vectors, dtype=np.float64).reshape(-1, 3)
+    return np.array([star.coor for star in sky.elements], dtype=np.float64).reshape(-1, 3)
+
+
+def intercept_mask(scanner, star_srs, x_srs):
+    """
+    Conditions of Scanner.intercept: star within the CCD width and the aperture.
+    Args:
+        scanner (Scanner): field of view.
+        star_srs (np.ndarray): (C, 3, S) star directions in SRS.
+        x_srs (np.ndarray): (C, 3) telescope axis in SRS.
+    Returns:
+        np.ndarray: (C, S) boolean mask.
+    """
+    x0, x1, x2 = (x_srs[:, k, None] for k in range(3))
+    width_angle = 2 * np.arctan2(scanner.ccd / 2, x0)
+    aperture_angle = 2 * np.arctan2(scanner.delta_z / 2, x0)
+    # arccos(a) < b is a > cos(b) for b in [0, pi]
+    xy = star_srs[:, 0] * x0 + star_srs[:, 1] * x1
+    xz = star_srs[:, 0] * x0 + star_srs[:, 2] * x2
+    return (xy > np.cos(width_angle)) & (xz > np.cos(aperture_angle))
+
+
+def transit_mask(scanner, star_srs, x_srs):
+    """
+    Conditions of star_finder: star within the aperture and the line of intercept.
+    Same arguments as intercept_mask.
+    """
+    x0, x1, x2 = (x_srs[:, k, None] for k in range(3))
+    aperture_angle = np.arctan2(scanner.delta_z / 2, x0)
+    cos_angle = star_srs[:, 0] * x0 + star_srs[:, 1] * x1 + star_srs[:, 2] * x2
+    return ((cos_angle > np.cos(aperture_angle))
+            & (np.abs(star_srs[:, 2] - x2) < scanner.delta_z)
+            & (np.abs(star_srs[:, 1] - x1) < scanner.delta_y))
+
+
+def find_transits(scanner, table, stars, mask=transit_mask, chunk_size=None):
+    """
+    Finds the (star, attitude sample) pairs satisfying the conditions of mask.
+
+    Args:
+        scanner (Scanner): field of view.
+        table (AttitudeTable): attitude samples, e.g. att.storage.
+        stars (np.ndarray or SkyIndex): (S, 3) unit vectors of the stars in BCRS, or
+            their SkyIndex to only test the stars near the telescope axis.
+        mask (function): intercept_mask or transit_mask.
+        chunk_size (int): attitude samples per chunk, by default about CHUNK_PAIRS pairs.
+    Returns:
+        Transits: star indexes, attitude rows and times, sorted by time.
+    """
+    if isinstance(stars, SkyIndex):
+        return _find_indexed_transits(scanner, table, stars, mask, chunk_size)
+    stars = np.asarray(stars, dtype=np.float64).reshape(-1, 3)
+    n_stars = stars.shape[0]
+    if chunk_size is None:
+        chunk_size = max(CHUNK_PAIRS // max(n_stars, 1), 1)
+
+    rows, star_index = [], []
+    stars_t = np.ascontiguousarray(stars.T)
+    for start in range(0, len(table), chunk_size):
+        stop = min(start + chunk_size, len(table))
+        A = rotation_matrices(table.q[start:stop])
+        x_srs = np.einsum('nij,nj->ni', A, table.x[start:stop])
+        star_srs = (A.reshape(-1, 3) @ stars_t).reshape(stop - start, 3, n_stars)
+        chunk_rows, chunk_stars = np.nonzero(mask(scanner, star_srs, x_srs))
+        rows.append(chunk_rows + start)
+        star_index.append(chunk_stars)
+
+    return _sorted_transits(table, rows, star_index)
+
+
+def _find_indexed_transits(scanner, table, index, mask, chunk_size):
+    """
+    find_transits on the pairs of attitude samples and stars within field_radius
+    of the telescope axis.
+    """
+    radius = field_radius(scanner)
+    if chunk_size is None:
+        chunk_size = _indexed_chunk_size(index, radius)
+
+    rows, star_index = [], []
+    for start in range(0, len(table), chunk_size):
+        stop = min(start + chunk_size, len(table))
+        pair_rows, pair_stars = index.pairs(table.x[start:stop], radius)
+        if len(pair_rows) == 0:
+            continue
+        A = rotation_matrices(table.q[start:stop])
+        x_srs = np.einsum('nij,nj->ni', A, table.x[start:stop])
+        star_srs = np.einsum('pij,pj->pi', A[pair_rows], index.vectors[pair_stars])
+        # Each pair is a chunk of one sample and one star for the mask.
+        selected = mask(scanner, star_srs[:, :, None], x_srs[pair_rows])[:, 0]
+        # Pairs come by sample, then star as in the brute force search.
+        order = np.lexsort((pair_stars[selected], pair_rows[selected]))
+        rows.append(pair_rows[selected][order] + start)
+        star_index.append(pair_stars[selected][order])
+
+    return _sorted_transits(table, rows, star_index)
+
+
+def _indexed_chunk_size(index, radius):
+    """
+    Attitude samples per chunk for about CHUNK_PAIRS pairs closer than radius,
+    for stars spread uniformly on the sky.
+    """
+    pairs_per_sample = len(index) * (1 - np.cos(min(radius, np.pi))) / 2
+    return int(max(CHUNK_PAIRS // max(pairs_per_sample, 1), 1))
+
+
+def _sorted_transits(table, rows, star_index):
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+    star_index = np.concatenate(star_index) if star_index else np.empty(0, dtype=np.intp)
+    order = np.argsort(table.t[rows], kind='stable')
+    return Transits(star_index[order], rows[order], table.t[rows[order]])
+
+
+def scan_sky(scanner, att, sky, deep_dt=0.001, chunk_size=None, indexed=True):
+    """
+    Batched star_finder: finds the candidate transits of every star of the sky in the
+    attitude storage, refines the attitude around them as Scanner.deep_scan does,
+    and finds the transits through the line of intercept.
+
+    Args:
+        scanner (Scanner): scanner, its obs_times, stars_positions and observations are filled.
+        att (Attitude): attitude, refined around the candidates.
+        sky (Sky): sky to be scanned.
+        deep_dt (float): step of the refined attitude [days].
+        chunk_size (int): attitude samples per chunk.
+        indexed (bool): prune the stars with a SkyIndex, for large skies.
+    Returns:
+        Transits: the transits of all the stars, rows refer to att.storage.
+    """
+    vectors = star_vectors(sky)
+    stars = SkyIndex(vectors) if indexed else vectors
+    candidates = find_transits(scanner, att.storage, stars, intercept_mask, chunk_size)
+    scanner.times_deep_scan = list(np.unique(candidates.time))
+    scanner.deep_scan(att, deep_dt)
+
+    storage = att.storage
+    transits = find_transits(scanner, storage, stars, transit_mask, chunk_size)
+
+    # ft.bcrs of the telescope axis in SRS, i.e. A^T A x
+    A = rotation_matrices(storage.q[transits.row])
+    x_srs = np.einsum('nij,nj->ni', A, storage.x[transits.row])
+    positions = np.einsum('nji,nj->ni', A, x_srs)
+    scanner.obs_times = list(transits.time)
+    scanner.stars_positions = list(positions)
+    along_scan, across_scan = field_angles(storage.q[transits.row], vectors[transits.star_index])
+    scanner.observations = ObservationTable(transits.star_index, transits.time, along_scan, across_scan,
+                                            positions, transits.row)
+    return transits
+
+
+def field_angles(q, stars):
+    """
+    Field angles of stars in SRS, the telescope axis being x.
+    Args:
+        q (np.ndarray): (N, 4) attitude quaternions.
+        stars (np.ndarray): (N, 3) unit vectors of the stars in BCRS.
+    Returns:
+        (np.ndarray, np.ndarray): along-scan and across-scan angles [rad].
+    """
+    s = np.einsum('nij,nj->ni', rotation_matrices(q), stars)
+    return np.arctan2(s[:, 1], s[:, 0]), np.arctan2(s[:, 2], np.hypot(s[:, 0], s[:, 1]))
+
+
+def attitude_function(att):
+    """
+    Attitude quaternions as a function of time: the dense output of att.solution
+    when it covers all of att.storage, else SLERP between the samples of att.storage.
+    The solution is that of the last integration only, so it does not cover a storage
+    extended by another create_storage or left from before an iter_storage.
+    """
+    if att.solution is not None and len(att.storage) and att.solution.covers(att.storage.t[[0, -1]]):
+        return lambda times: att.solution.quaternions(att.solution.state(times))
+    return att.storage.attitude_at
+
+
+def _axis_steps(table):
+    """
+    Angles between the telescope axes of consecutive samples of a table [rad].
+    """
+    return np.arccos(np.clip(np.sum(table.x[1:] * table.x[:-1], axis=1), -1., 1.))
+
+
+def bracket_geometry(table, chunk_size=2 ** 16):
+    """
+    BracketGeometry of the samples of an attitude table, computed chunk by chunk.
+    """
+    step = _axis_steps(table)
+    xy = np.empty((len(table), 2, 3))
+    for start in range(0, len(table), chunk_size):
+        stop = min(start + chunk_size, len(table))
+        xy[start:stop] = rotation_matrices(table.q[start:stop])[:, :2]
+    return BracketGeometry(step, xy)
+
+
+def _illinois(f, a, b, fa, fb, xtol, max_iterations):
+    """
+    Vectorised regula falsi with the Illinois modification: refines all the
+    brackets [a, b] of sign changes of f at once.
+    Args:
+        f (function): f(times, active) of the brackets with indexes active.
+    """
+    a, b, fa, fb = a.copy(), b.copy(), fa.copy(), fb.copy()
+    c = np.full_like(a, np.nan)
+    side = np.zeros(len(a), dtype=np.int8)
+    active = np.arange(len(a))
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        new = (a[active] * fb[active] - b[active] * fa[active]) / (fb[active] - fa[active])
+        converged = np.abs(new - c[active]) < xtol
+        c[active] = new
+        fc = f(new, active)
+
+        # The root is in [a, c]: c replaces b, and f(a) is halved if b was also kept last time.
+        left = fc * fb[active] > 0
+        i = active[left]
+        b[i], fb[i] = c[i], fc[left]
+        fa[i[side[i] == -1]] /= 2
+        side[i] = -1
+        right = fc * fa[active] > 0
+        i = active[right]
+        a[i], fa[i] = c[i], fc[right]
+        fb[i[side[i] == 1]] /= 2
+        side[i] = 1
+
+        converged |= (fc == 0) | (np.abs(b[active] - a[active]) < xtol)
+        active = active[~converged]
+    return c
+
+
+def solve_transits(scanner, att, stars, xtol=1e-10, max_iterations=50, chunk_size=None, geometry=None):
+    """
+    Times at which the stars cross the telescope axis within the aperture of star_finder.
+
+    The along-scan angle of every star near the telescope axis is evaluated at the
+    samples of att.storage; a sign change with the star in front of the telescope
+    brackets a transit, which is then solved with regula falsi on the interpolated
+    attitude (see attitude_function).
+
+    Args:
+        scanner (Scanner): field of view, the across-scan angle must be within
+            the aperture arctan(delta_z/2) of star_finder.
+        att (Attitude): attitude, left unchanged.
+        stars (np.ndarray or SkyIndex): (S, 3) unit vectors of the stars in BCRS.
+        xtol (float): tolerance on the transit times [days].
+        max_iterations (int): maximum number of refinements of a bracket.
+        chunk_size (int): attitude samples per chunk, by default about CHUNK_PAIRS pairs.
+        geometry (BracketGeometry): bracket_geometry(att.storage), computed chunk by
+            chunk if None. Pass it when solving many parts of a catalogue on the same attitude.
+    Returns:
+        Crossings: the transits sorted by time.
+    """
+    index = stars if isinstance(stars, SkyIndex) else SkyIndex(stars)
+    table = att.storage
+    attitude = attitude_function(att)
+    aperture = np.arctan2(scanner.delta_z / 2, 1.)
+
+    # Along-scan motion of the axis to the next sample, plus the aperture, bounds
+    # the distance to the axis of the stars crossing it before that sample.
+    step = geometry.step if geometry is not None else _axis_steps(table)
+    radius = step + aperture + 1e-3
+    if chunk_size is None:
+        chunk_size = _indexed_chunk_size(index, radius.mean())
+
+    star_index, time, across_scan = [], [], []
+    for start in range(0, len(table) - 1, chunk_size):
+        stop = min(start + chunk_size, len(table) - 1)
+        rows, pair_stars = index.pairs(table.x[start:stop], radius[start:stop])
+        # Only the x and y rows of the rotation matrices are needed for the brackets.
+        if geometry is not None:
+            A = np.asarray(geometry.xy[start:stop + 1])
+        else:
+            A = rotation_matrices(table.q[start:stop + 1])[:, :2]
+        v = index.vectors[pair_stars]
+        s0 = np.einsum('pij,pj->pi', A[rows], v)
+        s1 = np.einsum('pij,pj->pi', A[rows + 1], v)
+        # A root on a sample belongs to the interval ending there.
+        crossing = (((s0[:, 1] < 0) & (s1[:, 1] >= 0)) | ((s0[:, 1] > 0) & (s1[:, 1] <= 0)))
+        crossing &= (s0[:, 0] > 0) & (s1[:, 0] > 0)
+        rows = rows[crossing] + start
+        vectors = v[crossing]
+
+        def along_scan(times, active):
+            return np.einsum('pij,pj->pi', rotation_matrices(attitude(times))[:, 1:2], vectors[active])[:, 0]
+
+        roots = _illinois(along_scan, table.t[rows], table.t[rows + 1], s0[crossing, 1], s1[crossing, 1],
+                          xtol, max_iterations)
+        eta = field_angles(attitude(roots), vectors)[1]
+        inside = np.abs(eta) < aperture
+        star_index.append(pair_stars[crossing][inside])
+        time.append(roots[inside])
+        across_scan.append(eta[inside])
+
+    if not time:
+        return Crossings(np.empty(0, dtype=np.intp), np.empty(0), np.empty(0))
+    star_index, time, across_scan = (np.concatenate(column) for column in (star_index, time, across_scan))
+    order = np.argsort(time, kind='stable')
+    return Crossings(star_index[order], time[order], across_scan[order])